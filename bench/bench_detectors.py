@@ -0,0 +1,209 @@
+# bench/bench_detectors.py
+# 离线 detector 基准：对 bench/corpus 里保存的商品页（有货 / 售罄 / 删除 / 验证码墙）
+# 逐页测 解析+判定 耗时、峰值内存、判定是否与 manifest 里的期望一致。不访问任何线上站点。
+#
+# 语料分两组，分开统计：
+#   real       bench/corpus/<site>/        用 record_page.py 录下的真实页面（判定准确率与耗时以这组为准）
+#   synthetic  bench/corpus/synthetic/     手写的冒烟页面：只有判定用的文案加填充，耗时参考意义不大
+# expect 是页面的真实状态（人工确认），不是当前 detector 的输出；已知判错的页面标 known_miss: true，
+# 照样计入准确率并打印 MISS，但不让退出码变成 1。known_miss 的页面判对了会打印 FIXED，提醒去掉标记。
+#
+#   python bench/bench_detectors.py                        # 当前工作区
+#   python bench/bench_detectors.py --site amazon -n 50    # 只跑一个站点，每页 50 次
+#   python bench/bench_detectors.py --json out.json        # 保存结果
+#   python bench/bench_detectors.py --compare out.json     # 与保存的结果对比
+#   python bench/bench_detectors.py --rev HEAD~3           # 与某个 git 版本的 detectors/ 对比（同一份语料）
+#
+# 往语料里加真实页面：python bench/record_page.py <url> <site> <label> <expect>
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tarfile
+import subprocess
+import importlib
+import tracemalloc
+import contextlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+CORPUS = os.path.join(HERE, "corpus")
+KINDS = ("real", "synthetic")
+
+
+def load_manifest(site=None) -> list:
+    with open(os.path.join(CORPUS, "manifest.json"), encoding="utf-8") as f:
+        entries = json.load(f)
+    return [e for e in entries if site is None or e["site"] == site]
+
+
+def kind_of(entry: dict) -> str:
+    return "synthetic" if entry["file"].startswith("synthetic/") else "real"
+
+
+def _detector(site: str):
+    """site -> html(str) -> status；mercari.detect 返回 (status, trigger)，只取 status。"""
+    mod = importlib.import_module(f"detectors.{site}")
+
+    def run(html):
+        res = mod.detect(html)
+        return res[0] if isinstance(res, tuple) else res
+    return run
+
+
+def _pct(sorted_vals, q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(len(sorted_vals) * q))]
+
+
+def bench_page(detect, html: str, repeat: int) -> dict:
+    # 每次调用都给一个新的 str 对象，避免 detectors.parsed 的单槽缓存让后续调用跳过解析
+    copies = [("." + html)[1:] for _ in range(repeat + 1)]
+    quiet = io.StringIO()
+    with contextlib.redirect_stdout(quiet):
+        status = detect(copies[0])   # 预热 + 取判定结果
+
+        times = []
+        for html_copy in copies[1:]:
+            t0 = time.perf_counter()
+            detect(html_copy)
+            times.append((time.perf_counter() - t0) * 1000)
+
+        fresh = ("." + html)[1:]
+        tracemalloc.start()
+        detect(fresh)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    times.sort()
+    return {
+        "status": status,
+        "mean_ms": sum(times) / len(times),
+        "p50_ms": _pct(times, 0.5),
+        "p95_ms": _pct(times, 0.95),
+        "peak_kb": peak / 1024,
+        "bytes": len(html.encode("utf-8")),
+    }
+
+
+def run(site=None, repeat: int = 20) -> dict:
+    results = {}
+    detectors = {}
+    for e in load_manifest(site):
+        if e["site"] not in detectors:
+            detectors[e["site"]] = _detector(e["site"])
+        with open(os.path.join(CORPUS, e["file"]), encoding="utf-8") as f:
+            html = f.read()
+        r = bench_page(detectors[e["site"]], html, repeat)
+        r.update(site=e["site"], label=e["label"], kind=kind_of(e), expect=e["expect"],
+                 ok=(r["status"] == e["expect"]), known_miss=bool(e.get("known_miss")))
+        results[e["file"]] = r
+    return results
+
+
+def summarize(results: dict) -> dict:
+    """(kind, site) -> 汇总；真实页面和合成页面不混在一起算。"""
+    by_site = {}
+    for r in results.values():
+        s = by_site.setdefault((r.get("kind", "synthetic"), r["site"]), {"pages": 0, "correct": 0, "mean_ms": 0.0, "p95_ms": 0.0, "peak_kb": 0.0})
+        s["pages"] += 1
+        s["correct"] += int(r["ok"])
+        s["mean_ms"] += r["mean_ms"]
+        s["p95_ms"] = max(s["p95_ms"], r["p95_ms"])
+        s["peak_kb"] = max(s["peak_kb"], r["peak_kb"])
+    for s in by_site.values():
+        s["mean_ms"] /= s["pages"]
+    return by_site
+
+
+def print_report(results: dict, title: str = ""):
+    if title:
+        print(f"== {title}")
+    summary = summarize(results)
+    for kind in KINDS:
+        rows = sorted((site, s) for (k, site), s in summary.items() if k == kind)
+        if not rows:
+            print(f"[{kind}] no pages (add real captures with bench/record_page.py)")
+            continue
+        print(f"[{kind}]")
+        print(f"{'site':<10} {'pages':>5} {'acc':>7} {'mean ms':>9} {'p95 ms':>8} {'peak KB':>9}")
+        for site, s in rows:
+            print(f"{site:<10} {s['pages']:>5} {s['correct']:>3}/{s['pages']:<3} "
+                  f"{s['mean_ms']:>9.3f} {s['p95_ms']:>8.3f} {s['peak_kb']:>9.0f}")
+    for k, r in sorted(results.items()):
+        if not r["ok"]:
+            known = " (known_miss)" if r.get("known_miss") else ""
+            print(f"  MISS {k}: got {r['status']} expected {r['expect']}{known}")
+        elif r.get("known_miss"):
+            print(f"  FIXED {k}: now {r['status']} as expected; drop known_miss from manifest.json")
+
+
+def print_compare(base: dict, new: dict, base_name: str = "base", new_name: str = "new"):
+    print(f"== compare {base_name} -> {new_name}")
+    print(f"{'kind':<9} {'site':<10} {'acc':>13} {'mean ms':>21} {'speedup':>8} {'peak KB':>15}")
+    sb, sn = summarize(base), summarize(new)
+    for key in sorted(set(sb) | set(sn)):
+        b, n = sb.get(key), sn.get(key)
+        if not b or not n:
+            print(f"{key[0]:<9} {key[1]:<10} (only in {'new' if n else 'base'})")
+            continue
+        speed = b["mean_ms"] / n["mean_ms"] if n["mean_ms"] else float("inf")
+        print(f"{key[0]:<9} {key[1]:<10} {b['correct']:>3}/{b['pages']:<2} -> {n['correct']:>2}/{n['pages']:<2} "
+              f"{b['mean_ms']:>9.3f} -> {n['mean_ms']:<8.3f} {speed:>7.2f}x "
+              f"{b['peak_kb']:>6.0f} -> {n['peak_kb']:<6.0f}")
+    for k in sorted(set(base) & set(new)):
+        if base[k]["status"] != new[k]["status"]:
+            print(f"  CHANGED {k}: {base[k]['status']} -> {new[k]['status']} (expected {new[k]['expect']})")
+
+
+def run_rev(rev: str, site, repeat: int) -> dict:
+    """把某个 git 版本的 detectors/ 解到临时目录，用子进程跑同一份语料。"""
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = subprocess.run(["git", "-C", REPO, "archive", rev, "detectors"],
+                                 check=True, capture_output=True).stdout
+        with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+            tar.extractall(tmp)
+        out = os.path.join(tmp, "result.json")
+        cmd = [sys.executable, os.path.abspath(__file__), "--root", tmp, "-n", str(repeat), "--json", out, "--quiet"]
+        if site:
+            cmd += ["--site", site]
+        subprocess.run(cmd, check=True)
+        with open(out, encoding="utf-8") as f:
+            return json.load(f)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="offline detector benchmark")
+    ap.add_argument("--site", help="only this site (amazon/yahoo/yshopping/rakuten/dorasuta/mercari)")
+    ap.add_argument("-n", "--repeat", type=int, default=20, help="timed calls per page (default 20)")
+    ap.add_argument("--json", help="save results to this file")
+    ap.add_argument("--compare", help="compare with results saved by --json")
+    ap.add_argument("--rev", help="compare with detectors/ at this git revision")
+    ap.add_argument("--root", help=argparse.SUPPRESS)
+    ap.add_argument("--quiet", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    sys.path.insert(0, args.root or REPO)
+    results = run(args.site, args.repeat)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=1)
+    if args.quiet:
+        return 0
+
+    print_report(results, "working tree")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_compare(json.load(f), results, os.path.basename(args.compare), "working tree")
+    if args.rev:
+        print_compare(run_rev(args.rev, args.site, args.repeat), results, args.rev, "working tree")
+    # 已知判错（known_miss）不算失败，新出现的判错才算
+    return 0 if all(r["ok"] or r["known_miss"] for r in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+# bench/record_page.py
+# 把一个线上商品页保存进基准语料，并登记到 manifest.json：
+#   python bench/record_page.py <url> <site> <label> <expect>
+#   例：python bench/record_page.py https://jp.mercari.com/item/m123 mercari sold_out_2 SOLD_OUT
+# 抓取方式跟随 FETCH_MODE（mercari 页面需要 FETCH_MODE=PLAYWRIGHT 才有渲染后的内容）。
+# expect 是人工确认过的正确状态（不是 detector 当前的输出）；同名 label 会覆盖旧文件。
+# 页面存到 bench/corpus/<site>/，bench_detectors.py 把它算进 real 组；提交前检查并去掉买家/卖家名等个人信息。
+import os
+import sys
+import json
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from fetcher import fetch  # noqa: E402
+from sites import SITE_NAMES  # noqa: E402
+
+CORPUS = os.path.join(HERE, "corpus")
+
+
+def main(argv):
+    if len(argv) != 4:
+        print("usage: python bench/record_page.py <url> <site> <label> <expect>")
+        return 2
+    url, site, label, expect = argv
+    if site not in SITE_NAMES:
+        print(f"unknown site {site!r}, expected one of {SITE_NAMES}")
+        return 2
+
+    code, html = fetch(url)
+    if code == 0:
+        print(f"fetch failed: {html[:200]}")
+        return 1
+
+    rel = f"{site}/{label}.html"
+    os.makedirs(os.path.join(CORPUS, site), exist_ok=True)
+    with open(os.path.join(CORPUS, rel), "w", encoding="utf-8") as f:
+        f.write(html)
+
+    path = os.path.join(CORPUS, "manifest.json")
+    with open(path, encoding="utf-8") as f:
+        entries = [e for e in json.load(f) if e["file"] != rel]
+    entries.append({
+        "file": rel, "site": site, "label": label, "expect": expect,
+        "source": url, "http": code, "recorded": time.strftime("%Y-%m-%d"),
+    })
+    entries.sort(key=lambda e: e["file"])
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(entries, f, ensure_ascii=False, indent=1)
+    print(f"saved {rel} ({len(html)} chars, HTTP {code}), expect={expect}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
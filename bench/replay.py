@@ -0,0 +1,341 @@
+# bench/replay.py
+# 端到端回放：不访问任何线上服务，测整条流水线（读表 → 抓页 → 判定 → 状态库 → eBay 批量清零 → 通知）的吞吐。
+# 本进程起一个本地 HTTP 服务，同时充当：
+#   - 商品站点：按 URL 里的 label 返回 bench/corpus/synthetic 里的页面（gone = 404），可注入延迟 / 5xx
+#   - eBay Trading API：解析 ReviseInventoryStatus 请求，回显每个 <InventoryStatus>（Ack=Success），可注入 5xx
+#   - Telegram Bot API：sendMessage 返回 ok，可注入 429（retry_after）
+# 再用合成的台账（10k–100k 行）替换 read_ledger，调用 main_all.run_once，最后打印 rows/s 与各端点计数。
+#
+#   python bench/replay.py                           # 10000 行，全部站点（mercari 只用免渲染能判定的页面）
+#   python bench/replay.py -n 100000 --latency 20 --jitter 10 --error-rate 0.01
+#   python bench/replay.py --sites amazon,yahoo --ebay-error-rate 0.05 --tg-429-rate 0.02
+#   python bench/replay.py --ebay-latency 800         # eBay 很慢时，看流水线（pipeline.py）是否还卡住抓取
+#   python bench/replay.py --ledger-csv out.csv      # 同时把合成台账存下来
+#
+# 状态库 / HTTP 缓存 / 发件箱都放在临时目录；测第二轮的跳过 / 304 效果时用 --state-dir 加固定 --port
+# （URL 里带端口，换端口就是另一批商品）。
+# 各站点逐行日志默认丢弃（打印本身也很慢），--verbose 保留。
+import os
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+import contextlib
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from xml.sax.saxutils import escape
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+CORPUS = os.path.join(HERE, "corpus")
+sys.path.insert(0, REPO)
+
+# 合成台账里各 label 的比例；gone = 服务端直接 404
+MIX = {"in_stock": 0.70, "sold_out": 0.20, "deleted": 0.05, "gone": 0.05}
+# mercari 的 deleted / botwall 页面需要浏览器渲染才能判定，回放里不用；
+# 404（gone）也要渲染确认后才按删除处理（快速路径不认非浏览器拿到的 404），同样不用
+MERCARI_MIX = {"in_stock": 0.75, "sold_out": 0.25}
+# URL 里带上真实域名，sites.classify / ledger.select 才能照常分流
+SITE_HOSTS = {
+    "mercari": "jp.mercari.com",
+    "amazon": "amazon.co.jp",
+    "yshopping": "shopping.yahoo.co.jp",
+    "yahoo": "auctions.yahoo.co.jp",
+    "dorasuta": "dorasuta.jp",
+    "rakuten": "item.rakuten.co.jp",
+}
+
+_EBAY_OK = """<?xml version="1.0" encoding="UTF-8"?>
+<ReviseInventoryStatusResponse xmlns="urn:ebay:apis:eBLBaseComponents">
+<Timestamp>{ts}</Timestamp>
+<Ack>Success</Ack>
+<Version>1193</Version>
+<Build>E1193_CORE_APIINVENTORY_19146280_R1</Build>
+{items}
+</ReviseInventoryStatusResponse>"""
+
+_EBAY_ITEM = "<InventoryStatus>{key}<ItemID>{item_id}</ItemID><Quantity>{qty}</Quantity></InventoryStatus>"
+
+
+def load_pages() -> dict:
+    """(site, label) -> (body bytes, etag)；只用 synthetic/ 冒烟语料，MIX 里的 label 与它一一对应。"""
+    with open(os.path.join(CORPUS, "manifest.json"), encoding="utf-8") as f:
+        entries = json.load(f)
+    pages = {}
+    for e in entries:
+        if not e["file"].startswith("synthetic/"):
+            continue
+        with open(os.path.join(CORPUS, e["file"]), "rb") as f:
+            body = f.read()
+        pages[(e["site"], e["label"])] = (body, '"%s"' % hashlib.sha1(body).hexdigest()[:16])
+    return pages
+
+
+class Replay:
+    """本地替身服务的配置与计数（Handler 通过 server.replay 访问）。"""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0,
+                 ebay_error_rate=0.0, tg_429_rate=0.0, seed=0, ebay_latency_ms=0.0):
+        self.pages = load_pages()
+        self.site_by_host = {h: s for s, h in SITE_HOSTS.items()}
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.ebay_error_rate = ebay_error_rate
+        self.tg_429_rate = tg_429_rate
+        self.ebay_latency_ms = ebay_latency_ms
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def count(self, key: str, n: int = 1):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + n
+
+    def roll(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self.lock:
+            return self.rng.random() < rate
+
+    def delay(self):
+        if self.latency_ms <= 0 and self.jitter_ms <= 0:
+            return
+        with self.lock:
+            ms = self.latency_ms + self.rng.uniform(-self.jitter_ms, self.jitter_ms)
+        if ms > 0:
+            time.sleep(ms / 1000)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 头和正文分两次写，不关 Nagle 的话 keep-alive 下每个响应都要多等 ~40ms 的延迟 ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code: int, body: bytes, ctype: str, headers=None):
+        self.send_response(code)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    # ---------- 商品页：/<host>/item/<n>?label=<label> ----------
+    def do_GET(self):
+        rp = self.server.replay
+        parts = urlsplit(self.path)
+        host = parts.path.strip("/").split("/", 1)[0]
+        site = rp.site_by_host.get(host)
+        label = (parse_qs(parts.query).get("label") or [""])[0]
+        rp.delay()
+
+        if site is None:
+            rp.count("page_404")
+            return self._send(404, b"not found", "text/plain")
+        if rp.roll(rp.error_rate):
+            rp.count("page_5xx")
+            return self._send(503, b"<html><body>Service Unavailable</body></html>", "text/html")
+        if label == "gone":
+            rp.count("page_404")
+            return self._send(404, b"<html><body>404 Not Found</body></html>", "text/html")
+        page = rp.pages.get((site, label))
+        if page is None:
+            rp.count("page_404")
+            return self._send(404, b"unknown label", "text/plain")
+
+        body, etag = page
+        if self.headers.get("If-None-Match") == etag:
+            rp.count("page_304")
+            return self._send(304, b"", "text/html; charset=utf-8", {"ETag": etag})
+        rp.count("page_200")
+        return self._send(200, body, "text/html; charset=utf-8", {"ETag": etag})
+
+    def do_POST(self):
+        rp = self.server.replay
+        n = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(n).decode("utf-8", "replace") if n else ""
+        path = urlsplit(self.path).path
+        if path.startswith("/ebay/"):
+            return self._ebay(rp, data)
+        if path.startswith("/tg/"):
+            return self._telegram(rp, data)
+        rp.count("post_404")
+        return self._send(404, b"not found", "text/plain")
+
+    # ---------- eBay：ReviseInventoryStatus ----------
+    def _ebay(self, rp, data: str):
+        rp.delay()
+        if rp.ebay_latency_ms > 0:
+            time.sleep(rp.ebay_latency_ms / 1000)
+        if rp.roll(rp.ebay_error_rate):
+            rp.count("ebay_5xx")
+            return self._send(503, b"Service Unavailable", "text/plain")
+        items = []
+        for block in re.findall(r"<InventoryStatus>(.*?)</InventoryStatus>", data, re.S):
+            sku = re.search(r"<SKU>(.*?)</SKU>", block, re.S)
+            item = re.search(r"<ItemID>(.*?)</ItemID>", block, re.S)
+            qty = re.search(r"<Quantity>(.*?)</Quantity>", block, re.S)
+            # 按 SKU 改时响应里回显 SKU + 该 SKU 所属的 ItemID，这里用 SKU 的哈希凑一个
+            key = f"<SKU>{sku.group(1)}</SKU>" if sku else ""
+            item_id = item.group(1) if item else str(int(hashlib.sha1(sku.group(1).encode()).hexdigest()[:10], 16))
+            items.append(_EBAY_ITEM.format(key=key, item_id=escape(item_id), qty=qty.group(1) if qty else "0"))
+        rp.count("ebay_calls")
+        rp.count("ebay_items", len(items))
+        body = _EBAY_OK.format(ts=time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()), items="\n".join(items))
+        return self._send(200, body.encode("utf-8"), "text/xml")
+
+    # ---------- Telegram：sendMessage ----------
+    def _telegram(self, rp, data: str):
+        if rp.roll(rp.tg_429_rate):
+            rp.count("tg_429")
+            body = {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1}}
+            return self._send(429, json.dumps(body).encode(), "application/json")
+        rp.count("tg_messages")
+        try:
+            text = json.loads(data).get("text", "")
+        except ValueError:
+            text = ""
+        rp.count("tg_chars", len(text))
+        body = {"ok": True, "result": {"message_id": rp.counts.get("tg_messages", 0), "text": text[:64]}}
+        return self._send(200, json.dumps(body).encode(), "application/json")
+
+
+def start_server(replay: Replay, port: int = 0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    server.replay = replay
+    threading.Thread(target=server.serve_forever, name="replay-server", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def synth_ledger(n: int, base: str, sites, seed: int = 0):
+    """合成 n 行台账（source_url / ebay_item_id / sku / trigger），站点均匀轮转、label 按 MIX 抽样。"""
+    import pandas as pd
+
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n):
+        site = sites[i % len(sites)]
+        mix = MERCARI_MIX if site == "mercari" else MIX
+        label = rng.choices(list(mix), weights=list(mix.values()))[0]
+        rows.append({
+            "source_url": f"{base}/{SITE_HOSTS[site]}/item/{i}?label={label}",
+            "ebay_item_id": str(110000000000 + i) if i % 3 else "",
+            "sku": f"RP-{site[:3].upper()}-{i:06d}" if i % 3 != 1 else "",
+            "trigger": "" if i % 10 else "manual",
+        })
+    return pd.DataFrame(rows, columns=["source_url", "ebay_item_id", "sku", "trigger"])
+
+
+def _configure_env(base: str, state_dir: str):
+    # 端点 / 凭据 / 状态库一律指向本地；其余调优项保留调用方的设置
+    os.environ.update({
+        "EBAY_ENDPOINT": f"{base}/ebay/ws/api.dll",
+        "TG_API": base + "/tg/bot{token}/{method}",
+        "EBAY_AUTH_TOKEN": "replay-token",
+        "EBAY_DEV_ID": "replay", "EBAY_APP_ID": "replay", "EBAY_CERT_ID": "replay",
+        "TELEGRAM_BOT_TOKEN": "replay", "TELEGRAM_CHAT_ID": "1",
+        "DRY_RUN": "false",
+        "STATE_DB": os.path.join(state_dir, "listings.db"),
+        "HTTP_CACHE_DB": os.path.join(state_dir, "http_cache.db"),
+        "NOTIFY_OUTBOX_DB": os.path.join(state_dir, "outbox.db"),
+        "NO_PROXY": "127.0.0.1,localhost",
+    })
+    for k in ("GITHUB_REPOSITORY", "GITHUB_RUN_ID"):
+        os.environ.pop(k, None)
+    os.environ.setdefault("METRICS_FILE", os.path.join(state_dir, "metrics.jsonl"))
+    os.environ.setdefault("FETCH_MODE", "REQUESTS")
+    os.environ.setdefault("NOTIFY_MIN_INTERVAL", "0")
+    os.environ.setdefault("EBAY_BACKOFF_BASE", "0.05")
+    # 所有替身站点都在 127.0.0.1 上，共用一个令牌桶；测吞吐时默认不限速，测限速时显式设 RATE_LIMIT=true
+    os.environ.setdefault("RATE_LIMIT", "false")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="end-to-end replay against local stand-ins")
+    ap.add_argument("-n", "--rows", type=int, default=10000, help="synthetic ledger rows (default 10000)")
+    ap.add_argument("--sites", default=",".join(SITE_HOSTS), help="comma-separated site names")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--latency", type=float, default=0.0, help="per-request latency in ms")
+    ap.add_argument("--jitter", type=float, default=0.0, help="± latency jitter in ms")
+    ap.add_argument("--ebay-latency", type=float, default=0.0, help="extra latency in ms for eBay calls only")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="fraction of page requests answered 503")
+    ap.add_argument("--ebay-error-rate", type=float, default=0.0, help="fraction of eBay calls answered 503")
+    ap.add_argument("--tg-429-rate", type=float, default=0.0, help="fraction of Telegram calls answered 429")
+    ap.add_argument("--state-dir", help="keep state/cache/outbox DBs here (default: fresh temp dir)")
+    ap.add_argument("--port", type=int, default=0, help="fixed server port (URLs are keyed by it; use with --state-dir)")
+    ap.add_argument("--ledger-csv", help="also save the synthetic ledger to this CSV")
+    ap.add_argument("--verbose", action="store_true", help="keep per-row logs")
+    args = ap.parse_args(argv)
+
+    sites = [s.strip() for s in args.sites.split(",") if s.strip()]
+    unknown = [s for s in sites if s not in SITE_HOSTS]
+    if unknown:
+        print(f"unknown sites: {unknown}, expected {list(SITE_HOSTS)}")
+        return 2
+
+    replay = Replay(args.latency, args.jitter, args.error_rate, args.ebay_error_rate, args.tg_429_rate, args.seed,
+                    args.ebay_latency)
+    server, base = start_server(replay, args.port)
+
+    tmp = None
+    state_dir = args.state_dir
+    if not state_dir:
+        tmp = tempfile.TemporaryDirectory(prefix="replay-")
+        state_dir = tmp.name
+    _configure_env(base, state_dir)
+    os.environ["RUN_SITES"] = ",".join(sites)
+
+    t0 = time.perf_counter()
+    df = synth_ledger(args.rows, base, sites, args.seed)
+    gen_s = time.perf_counter() - t0
+    if args.ledger_csv:
+        df.to_csv(args.ledger_csv, index=False)
+
+    import main_all
+    import outbox
+    import ledger
+    main_all.read_ledger = lambda: df
+    # SHARD_INDEX/SHARD_COUNT 设了的话本进程只跑其中一片，rows/s 按实际处理的行数算
+    _, shard_count = ledger.shard_spec()
+    rows = len(ledger.prepare(df)) if shard_count > 1 else args.rows
+
+    log = open(os.devnull, "w") if not args.verbose else None
+    with contextlib.redirect_stdout(log) if log else contextlib.nullcontext():
+        t0 = time.perf_counter()
+        main_all.run_once()
+        run_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        left = outbox.drain()
+        drain_s = time.perf_counter() - t0
+    if log:
+        log.close()
+    server.shutdown()
+
+    c = replay.counts
+    print(f"[REPLAY] sites={','.join(sites)} rows={rows} of {args.rows} ledger_gen={gen_s:.2f}s")
+    print(f"[REPLAY] run_once={run_s:.2f}s  rows/s={rows / run_s if run_s else 0:.0f}  "
+          f"outbox_drain={drain_s:.2f}s left={left}")
+    print(f"[REPLAY] pages 200={c.get('page_200', 0)} 304={c.get('page_304', 0)} "
+          f"404={c.get('page_404', 0)} 5xx={c.get('page_5xx', 0)}")
+    print(f"[REPLAY] ebay calls={c.get('ebay_calls', 0)} items={c.get('ebay_items', 0)} 5xx={c.get('ebay_5xx', 0)}")
+    print(f"[REPLAY] telegram messages={c.get('tg_messages', 0)} chars={c.get('tg_chars', 0)} "
+          f"429={c.get('tg_429', 0)}")
+    if tmp:
+        tmp.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,266 @@
+# browser_pool.py
+# 常驻 Chromium 池：整个进程只启动一次浏览器，页面用完归还复用。
+# - fetcher.fetch() / main_gsheets 都从这里取浏览器，避免“每个 URL 冷启动一次 Chromium”
+# - main_loop 多轮 run_once 之间也会复用同一个浏览器
+# - 注意：sync_playwright 绑定在创建它的线程上，只能在同一线程内使用
+#
+# 持久 profile（PW_PROFILE_DIR 非空时启用）：用 launch_persistent_context 打开同一个用户目录，
+# Chromium 的 HTTP 磁盘缓存（JS 包 / 字体）、cookie、localStorage（同意弹窗等）跨轮次、跨 run 保留。
+# 这时整个进程只有一个 context：new_context() 返回它（选项以第一次打开时为准），用完调 release_context()
+# 只关本轮开的页面。同一目录同时只能被一个浏览器打开（main_gsheets 并发模式启动前会先 close() 这里的）。
+#   PW_PROFILE_DIR       空（默认，每次全新 profile）| 目录，例如 .state/chromium-profile（workflow 的 .state 缓存会带上）
+#   PW_PROFILE_MAX_MB    目录大小上限，默认 256；启动前超过就先按修改时间删最旧的缓存文件，
+#                        降到上限的 80% 以下；只删缓存还不够就整个 profile 重建。Chromium 自己的磁盘缓存上限设为它的一半
+import os
+import shutil
+import atexit
+from contextlib import contextmanager
+
+from playwright.sync_api import sync_playwright
+
+import resource_blocker
+
+_pw = None
+_browser = None
+_ctx = None
+_idle = []
+_persistent = False     # _ctx 是持久 profile 的 context（没有单独的 browser 对象）
+_ctx_closed = False     # 持久 context 已关闭（浏览器崩溃时也会触发 close 事件）
+
+# profile 里可以随时删掉重下的缓存目录（cookie / localStorage 不在这里面）
+CACHE_DIRS = ("Cache", "Code Cache", "GPUCache", "DawnCache", "GrShaderCache", "ShaderCache",
+              os.path.join("Service Worker", "CacheStorage"), os.path.join("Service Worker", "ScriptCache"))
+
+
+def _pool_size() -> int:
+    """空闲页面最多保留几个（多了只占内存）；运行时读取，兼容 load_dotenv 晚于 import。"""
+    try:
+        return max(0, int(os.getenv("PW_POOL_SIZE", "2")))
+    except ValueError:
+        return 2
+
+
+def _alive() -> bool:
+    try:
+        if _persistent:
+            return _ctx is not None and not _ctx_closed
+        return _browser is not None and _browser.is_connected()
+    except Exception:
+        return False
+
+
+def profile_dir() -> str:
+    return os.getenv("PW_PROFILE_DIR", "").strip()
+
+
+def _profile_cap() -> int:
+    """PW_PROFILE_MAX_MB → 字节；0 = 不限。"""
+    try:
+        return max(0, int(float(os.getenv("PW_PROFILE_MAX_MB", "256")) * 1024 * 1024))
+    except ValueError:
+        return 256 * 1024 * 1024
+
+
+def profile_args() -> list:
+    """持久 profile 的 Chromium 启动参数：磁盘缓存上限 = 目录上限的一半（Chromium 自己按 LRU 淘汰）。"""
+    cap = _profile_cap()
+    return [f"--disk-cache-size={cap // 2}"] if cap else []
+
+
+def _files(root: str):
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path, follow_symlinks=False)
+            except OSError:
+                continue
+            yield path, st.st_size, st.st_mtime
+
+
+def trim_profile(path: str, cap: int = None) -> int:
+    """
+    profile 目录超过上限时淘汰：先按修改时间从旧到新删缓存目录里的文件，直到降到上限的 80%；
+    只删缓存不够（cookie / 本地存储本身太大）就整个目录删掉重建。返回删掉的字节数。必须在浏览器没打开时调用。
+    """
+    cap = _profile_cap() if cap is None else cap
+    if not cap or not os.path.isdir(path):
+        return 0
+    total = sum(size for _, size, _ in _files(path))
+    if total <= cap:
+        return 0
+    target = int(cap * 0.8)
+    cache = []
+    for sub in ("Default", ""):
+        for name in CACHE_DIRS:
+            d = os.path.join(path, sub, name)
+            if os.path.isdir(d):
+                cache += list(_files(d))
+    freed = 0
+    for f, size, _ in sorted(set(cache), key=lambda x: x[2]):
+        if total - freed <= target:
+            break
+        try:
+            os.remove(f)
+            freed += size
+        except OSError:
+            pass
+    if total - freed > cap:
+        shutil.rmtree(path, ignore_errors=True)
+        freed = total
+        print(f"[BROWSER] profile {path} still over {cap // 1048576}MB after cache eviction, reset")
+    print(f"[BROWSER] profile {path}: {total / 1048576:.0f}MB > {cap // 1048576}MB, evicted {freed / 1048576:.0f}MB")
+    return freed
+
+
+def prepare_profile() -> str:
+    """建好持久 profile 目录并按上限淘汰，返回路径（async Playwright 也用它）。"""
+    path = profile_dir()
+    trim_profile(path)
+    os.makedirs(path, exist_ok=True)
+    # 上次进程被杀掉时留下的锁文件会让 Chromium 拒绝打开这个目录
+    for name in ("SingletonLock", "SingletonCookie", "SingletonSocket"):
+        try:
+            os.remove(os.path.join(path, name))
+        except OSError:
+            pass
+    return path
+
+
+def _on_close(_):
+    global _ctx_closed
+    _ctx_closed = True
+
+
+def _open_persistent(**kwargs):
+    """打开持久 profile 的 context（之前的浏览器/context 全部关掉）。"""
+    global _pw, _ctx, _persistent, _ctx_closed
+    close()
+    kwargs.setdefault("locale", "ja-JP")
+    path = prepare_profile()
+    _pw = sync_playwright().start()
+    ctx = _pw.chromium.launch_persistent_context(path, headless=True, args=profile_args(), **kwargs)
+    ctx.on("close", _on_close)
+    # 持久 context 打开时自带一个空白页，放进池里复用
+    _idle.extend(p for p in ctx.pages[:_pool_size()])
+    _ctx, _persistent, _ctx_closed = resource_blocker.install(ctx), True, False
+    print(f"[BROWSER] persistent profile: {path}")
+    return _ctx
+
+
+def get_browser():
+    """返回常驻 browser；第一次调用或浏览器崩溃后会（重新）启动。持久 profile 模式下没有单独的 browser，不要调用。"""
+    global _pw, _browser
+    if _alive() and not _persistent:
+        return _browser
+    # 浏览器挂了：把旧的全部清掉再重启
+    close()
+    _pw = sync_playwright().start()
+    _browser = _pw.chromium.launch(headless=True)
+    return _browser
+
+
+def new_context(**kwargs):
+    """
+    在常驻 browser 上新建 context（用完交给 release_context）；PW_BLOCK_MEDIA 拦截规则也在这里挂上。
+    持久 profile 模式下返回共用的那个 context。
+    """
+    if profile_dir():
+        if _persistent and _alive():
+            return _ctx
+        return _open_persistent(**kwargs)
+    kwargs.setdefault("locale", "ja-JP")
+    return resource_blocker.install(get_browser().new_context(**kwargs))
+
+
+def release_context(ctx, pages=()):
+    """用完 new_context 拿到的 context：普通 context 直接关；持久 profile 的只关 pages（context 留给下一轮）。"""
+    if ctx is None:
+        return
+    if _persistent and ctx is _ctx:
+        for page in pages:
+            try:
+                if page is not None:
+                    page.close()
+            except Exception:
+                pass
+        return
+    ctx.close()
+
+
+def _default_context():
+    global _ctx
+    if profile_dir():
+        return new_context()
+    if _ctx is None or not _alive() or _persistent:
+        get_browser()
+        _ctx = new_context()
+    return _ctx
+
+
+def acquire_page():
+    """从池里取一个页面；没有空闲页面就新开一个。"""
+    ctx = _default_context()
+    while _idle:
+        page = _idle.pop()
+        try:
+            if not page.is_closed():
+                return page
+        except Exception:
+            pass
+    return ctx.new_page()
+
+
+def release_page(page, reusable: bool = True):
+    """归还页面：先导航到 about:blank 释放旧页面的资源；出错或池已满则直接关闭。"""
+    if page is None:
+        return
+    if reusable and len(_idle) < _pool_size():
+        try:
+            if not page.is_closed():
+                page.goto("about:blank", timeout=5000)
+                _idle.append(page)
+                return
+        except Exception:
+            pass
+    try:
+        page.close()
+    except Exception:
+        pass
+
+
+@contextmanager
+def borrow_page():
+    """
+    with borrow_page() as page:
+        page.goto(url)
+    正常结束的页面放回池里；抛异常的页面直接丢弃，避免脏状态影响下一个 URL。
+    """
+    page = acquire_page()
+    ok = False
+    try:
+        yield page
+        ok = True
+    finally:
+        release_page(page, reusable=ok)
+
+
+def close():
+    """关闭池里所有资源（进程退出时自动调用；持久 profile 在关闭 context 时写回磁盘）。"""
+    global _pw, _browser, _ctx, _persistent
+    _idle.clear()
+    for obj in (_ctx, _browser):
+        if obj is not None:
+            try:
+                obj.close()
+            except Exception:
+                pass
+    if _pw is not None:
+        try:
+            _pw.stop()
+        except Exception:
+            pass
+    _pw, _browser, _ctx, _persistent = None, None, None, False
+
+
+atexit.register(close)
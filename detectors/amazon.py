@@ -1,6 +1,6 @@
 # detectors/amazon.py
 import re
-from bs4 import BeautifulSoup
+from .parsed import parse, ParsedPage
 
 _price_num = re.compile(r"[\d,]+")
 
@@ -16,18 +16,18 @@ def _to_int(txt: str):
     except Exception:
         return None
 
-def detect(html: str) -> str:
+def detect(html) -> str:
     """
+    html: str 或 ParsedPage（与 extract_price 共用同一次解析）
     Amazon 库存粗判：
       - 文本包含「在庫あり」「通常1～2日以内に発送」→ IN_STOCK
       - 文本包含「在庫切れ」「一時的に在庫切れ」「現在在庫切れです」→ OUT_OF_STOCK
       - 其它无法确认 → UNKNOWN
     """
-    if not html:
+    page = parse(html)
+    if page.empty:
         return "UNKNOWN"
-    soup = BeautifulSoup(html, "lxml")
-    text = soup.get_text(" ")
-    t = text
+    t = page.text
 
     # 有货常见文案
     if any(w in t for w in ["在庫あり", "通常1～2日以内に発送", "通常1~2日以内に発送", "残り", "お急ぎ便"]):
@@ -39,14 +39,14 @@ def detect(html: str) -> str:
 
     return "UNKNOWN"
 
-def extract_price(html: str):
+def extract_price(html):
     """
     提取“当前应付价”。优先 core/apex 区域，避开划线价（a-text-price 等）。
-    兼容 PC/移动（/gp/aw/…）页面。
+    兼容 PC/移动（/gp/aw/…）页面。html: str 或 ParsedPage。
     """
-    if not html:
+    page = parse(html)
+    if page.empty:
         return None
-    soup = BeautifulSoup(html, "lxml")
 
     # 1) 新版应付价容器（桌面）
     sel_pref = [
@@ -55,9 +55,9 @@ def extract_price(html: str):
         "#price span.a-price span.a-offscreen",
     ]
     for sel in sel_pref:
-        el = soup.select_one(sel)
-        if el and el.get_text(strip=True):
-            val = _to_int(el.get_text())
+        txt = ParsedPage.el_text(page.select_one(sel))
+        if txt.strip():
+            val = _to_int(txt)
             if val is not None:
                 return val
 
@@ -67,28 +67,26 @@ def extract_price(html: str):
         "#apex_price_inside_buybox .a-offscreen",
     ]
     for sel in sel_mobile:
-        el = soup.select_one(sel)
-        if el and el.get_text(strip=True):
+        el = page.select_one(sel)
+        txt = ParsedPage.el_text(el)
+        if txt.strip():
             # 跳过划线价容器祖先
-            bad_ancestor = el.find_parent(class_="a-text-price")
-            if bad_ancestor:
+            if ParsedPage.has_ancestor_class(el, "a-text-price"):
                 continue
-            val = _to_int(el.get_text())
+            val = _to_int(txt)
             if val is not None:
                 return val
 
     # 3) 旧 ID 兜底
     for old_id in ("priceblock_dealprice", "priceblock_ourprice", "priceblock_saleprice"):
-        el = soup.find(id=old_id)
-        if el and el.get_text(strip=True):
-            val = _to_int(el.get_text())
+        txt = ParsedPage.el_text(page.select_one(f"[id='{old_id}']"))
+        if txt.strip():
+            val = _to_int(txt)
             if val is not None:
                 return val
 
-    # 4) 最后兜底：整页文本里的“￥ 12,345”，但排除划线价区域文本
-    for bad in soup.select(".a-text-price, .basisPrice, .priceBlockStrikePriceString"):
-        bad.decompose()
-    m = re.search(r"￥\s*([\d,]+)", soup.get_text(" "))
+    # 4) 最后兜底：整页文本里的“￥ 12,345”，但排除划线价区域文本（不改 DOM）
+    m = re.search(r"￥\s*([\d,]+)", page.text_without(".a-text-price, .basisPrice, .priceBlockStrikePriceString"))
     if m:
         try:
             return int(m.group(1).replace(",", ""))
@@ -1,5 +1,5 @@
-from bs4 import BeautifulSoup
 import re
+from .parsed import parse
 
 BUY_WORDS = ["カートに追加", "カートへ入れる", "購入"]
 SOLD_WORDS = ["SOLD OUT", "品切れ", "在庫切れ"]
@@ -8,18 +8,19 @@ def _contains_any(text: str, words) -> bool:
     t = text.lower()
     return any(w.lower() in t for w in words)
 
-def detect(html: str) -> str:
+def detect(html) -> str:
     """
+    html: str 或 ParsedPage
     返回:
       - IN_STOCK     有购买按钮或在庫数>=1
       - OUT_OF_STOCK 有售罄字样或在庫数=0
       - UNKNOWN      其他（不动作）
     """
-    if not html:
+    page = parse(html)
+    if page.empty:
         return "UNKNOWN"
 
-    soup = BeautifulSoup(html, "lxml")
-    text = soup.get_text(" ", strip=True)
+    text = page.text_stripped
 
     m = re.search(r"在庫数\s*[:：]\s*(\d+)", text)
     if m:
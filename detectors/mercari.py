@@ -2,15 +2,20 @@
 # -*- coding: utf-8 -*-
 """
 Mercari 商品状态检测（兼容 Page 与 HTML 字符串）
-- detect(obj, wait_ms=8000) -> (status, trigger)
+- detect(obj, deadline_ms=None) -> (status, trigger)
 - obj 可以是 playwright.sync_api.Page 或 str(HTML)
+- await detect_async(page, deadline_ms=None)：playwright.async_api.Page 版（并发模式用）
+- Page 判定：所有信号同时等待，先到先判；最多等 MERCARI_DEADLINE_MS，到时仍无信号 → UNKNOWN
+- detect_structured(html)：只看 ld+json / meta 里的 availability，给免渲染快速路径用
 状态：IN_STOCK / SOLD_OUT / UNAVAILABLE / UNKNOWN
 """
 
 from __future__ import annotations
-import re, time
+import os, re, json, time
 from typing import Tuple, Any
 
+from .parsed import ParsedPage, parse
+
 try:
     # 在 Actions 环境没有安装 Playwright 时，给个哑类型
     from playwright.sync_api import Page, TimeoutError as PlaywrightTimeoutError  # type: ignore
@@ -63,116 +68,214 @@ def _detect_from_html(html: str) -> Tuple[str, str]:
     return STATUS_UNKNOWN, "html:no-signal"
 
 
-# ===================== Page 强判定版 =====================
+# ===================== 结构化数据快速判定（免渲染） =====================
 
-def _wait_dom(page: "Page"):
-    try:
-        page.wait_for_load_state("domcontentloaded", timeout=10000)
-        try:
-            page.wait_for_load_state("networkidle", timeout=5000)
-        except PlaywrightTimeoutError:
-            pass
-    except PlaywrightTimeoutError:
-        pass
+def _iter_ldjson_nodes(data):
+    """ld+json 可能是对象/数组/@graph，逐个展开。"""
+    if isinstance(data, list):
+        for x in data:
+            yield from _iter_ldjson_nodes(x)
+    elif isinstance(data, dict):
+        yield data
+        for key in ("@graph", "offers"):
+            if key in data:
+                yield from _iter_ldjson_nodes(data[key])
 
-def _detect_from_page(page: "Page", wait_ms: int = 8000) -> Tuple[str, str]:
-    _wait_dom(page)
 
-    # 1) 多轮等待“購入手続きへ”
-    for i in range(4):  # 约 20 秒
-        try:
-            buy_btn = page.get_by_role("button", name=BUY_BTN_RE).first
-            buy_btn.wait_for(state="visible", timeout=wait_ms)
-            if buy_btn.is_enabled():
-                return STATUS_IN_STOCK, f"button:購入手続きへ[{i}]"
-        except PlaywrightTimeoutError:
-            pass
-        except Exception:
-            pass
+def _availability_status(value: str):
+    v = str(value or "").lower()
+    if v.endswith("instock") or v in ("in stock", "in_stock"):
+        return STATUS_IN_STOCK
+    if any(k in v for k in ("soldout", "outofstock", "discontinued", "out of stock", "out_of_stock")):
+        return STATUS_SOLD_OUT
+    return None
 
-        # 备选：data-testid/文本
+
+def detect_structured(html) -> Tuple[str, str]:
+    """
+    只看页面里的结构化字段（ld+json offers.availability / availability meta），不看正文文案。
+    用于 requests 直接拿到的静态 HTML：判不出就返回 UNKNOWN，由调用方再走浏览器渲染。
+    html: str 或 ParsedPage
+    """
+    page = parse(html)
+    if page.empty:
+        return STATUS_UNKNOWN, "structured:empty"
+
+    for el in page.select('script[type="application/ld+json"]'):
         try:
-            locator = page.locator('button[data-testid="buy-button"], text=購入手続きへ')
-            if locator.count() > 0 and locator.first.is_visible():
-                return STATUS_IN_STOCK, f"locator:buy-button[{i}]"
+            data = json.loads(el.text or "")
         except Exception:
-            pass
+            continue
+        for node in _iter_ldjson_nodes(data):
+            st = _availability_status(node.get("availability"))
+            if st:
+                return st, f"structured:ldjson-{node.get('availability')}"
 
-        time.sleep(5)
+    for css in ('meta[itemprop="availability"]', 'meta[property="product:availability"]',
+                'meta[name="product:availability"]', 'link[itemprop="availability"]'):
+        el = page.select_one(css)
+        if el is not None:
+            st = _availability_status(el.get("content") or el.get("href"))
+            if st:
+                return st, f"structured:meta-{el.get('content') or el.get('href')}"
 
-    # 2) 售罄按钮
-    try:
-        sold_btn = page.get_by_role("button", name=SOLD_BTN_RE).first
-        sold_btn.wait_for(state="visible", timeout=2000)
-        label = sold_btn.inner_text().strip()[:32] if sold_btn else "売り切れ"
-        return STATUS_SOLD_OUT, f"button:{label}"
-    except PlaywrightTimeoutError:
-        pass
-    except Exception:
-        pass
+    return STATUS_UNKNOWN, "structured:none"
 
-    # 3) 售罄/已配送完成等文案
-    body_text = ""
-    try:
-        body_text = page.locator("body").inner_text(timeout=2000)
-    except Exception:
-        body_text = ""
-    if SOLD_TXT_RE.search(body_text or ""):
-        return STATUS_SOLD_OUT, "text:売り切れ/配送/終了"
 
-    # 4) SOLD 缎带（aria-label）
+# ===================== Page 强判定版 =====================
+# 所有信号在页面里用一段 JS 同时检查，wait_for_function 轮询到第一个“决定性”信号就返回，
+# 不再按顺序一个个 wait_for + sleep（旧版售罄商品最坏要 ~55 秒）。
+# - 强信号（随时可判）：可点击的购买按钮 / 售罄按钮 / ld+json availability
+# - 弱信号（开始判定满 MERCARI_WEAK_SIGNAL_MS 后才采信）：正文售罄文案 / aria-label=SOLD / 404 文案
+#   推荐商品区也会出现 SOLD 缎带，太早采信会把在售商品误判为售罄：
+#   等待从开始轮询算起（不是 performance.now() 的导航开始时间，慢页面 goto 返回时可能早就过了），
+#   且只看 <main> 里、不属于其它商品链接（推荐卡片）的部分。
+# 同步与 async 共用同一段 JS，判定逻辑只有一份。
+
+_DECIDE_JS = r"""
+([buyRe, soldBtnRe, soldTxtRe, badgeRe, graceMs, startedAt, final]) => {
+  const BUY = new RegExp(buyRe, "i");
+  const SOLD_BTN = new RegExp(soldBtnRe, "i");
+  const SOLD_TXT = new RegExp(soldTxtRe, "s");
+  const BADGE = new RegExp(badgeRe, "i");
+  const visible = (el) => {
+    if (!el.getClientRects().length) return false;
+    const st = getComputedStyle(el);
+    return st.visibility !== "hidden" && st.display !== "none";
+  };
+  const enabled = (el) => !el.disabled && el.getAttribute("aria-disabled") !== "true";
+  const nameOf = (el) => (el.getAttribute("aria-label") || el.innerText || el.value || "").trim();
+
+  // 1) 购买按钮（可见且可点击）
+  const buttons = [...document.querySelectorAll(
+    'button, [role="button"], input[type="submit"], input[type="button"]')].filter(visible);
+  for (const b of buttons) {
+    if (BUY.test(nameOf(b)) && enabled(b)) return ["IN_STOCK", "button:購入手続きへ"];
+  }
+  const tb = document.querySelector('button[data-testid="buy-button"]');
+  if (tb && visible(tb)) return ["IN_STOCK", "locator:buy-button"];
+
+  // 2) 售罄按钮
+  for (const b of buttons) {
+    const name = nameOf(b);
+    if (SOLD_BTN.test(name)) return ["SOLD_OUT", "button:" + name.slice(0, 32)];
+  }
+
+  // 3) 结构化数据
+  const ld = [...document.querySelectorAll('script[type="application/ld+json"]')]
+    .map((s) => s.textContent || "");
+  if (ld.some((s) => s.includes('"availability"'))) {
+    const joined = ld.join(" ");
+    if (joined.includes("InStock")) return ["IN_STOCK", "ldjson:InStock"];
+    if (/SoldOut|OutOfStock|Discontinued/.test(joined)) return ["SOLD_OUT", "ldjson:SoldOut"];
+  }
+
+  // 弱信号：从开始判定算起等够 graceMs 才采信（final=true 表示已到截止时间，最后看一眼）
+  if (!final && Date.now() - startedAt < graceMs) return null;
+
+  const body = document.body ? document.body.innerText : "";
+  // 只看本商品区域：推荐卡片（指向其它商品的链接）里的 SOLD 缎带 / 文案不算
+  const root = document.querySelector("main") || document.body;
+  const path = (u) => new URL(u, location.href).pathname.replace(/\/$/, "");
+  const here = path(location.href);
+  const tiles = root ? [...root.querySelectorAll('a[href*="/item/"]')].filter((a) => path(a.href) !== here) : [];
+  const inTile = (el) => tiles.some((a) => a.contains(el));
+  let own = root ? root.innerText : "";
+  for (const a of tiles) own = own.replace(a.innerText, "");
+  if (SOLD_TXT.test(own)) return ["SOLD_OUT", "text:売り切れ/配送/終了"];
+  for (const el of (root ? root.querySelectorAll("[aria-label]") : [])) {
+    if (BADGE.test(el.getAttribute("aria-label") || "") && !inTile(el)) return ["SOLD_OUT", "aria-label:SOLD"];
+  }
+  if (body.includes("ページが見つかりません")) return ["UNAVAILABLE", "text:ページが見つかりません"];
+  return null;
+}
+"""
+
+# 截止时间到了仍没有任何信号：判不出就是判不出，返回 UNKNOWN（不清零，state_store 不记录，下一轮再查）。
+# 旧版这里按售罄兜底；慢水合的在售商品会因此被误清零。
+TRIGGER_NO_SIGNAL = "deadline:no-signal"
+_FALLBACK = (STATUS_UNKNOWN, TRIGGER_NO_SIGNAL)
+
+
+def _env_ms(name: str, default: int) -> int:
     try:
-        aria_concat = " ".join(page.locator("//*").evaluate_all(
-            "els => els.map(e => e.getAttribute('aria-label')||'').join(' ')"
-        ) or [])
-        if SOLD_BADGE_RE.search(aria_concat):
-            return STATUS_SOLD_OUT, "aria-label:SOLD"
-    except Exception:
-        pass
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _args(started_ms: float, final: bool = False) -> list:
+    # started_ms：开始判定的时刻（epoch 毫秒，浏览器与本进程在同一台机器上，和 Date.now() 可比）
+    return [BUY_BTN_RE.pattern, SOLD_BTN_RE.pattern, SOLD_TXT_RE.pattern, SOLD_BADGE_RE.pattern,
+            _env_ms("MERCARI_WEAK_SIGNAL_MS", 8000), started_ms, final]
+
+
+def _deadline_ms(deadline_ms) -> int:
+    # 到时仍无信号返回 UNKNOWN（见 _FALLBACK），超时只会推迟判定，不会误清零
+    return int(deadline_ms) if deadline_ms else _env_ms("MERCARI_DEADLINE_MS", 20000)
+
 
-    # 5) 结构化数据
+def _detect_from_page(page: "Page", deadline_ms: int = None) -> Tuple[str, str]:
+    started = time.time() * 1000
     try:
-        ld_json_list = page.locator('script[type="application/ld+json"]').all_inner_texts()
-        if any('"availability"' in s for s in ld_json_list):
-            joined = " ".join(ld_json_list)
-            if "InStock" in joined:
-                return STATUS_IN_STOCK, "ldjson:InStock"
-            if any(k in joined for k in ("SoldOut", "OutOfStock", "Discontinued")):
-                return STATUS_SOLD_OUT, "ldjson:SoldOut"
-    except Exception:
+        handle = page.wait_for_function(_DECIDE_JS, arg=_args(started), polling=200,
+                                        timeout=_deadline_ms(deadline_ms))
+        status, trigger = handle.json_value()
+        return status, trigger
+    except PlaywrightTimeoutError:
         pass
+    # 到截止时间：把弱信号也算上最后判一次
+    res = page.evaluate(_DECIDE_JS, _args(started, final=True))
+    return tuple(res) if res else _FALLBACK
 
-    # 6) 404
-    if "ページが見つかりません" in (body_text or ""):
-        return STATUS_UNAVAIL, "text:ページが見つかりません"
 
-    # 7) 兜底（保守）
-    return STATUS_SOLD_OUT, "fallback:no-buy-button"
+async def _detect_from_page_async(page, deadline_ms: int = None) -> Tuple[str, str]:
+    started = time.time() * 1000
+    try:
+        handle = await page.wait_for_function(_DECIDE_JS, arg=_args(started), polling=200,
+                                              timeout=_deadline_ms(deadline_ms))
+        status, trigger = await handle.json_value()
+        return status, trigger
+    except PlaywrightTimeoutError:
+        pass
+    res = await page.evaluate(_DECIDE_JS, _args(started, final=True))
+    return tuple(res) if res else _FALLBACK
 
 
 # ===================== 统一入口 =====================
 
-def detect(obj: Any, wait_ms: int = 8000) -> Tuple[str, str]:
+def detect(obj: Any, deadline_ms: int = None) -> Tuple[str, str]:
     """
-    obj: playwright Page 或 str(HTML)
+    obj: playwright Page 或 str(HTML) / ParsedPage
+    deadline_ms: Page 判定的时间上限，默认 MERCARI_DEADLINE_MS（20000）
     """
     # Page 路径
     try:
         from playwright.sync_api import Page as _P  # 防止类型比较失败
         if isinstance(obj, _P):
-            return _detect_from_page(obj, wait_ms=wait_ms)
-    except Exception:
+            return _detect_from_page(obj, deadline_ms=deadline_ms)
+    except ImportError:
         pass
 
-    # HTML 路径
+    # HTML 路径（ParsedPage 也只用原始 HTML，不需要 DOM）
     if isinstance(obj, str):
         return _detect_from_html(obj)
+    if isinstance(obj, ParsedPage):
+        return _detect_from_html(obj.html)
 
     # 未知类型
     return STATUS_UNKNOWN, "bad-arg"
 
 
+async def detect_async(page: Any, deadline_ms: int = None) -> Tuple[str, str]:
+    """
+    page: playwright.async_api.Page 或 str(HTML)
+    """
+    if isinstance(page, str):
+        return _detect_from_html(page)
+    return await _detect_from_page_async(page, deadline_ms=deadline_ms)
+
+
 NAME = "mercari"
-__all__ = ["detect", "NAME",
+__all__ = ["detect", "detect_async", "detect_structured", "NAME", "TRIGGER_NO_SIGNAL",
            "STATUS_IN_STOCK", "STATUS_SOLD_OUT", "STATUS_UNAVAIL", "STATUS_UNKNOWN"]
-
@@ -0,0 +1,147 @@
+# detectors/parsed.py
+# 一次解析、多处复用的页面对象：
+# - lxml 原生 DOM（比 BeautifulSoup 快得多）
+# - 整页文本懒计算，只算一次（规则与 BeautifulSoup.get_text 一致：跳过 script/style/template/rt 和注释）
+# - CSS 选择器编译结果全局缓存
+# 各 detector 的 detect()/extract_price() 既接受 str(HTML) 也接受 ParsedPage。
+from functools import lru_cache
+
+from lxml import etree
+from lxml.cssselect import CSSSelector
+
+# 这些标签里的文字不算“页面文本”（与 bs4 的 get_text 行为一致）
+_SKIP_TAGS = frozenset(("script", "style", "template", "rt"))
+
+_PARSER = etree.HTMLParser(encoding="utf-8")
+
+# fetcher.fetch_playwright 会把整页纯文本以注释包裹追加在 </html> 之后。
+# libxml2 会丢掉 </html> 之后的文本，这里先切出来，单独并入页面文本。
+_DUMP_START = "<!--TEXT_DUMP_START-->"
+_DUMP_END = "<!--TEXT_DUMP_END-->"
+
+
+@lru_cache(maxsize=256)
+def _selector(css: str) -> CSSSelector:
+    return CSSSelector(css)
+
+
+def _strings(root, skip=frozenset()):
+    """按文档顺序产出 root 下的文本片段；skip 中的元素（连同子树）整体跳过，但其 tail 保留。"""
+    out = []
+    if root is None:
+        return out
+    # 显式栈代替递归（深层嵌套的页面不会撞递归上限）；栈里的 str 是待输出的 tail
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, str):
+            out.append(node)
+            continue
+        tag = node.tag
+        # 注释/处理指令的 tag 不是 str，只保留它们的 tail
+        if isinstance(tag, str) and tag.lower() not in _SKIP_TAGS and node not in skip:
+            if node.text:
+                out.append(node.text)
+            for child in reversed(node):
+                if child.tail:
+                    stack.append(child.tail)
+                stack.append(child)
+    return out
+
+
+class ParsedPage:
+    """一份 HTML 只解析一次；text / text_stripped 首次访问时才计算。"""
+
+    __slots__ = ("html", "root", "text_dump", "_strings", "_text", "_text_stripped")
+
+    def __init__(self, html: str):
+        self.html = html or ""
+        self.root = None
+        self.text_dump = ""
+        markup = self.html
+        idx = markup.rfind(_DUMP_START)
+        if idx >= 0:
+            self.text_dump = markup[idx + len(_DUMP_START):].split(_DUMP_END, 1)[0]
+            markup = markup[:idx]
+        if markup.strip():
+            try:
+                self.root = etree.fromstring(markup.encode("utf-8", errors="replace"), _PARSER)
+            except Exception:
+                self.root = None
+        self._strings = None
+        self._text = None
+        self._text_stripped = None
+
+    @property
+    def empty(self) -> bool:
+        return not self.html
+
+    def _all_strings(self):
+        if self._strings is None:
+            self._strings = _strings(self.root)
+            if self.text_dump:
+                self._strings.append(self.text_dump)
+        return self._strings
+
+    @property
+    def text(self) -> str:
+        """相当于 soup.get_text(" ")"""
+        if self._text is None:
+            self._text = " ".join(self._all_strings())
+        return self._text
+
+    @property
+    def text_stripped(self) -> str:
+        """相当于 soup.get_text(" ", strip=True)"""
+        if self._text_stripped is None:
+            self._text_stripped = " ".join(s.strip() for s in self._all_strings() if s.strip())
+        return self._text_stripped
+
+    def select(self, css: str) -> list:
+        if self.root is None:
+            return []
+        return _selector(css)(self.root)
+
+    def select_one(self, css: str):
+        found = self.select(css)
+        return found[0] if found else None
+
+    def text_without(self, css: str) -> str:
+        """整页文本，但去掉匹配 css 的元素（不修改 DOM，DOM 还要给别的函数用）。"""
+        skip = set(self.select(css))
+        if not skip:
+            return self.text
+        parts = _strings(self.root, skip=skip)
+        if self.text_dump:
+            parts.append(self.text_dump)
+        return " ".join(parts)
+
+    @staticmethod
+    def el_text(el) -> str:
+        """单个元素的文本（相当于 tag.get_text()）"""
+        return "".join(_strings(el)) if el is not None else ""
+
+    @staticmethod
+    def has_ancestor_class(el, cls: str) -> bool:
+        for anc in el.iterancestors():
+            if cls in (anc.get("class") or "").split():
+                return True
+        return False
+
+
+# 单槽缓存：fetcher(AUTO) 里 detect 过的 html，主流程再 parse 同一个字符串对象时直接复用
+_last = (None, None)
+
+
+def parse(obj) -> ParsedPage:
+    """str -> ParsedPage（同一个字符串对象连续解析只做一次）；ParsedPage 原样返回。"""
+    global _last
+    if isinstance(obj, ParsedPage):
+        return obj
+    html = obj if isinstance(obj, str) else ("" if obj is None else str(obj))
+    last_html, last_page = _last
+    if last_html is html and last_page is not None:
+        return last_page
+    page = ParsedPage(html)
+    _last = (html, page)
+    return page
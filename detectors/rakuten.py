@@ -1,22 +1,22 @@
 # detectors/rakuten.py
-from bs4 import BeautifulSoup
 import re
+from .parsed import parse
 
-def detect(html: str) -> str:
+def detect(html) -> str:
     """
+    html: str 或 ParsedPage
     Rakuten 商品状态检测：
       - 删除/下架  -> DELETED
       - 售罄       -> OUT_OF_STOCK
       - 可购买     -> IN_STOCK
       - 无法判断   -> UNKNOWN
     """
-    if not html:
+    page = parse(html)
+    if page.empty:
         print("[RAKUTEN DETECT] empty html")
         return "UNKNOWN"
 
-    soup = BeautifulSoup(html, "lxml")
-    text = soup.get_text(" ", strip=True)
-    html_lower = html.lower()
+    text = page.text_stripped
 
     # ---------- (1) 删除 / 下架 ----------
     deleted_markers = [
@@ -43,11 +43,10 @@ def detect(html: str) -> str:
         return "OUT_OF_STOCK"
 
     # meta availability
-    meta = (
-        soup.find("meta", {"itemprop": "availability"})
-        or soup.find("meta", {"property": "product:availability"})
-    )
-    if meta:
+    meta = page.select_one('meta[itemprop="availability"]')
+    if meta is None:
+        meta = page.select_one('meta[property="product:availability"]')
+    if meta is not None:
         val = (meta.get("content") or "").lower()
         if "out_of_stock" in val or "sold" in val:
             print("[RAKUTEN DETECT] matched: meta out_of_stock")
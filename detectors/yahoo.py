@@ -1,5 +1,5 @@
 # detectors/yahoo.py
-from bs4 import BeautifulSoup
+from .parsed import parse
 
 # 购买/在售信号（任一出现即可认为在售）
 BUY_SIGNALS = [
@@ -29,20 +29,20 @@ GONE_SIGNALS = [
     "このページは存在しません",
 ]
 
-def detect(html: str) -> str:
+def detect(html) -> str:
     """
+    html: str 或 ParsedPage
     返回：
       - IN_STOCK     有“购买/结算/入札”按钮
       - OUT_OF_STOCK 无购买按钮，且出现售罄/结束的强信号
       - UNKNOWN      其他情况（不做动作，避免误报）
     """
-    if not html:
+    page = parse(html)
+    if page.empty:
         return "UNKNOWN"
 
-    soup = BeautifulSoup(html, "lxml")
-
     # 把整页文本转小写，方便包含判断
-    text = soup.get_text(" ", strip=True).lower()
+    text = page.text_stripped.lower()
 
     def contains_any(haystack: str, needles) -> bool:
         for s in needles:
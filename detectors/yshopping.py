@@ -1,6 +1,6 @@
 # detectors/yshopping.py
 import re
-from bs4 import BeautifulSoup
+from .parsed import parse, ParsedPage
 
 _OUT_WORDS = [
     "在庫なし", "在庫切れ", "売り切れ", "完売", "販売終了",
@@ -15,29 +15,29 @@ def _txt(s):
         return ""
     return re.sub(r"\s+", " ", s).strip()
 
-def detect(html: str) -> str:
+def detect(html) -> str:
     """
+    html: str 或 ParsedPage（与 extract_price 共用同一次解析）
     返回:
       - 'OUT_OF_STOCK' : 明确售罄/无货
       - 'IN_STOCK'     : 明确有货
       - 'UNKNOWN'      : 无法判断
     """
-    if not html:
+    page = parse(html)
+    if page.empty:
         return "UNKNOWN"
 
-    soup = BeautifulSoup(html, "lxml")
-
     # 1) 优先看 og:availability
-    og = soup.find("meta", {"property": "og:availability"})
-    if og and og.get("content"):
-        v = og["content"].lower()
+    og = page.select_one('meta[property="og:availability"]')
+    if og is not None and og.get("content"):
+        v = og.get("content").lower()
         if "out_of_stock" in v:
             return "OUT_OF_STOCK"
         if "instock" in v or "in_stock" in v:
             return "IN_STOCK"
 
     # 2) 常见库存提示区域（Y!ショッピング有多种主题，这里走文本兜底）
-    text = _txt(soup.get_text(" "))
+    text = _txt(page.text)
     if any(w in text for w in _OUT_WORDS):
         return "OUT_OF_STOCK"
     if any(w in text for w in _IN_WORDS):
@@ -46,19 +46,19 @@ def detect(html: str) -> str:
     return "UNKNOWN"
 
 
-def extract_price(html: str):
+def extract_price(html):
     """
     尽量提取日元价格，返回 int 或 None。
-    逻辑：先找 itemprop/og:price，再兜底文本解析。
+    逻辑：先找 itemprop/og:price，再兜底文本解析。html: str 或 ParsedPage。
     """
-    if not html:
+    page = parse(html)
+    if page.empty:
         return None
-    soup = BeautifulSoup(html, "lxml")
 
     # itemprop=price
-    n = soup.find(attrs={"itemprop": "price"})
-    if n:
-        v = n.get("content") or n.get_text()
+    n = page.select_one('[itemprop="price"]')
+    if n is not None:
+        v = n.get("content") or ParsedPage.el_text(n)
         if v:
             m = _price_num.search(v)
             if m:
@@ -66,15 +66,15 @@ def extract_price(html: str):
 
     # meta property="product:price:amount" / "og:price:amount"
     for prop in ["product:price:amount", "og:price:amount"]:
-        m = soup.find("meta", {"property": prop})
-        if m and m.get("content"):
+        m = page.select_one(f'meta[property="{prop}"]')
+        if m is not None and m.get("content"):
             try:
-                return int(_price_num.search(m["content"]).group(0).replace(",", ""))
+                return int(_price_num.search(m.get("content")).group(0).replace(",", ""))
             except Exception:
                 pass
 
     # 兜底：页面文本中挑最近的“￥123,456”
-    m = re.search(r"￥\s*([\d,]+)", soup.get_text(" "))
+    m = re.search(r"￥\s*([\d,]+)", page.text)
     if m:
         return int(m.group(1).replace(",", ""))
 
@@ -1,10 +1,25 @@
 # ebay_update.py
 import os
 import re
+import time
+import random
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+import xml.etree.ElementTree as ET
 from xml.sax.saxutils import escape
 
+import state_store
+import metrics
+import pipeline
+
+# 可用环境变量 EBAY_ENDPOINT 覆盖（bench/replay.py 指向本地的模拟 Trading API）
 EBAY_ENDPOINT = "https://api.ebay.com/ws/api.dll"
+# ReviseInventoryStatus 单次请求最多 4 个 <InventoryStatus>
+MAX_BATCH = 4
+_NS = "{urn:ebay:apis:eBLBaseComponents}"
+
+_session = None
 
 
 def _is_blank(value) -> bool:
@@ -43,31 +58,97 @@ def _build_headers() -> dict:
 
 
 def _build_body(auth_token: str, inv_xml: str, quantity: int) -> str:
+    return _build_batch_body(auth_token, [inv_xml], quantity)
+
+
+def _build_batch_body(auth_token: str, inv_xmls: list, quantity: int) -> str:
+    """一个请求里放多个 <InventoryStatus>（最多 MAX_BATCH 个）。"""
+    statuses = "".join(
+        f"""
+  <InventoryStatus>
+    {inv_xml}
+    <Quantity>{quantity}</Quantity>
+  </InventoryStatus>"""
+        for inv_xml in inv_xmls
+    )
     return f"""<?xml version="1.0" encoding="utf-8"?>
 <ReviseInventoryStatusRequest xmlns="urn:ebay:apis:eBLBaseComponents">
   <RequesterCredentials>
     <eBayAuthToken>{escape(auth_token)}</eBayAuthToken>
-  </RequesterCredentials>
-  <InventoryStatus>
-    {inv_xml}
-    <Quantity>{quantity}</Quantity>
-  </InventoryStatus>
+  </RequesterCredentials>{statuses}
 </ReviseInventoryStatusRequest>""".strip()
 
 
-def _post(body: str, headers: dict) -> dict:
-    """发送请求并返回基础结构。"""
+def _env_float(name: str, default: float) -> float:
     try:
-        resp = requests.post(
-            EBAY_ENDPOINT, data=body.encode("utf-8"), headers=headers, timeout=30
-        )
-        text = resp.text or ""
-        ok = (resp.status_code == 200) and (
-            "<Ack>Success</Ack>" in text or "<Ack>Warning</Ack>" in text
-        )
-        return {"ok": ok, "status": resp.status_code, "body": text}
-    except Exception as e:
-        return {"ok": False, "status": None, "error": str(e), "body": ""}
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _retry_codes() -> set:
+    """可重试的 eBay 错误码：10007 内部错误 / 518 调用次数超限；EBAY_RETRY_CODES 可覆盖。"""
+    raw = os.getenv("EBAY_RETRY_CODES", "10007,518")
+    return {c.strip() for c in raw.split(",") if c.strip()}
+
+
+def _get_session() -> requests.Session:
+    """模块级 Session：复用到 api.ebay.com 的 TCP+TLS 连接（并发模式下多线程共用）。"""
+    global _session
+    if _session is None:
+        s = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=8)
+        s.mount("https://", adapter)
+        s.mount("http://", adapter)
+        _session = s
+    return _session
+
+
+def _retryable(status, text: str) -> bool:
+    if status is None:
+        return True
+    if status == 429 or status >= 500:
+        return True
+    if status == 200 and "<Ack>Failure</Ack>" in text:
+        codes = set(re.findall(r"<ErrorCode>(\d+)</ErrorCode>", text))
+        return bool(codes & _retry_codes())
+    return False
+
+
+def _post(body: str, headers: dict) -> dict:
+    """
+    发送请求并返回基础结构。
+    网络错误 / 5xx / 429 / 可重试 eBay 错误码时按指数退避 + 抖动重试；
+    清零（设 Quantity）是幂等操作，读超时后重发也安全。
+    """
+    max_retries = int(_env_float("EBAY_MAX_RETRIES", 3))
+    timeout = (_env_float("EBAY_CONNECT_TIMEOUT", 5), _env_float("EBAY_READ_TIMEOUT", 30))
+    base = _env_float("EBAY_BACKOFF_BASE", 1.0)
+    data = body.encode("utf-8")
+    endpoint = os.getenv("EBAY_ENDPOINT", EBAY_ENDPOINT)
+
+    res = {}
+    for attempt in range(max_retries + 1):
+        try:
+            resp = _get_session().post(endpoint, data=data, headers=headers, timeout=timeout)
+            text = resp.text or ""
+            ok = (resp.status_code == 200) and (
+                "<Ack>Success</Ack>" in text or "<Ack>Warning</Ack>" in text
+            )
+            res = {"ok": ok, "status": resp.status_code, "body": text}
+        except Exception as e:
+            res = {"ok": False, "status": None, "error": str(e), "body": ""}
+
+        res["attempts"] = attempt + 1
+        if res["ok"] or attempt >= max_retries or not _retryable(res["status"], res["body"]):
+            return res
+
+        # full jitter：0 ~ base*2^attempt 秒，最长 30 秒
+        delay = random.uniform(0, min(30.0, base * (2 ** attempt)))
+        print(f"[EBAY_RETRY] attempt={attempt + 1} status={res['status']} "
+              f"{res.get('error', '')[:120]} -> sleep {delay:.1f}s")
+        time.sleep(delay)
+    return res
 
 
 def _has_invalid_sku(body: str) -> bool:
@@ -156,3 +237,227 @@ def update_qty_with_fallback(item_id: str, sku: str, quantity: int = 0) -> dict:
     # 没有 SKU，直接用 ItemID
     only = revise_inventory_status(item_id=item_id, sku="", quantity=quantity)
     return {"ok": only.get("ok"), "first": only, "fallback": None}
+
+
+# ===================== 批量清零 =====================
+
+def _inv_xml(item_id: str, sku: str) -> tuple:
+    """返回 (inv_xml, used)：有 SKU 按 SKU，否则按 ItemID。"""
+    if sku:
+        return f"<SKU>{escape(sku)}</SKU>", "sku"
+    return f"<ItemID>{escape(item_id)}</ItemID>", "item_id"
+
+
+def _parse_batch_response(body: str) -> dict:
+    """
+    解析多商品 ReviseInventoryStatus 响应：
+      - ok_keys：响应里回显的 <InventoryStatus> 的 SKU / ItemID（即成功的成员）
+      - errors ：[(error_xml, error_code, [ErrorParameters 的值...]), ...]，只收 SeverityCode=Error
+    """
+    out = {"ack": "", "ok_keys": set(), "errors": []}
+    try:
+        root = ET.fromstring(body.encode("utf-8"))
+    except Exception:
+        return out
+    out["ack"] = root.findtext(f"{_NS}Ack") or ""
+    for inv in root.findall(f"{_NS}InventoryStatus"):
+        for tag in ("SKU", "ItemID"):
+            v = (inv.findtext(f"{_NS}{tag}") or "").strip()
+            if v:
+                out["ok_keys"].add(v)
+    for err in root.findall(f"{_NS}Errors"):
+        if (err.findtext(f"{_NS}SeverityCode") or "") != "Error":
+            continue
+        code = (err.findtext(f"{_NS}ErrorCode") or "").strip()
+        params = [(p.findtext(f"{_NS}Value") or "").strip() for p in err.findall(f"{_NS}ErrorParameters")]
+        out["errors"].append((ET.tostring(err, encoding="unicode"), code, [p for p in params if p]))
+    return out
+
+
+def revise_inventory_status_batch(entries: list, quantity: int = 0) -> list:
+    """
+    一次请求更新多个商品（entries: [{"item_id":..., "sku":...}, ...]，最多 MAX_BATCH 个）。
+    返回与 entries 一一对应的结果，每个结果的结构与 revise_inventory_status 相同；
+    成功与否按响应里逐个商品的回显/Errors 判定，失败成员的 body 只含归属于它的 Errors。
+    """
+    if len(entries) > MAX_BATCH:
+        raise ValueError(f"ReviseInventoryStatus accepts at most {MAX_BATCH} items per call")
+
+    members = []
+    for e in entries:
+        item_id, sku = _norm(e.get("item_id")), _norm(e.get("sku"))
+        inv_xml, used = _inv_xml(item_id, sku)
+        members.append({"item_id": item_id, "sku": sku, "used": used, "inv_xml": inv_xml,
+                        "key": sku if used == "sku" else item_id})
+
+    def _result(m, **kw):
+        res = {"used": m["used"], "item_id": m["item_id"], "sku": m["sku"], "quantity": quantity}
+        res.update(kw)
+        return res
+
+    # 单个商品直接走原来的单条接口
+    if len(members) == 1:
+        m = members[0]
+        return [revise_inventory_status(item_id=m["item_id"], sku=m["sku"], quantity=quantity)]
+
+    auth_token = os.getenv("EBAY_AUTH_TOKEN")
+    if _is_blank(auth_token):
+        return [_result(m, ok=False, error="Missing EBAY_AUTH_TOKEN in environment") for m in members]
+
+    if os.getenv("DRY_RUN", "false").lower() == "true":
+        return [_result(m, ok=True, dry_run=True) for m in members]
+
+    headers = _build_headers()
+    body = _build_batch_body(auth_token, [m["inv_xml"] for m in members], quantity)
+    raw = _post(body, headers)
+    text = raw.get("body", "") or ""
+
+    # 网络错误 / 非 200：整批失败
+    if raw.get("status") != 200:
+        return [_result(m, ok=False, status=raw.get("status"), body=text,
+                        **({"error": raw["error"]} if raw.get("error") else {})) for m in members]
+
+    parsed = _parse_batch_response(text)
+    attributed = any(params for _, _, params in parsed["errors"])
+    results = []
+    retry_single = []
+    for idx, m in enumerate(members):
+        if m["key"] in parsed["ok_keys"]:
+            results.append(_result(m, ok=True, status=200, body=text))
+            continue
+        own = [xml for xml, _, params in parsed["errors"] if m["key"] in params]
+        if own:
+            results.append(_result(m, ok=False, status=200, body="\n".join(own)))
+        elif attributed:
+            # 别的成员有明确报错、本成员既没回显也没报错：被整批失败连累，单独重发一次
+            results.append(None)
+            retry_single.append(idx)
+        else:
+            # 报错没有标明属于哪个商品（如 token 过期）：整批都算失败
+            results.append(_result(m, ok=False, status=200, body=text))
+
+    for idx in retry_single:
+        m = members[idx]
+        results[idx] = revise_inventory_status(item_id=m["item_id"], sku=m["sku"], quantity=quantity)
+
+    for res in results:
+        if (not res.get("ok")) and _has_token_expired(res.get("body", "")):
+            res.setdefault("error", "Auth token hard expired (code 932). Please refresh EBAY_AUTH_TOKEN.")
+    return results
+
+
+def update_qty_batch_with_fallback(entries: list, quantity: int = 0) -> list:
+    """
+    批量版 update_qty_with_fallback：先整批（SKU 优先）提交，
+    只对返回 Invalid SKU（21916255）且有 ItemID 的成员，再按 ItemID 批量重发。
+    返回结构与 update_qty_with_fallback 相同。
+    """
+    entries = [{"item_id": _norm(e.get("item_id")), "sku": _norm(e.get("sku"))} for e in entries]
+    firsts = revise_inventory_status_batch(entries, quantity=quantity)
+    out = [{"ok": r.get("ok"), "first": r, "fallback": None} for r in firsts]
+
+    need = [i for i, (e, r) in enumerate(zip(entries, firsts))
+            if e["sku"] and e["item_id"] and (not r.get("ok")) and _has_invalid_sku(r.get("body", ""))]
+    if need:
+        seconds = revise_inventory_status_batch(
+            [{"item_id": entries[i]["item_id"], "sku": ""} for i in need], quantity=quantity
+        )
+        for i, second in zip(need, seconds):
+            out[i] = {"ok": second.get("ok"), "first": firsts[i], "second": second, "fallback": "item_id"}
+    return out
+
+
+class ZeroBatch:
+    """
+    收集一轮里待清零的商品，攒满 EBAY_BATCH_SIZE（默认 4，上限 4）个就合并成一次请求发送；
+    run_once 结束前必须调用 flush() 发送剩余的并等发送/通知全部完成。
+      batch.add(item_id, sku, on_done=lambda res: ..., url=url)   # res 结构同 update_qty_with_fallback
+    传了 url 的商品，推送结果会写回 state_store（下一轮据此跳过已清零的商品）。
+    fallback=False 时不做 SKU→ItemID 回退，res 结构同 revise_inventory_status。
+    发送和 on_done 回调分别在流水线的 ebay / notify 段的线程里执行（见 pipeline.py），add() 不等 eBay 返回；
+    site 用于记录这两段的队列统计。
+    线程安全（main_gsheets 并发模式会在多个线程里 add）。
+    """
+
+    def __init__(self, quantity: int = 0, fallback: bool = True, size: int = None, site: str = ""):
+        if size is None:
+            try:
+                size = int(os.getenv("EBAY_BATCH_SIZE", str(MAX_BATCH)))
+            except ValueError:
+                size = MAX_BATCH
+        self.size = max(1, min(MAX_BATCH, size))
+        self.quantity = quantity
+        self.fallback = fallback
+        self.site = site
+        self._pending = []
+        self._lock = threading.Lock()
+        self._ebay = None
+        self._notify = None
+
+    def _stages(self):
+        with self._lock:
+            if self._ebay is None:
+                notify = pipeline.Stage("notify", self._call, pipeline.workers("notify"))
+                self._ebay = pipeline.Stage("ebay", lambda chunk: self._send(chunk, notify), pipeline.workers("ebay"))
+                self._notify = notify
+            return self._ebay
+
+    def add(self, item_id: str, sku: str, on_done=None, url: str = ""):
+        with self._lock:
+            # 记下发起清零的那一行，攒批发出后把 eBay / 通知耗时记回这一行
+            self._pending.append(({"item_id": item_id, "sku": sku, "url": url, "rec": metrics.current()}, on_done))
+            if len(self._pending) < self.size:
+                return
+            chunk, self._pending = self._pending, []
+        self._stages().put(chunk)
+
+    def flush(self):
+        ebay = self._stages()
+        while True:
+            with self._lock:
+                chunk, self._pending = self._pending[:self.size], self._pending[self.size:]
+            if not chunk:
+                break
+            ebay.put(chunk)
+        # 先等 eBay 段发完（回调都已交给 notify 段），再等通知发完
+        with self._lock:
+            ebay, notify, self._ebay, self._notify = self._ebay, self._notify, None, None
+        ebay.close()
+        notify.close()
+        if self.site:
+            metrics.queue(self.site, "ebay", ebay.stats())
+            metrics.queue(self.site, "notify", notify.stats())
+        if ebay.errors:
+            raise ebay.errors[0]
+
+    def _send(self, chunk, notify):
+        entries = [e for e, _ in chunk]
+        t0 = time.perf_counter()
+        if self.fallback:
+            results = update_qty_batch_with_fallback(entries, quantity=self.quantity)
+        else:
+            results = revise_inventory_status_batch(entries, quantity=self.quantity)
+        ebay_ms = (time.perf_counter() - t0) * 1000
+        for (e, cb), res in zip(chunk, results):
+            rec = e["rec"]
+            metrics.add("ebay", ebay_ms, rec)
+            metrics.note(rec, ebay_batch=len(chunk), ebay_ok=bool(res.get("ok")))
+            if res.get("fallback"):
+                metrics.fallback(f"ebay:{res['fallback']}", rec)
+            # dry-run 没有真的改 eBay，不写状态
+            dry = res.get("dry_run") or (res.get("first") or {}).get("dry_run")
+            if e["url"] and not dry:
+                try:
+                    state_store.record_push(e["url"], e["item_id"], e["sku"], self.quantity, bool(res.get("ok")))
+                except Exception as ex:
+                    print(f"[EBAY_BATCH] state store error: {ex}")
+            if cb is not None:
+                notify.put((cb, res, rec))
+
+    def _call(self, item):
+        cb, res, rec = item
+        try:
+            with metrics.stage("notify", rec):
+                cb(res)
+        except Exception as e:
+            print(f"[EBAY_BATCH] callback error: {e}")
@@ -1,12 +1,116 @@
-# fetcher.py（Playwright 版本）
-from playwright.sync_api import sync_playwright
+# fetcher.py
+# FETCH_MODE（运行时读取环境变量）：
+#   - REQUESTS（默认）：keep-alive 的 requests.Session 直接取静态 HTML，最快（带磁盘缓存/条件请求，见 http_cache.py）
+#   - PLAYWRIGHT：常驻 Chromium 渲染（动态 SOLD 标记等需要 JS 的页面）
+#   - AUTO：先 REQUESTS；若传入的 detect(html) 判不出（UNKNOWN）或 HTTP 非 200，再用 Playwright 渲染一次
+# 真正发出请求前都先过 ratelimit 的按域名令牌桶（缓存新鲜期内直接用缓存的不算）。
+import os
+import re
+import requests
+from requests.adapters import HTTPAdapter
 
-def fetch(url: str):
+import http_cache
+import metrics
+import ratelimit
+
+UA = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+      "(KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36")
+
+_META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset=["']?([\w\-]+)""", re.I)
+
+_session = None
+
+
+def _accept_encoding() -> str:
+    # 装了 brotli 才声明 br，否则 requests/urllib3 解不开
+    try:
+        import brotli  # noqa: F401
+        return "gzip, deflate, br"
+    except Exception:
+        return "gzip, deflate"
+
+
+def _get_session() -> requests.Session:
+    """模块级 Session：连接池 + keep-alive，同一站点的多次请求复用 TCP/TLS 连接。"""
+    global _session
+    if _session is None:
+        s = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=8)
+        s.mount("https://", adapter)
+        s.mount("http://", adapter)
+        s.headers.update({
+            "User-Agent": UA,
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+            "Accept-Language": "ja-JP,ja;q=0.9,en;q=0.6",
+            "Accept-Encoding": _accept_encoding(),
+        })
+        _session = s
+    return _session
+
+
+def _requests_timeout() -> float:
     try:
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            ctx = browser.new_context(locale="ja-JP")
-            page = ctx.new_page()
+        return float(os.getenv("REQUESTS_TIMEOUT", "25"))
+    except ValueError:
+        return 25.0
+
+
+def _decode(resp) -> str:
+    """
+    响应头没写 charset 时 requests 会按 ISO-8859-1 解码，日文页面会乱码。
+    这里先看 <meta charset>，都没有再按 utf-8。
+    """
+    ctype = resp.headers.get("Content-Type", "").lower()
+    if "charset=" not in ctype:
+        m = _META_CHARSET_RE.search(resp.content[:4096])
+        resp.encoding = m.group(1).decode("ascii", "ignore") if m else "utf-8"
+    try:
+        return resp.text
+    except LookupError:
+        # meta 里写了 Python 不认识的编码名
+        return resp.content.decode("utf-8", errors="replace")
+
+
+def fetch_requests(url: str):
+    """
+    requests 直接取 HTML；经过 http_cache：新鲜期内直接用缓存，过期则发条件请求，304 复用上次的正文。
+    """
+    try:
+        entry = http_cache.lookup(url)
+    except Exception as e:
+        print(f"[HTTP_CACHE] lookup error, bypass: {e}")
+        entry = None
+    if http_cache.fresh(url, entry):
+        metrics.note(cache="fresh")
+        return 200, http_cache.serve_fresh(entry)
+
+    ratelimit.wait(url)
+    try:
+        resp = _get_session().get(url, timeout=_requests_timeout(), allow_redirects=True,
+                                  headers=http_cache.conditional_headers(entry))
+        if resp.status_code == 304 and entry and entry["body"] is not None:
+            metrics.note(cache="304")
+            return 200, http_cache.revalidated(url, entry)
+        html = _decode(resp)
+    except Exception as e:
+        return 0, f"__FETCH_ERROR__::{e}"
+
+    if resp.status_code == 200:
+        try:
+            http_cache.store(url, resp.headers, html, entry)
+        except Exception as e:
+            print(f"[HTTP_CACHE] store error: {e}")
+    return resp.status_code, html
+
+
+def fetch_playwright(url: str):
+    try:
+        # 只有真正需要渲染时才加载 Playwright（REQUESTS 模式可以不装）
+        import browser_pool
+
+        ratelimit.wait(url)
+        # 从常驻浏览器池借一个页面，用完归还（不再每个 URL 启动一次 Chromium）
+        with browser_pool.borrow_page() as page:
             resp = page.goto(url, wait_until="domcontentloaded", timeout=45000)
 
             # 等待任一交互元素出现（按钮/链接）。有些页面按钮是 hydration 后才插入。
@@ -24,19 +128,54 @@ def fetch(url: str):
             except:
                 text_dump = ""
 
-            browser.close()
-
-            # 把纯文本塞进注释，传给 detector 作为兜底搜索区域
-            if text_dump:
-                html = (
-                    html
-                    + "\n<!--TEXT_DUMP_START-->\n"
-                    + text_dump
-                    + "\n<!--TEXT_DUMP_END-->\n"
-                )
+        # 把纯文本塞进注释，传给 detector 作为兜底搜索区域
+        if text_dump:
+            html = (
+                html
+                + "\n<!--TEXT_DUMP_START-->\n"
+                + text_dump
+                + "\n<!--TEXT_DUMP_END-->\n"
+            )
 
-            code = resp.status if resp else 0
-            return code, html
+        code = resp.status if resp else 0
+        return code, html
     except Exception as e:
         return 0, f"__FETCH_ERROR__::{e}"
 
+
+def _status_of(result) -> str:
+    # mercari.detect 返回 (status, trigger)，其它 detector 直接返回 status
+    if isinstance(result, tuple):
+        return result[0] if result else "UNKNOWN"
+    return result or "UNKNOWN"
+
+
+def fetch(url: str, detect=None, escalate: bool = True):
+    """
+    返回 (http_code, html)；抓取失败时 code=0、html 以 "__FETCH_ERROR__::" 开头。
+    detect：该站点的 detector（html -> status），仅 AUTO 模式用来决定要不要升级到 Playwright。
+    escalate=False：AUTO 模式只取静态页，升级由调用方决定（pipeline 的抓取线程用，升级在 parse_pool.complete 里做）。
+    """
+    mode = os.getenv("FETCH_MODE", "REQUESTS").strip().upper()
+    if mode == "PLAYWRIGHT":
+        return fetch_playwright(url)
+
+    code, html = fetch_requests(url)
+    if mode != "AUTO" or not escalate:
+        return code, html
+
+    # AUTO：链接明确失效，不必再渲染
+    if code in (404, 410):
+        return code, html
+    if code == 200:
+        if detect is None:
+            return code, html
+        try:
+            if _status_of(detect(html)) != "UNKNOWN":
+                return code, html
+        except Exception as e:
+            print(f"[FETCH] detect error on static html, escalate: {e}")
+
+    print(f"[FETCH] AUTO escalate to Playwright: {url} (HTTP={code})")
+    metrics.fallback("playwright")
+    return fetch_playwright(url)
@@ -0,0 +1,195 @@
+# http_cache.py
+# fetcher.fetch_requests 的磁盘缓存（SQLite）：按 URL 存 ETag / Last-Modified / 正文哈希 / 压缩正文。
+# - 还在新鲜期（按站点 TTL）→ 不发请求，直接用上次的正文
+# - 过了新鲜期 → 带 If-None-Match / If-Modified-Since 发条件请求；304 = 没变，复用上次的正文（判定结果自然也一样）
+# - 200 → 更新缓存；正文哈希与上次相同时记为 unchanged
+# 只缓存 requests 取到的 200 页面；Playwright 渲染结果不缓存。
+#
+# 环境变量（运行时读取）：
+#   HTTP_CACHE               true/false   总开关（默认 true）
+#   HTTP_CACHE_DB            路径         默认 .state/http_cache.db
+#   HTTP_CACHE_TTL           秒           默认新鲜期，默认 0（每次都发条件请求）
+#   HTTP_CACHE_TTL_<SITE>    秒           按站点覆盖（站点名见 sites.SITE_NAMES，如 HTTP_CACHE_TTL_AMAZON=600）
+#   HTTP_CACHE_MAX_AGE_DAYS  天           超过这么久没更新的条目在打开时清掉，默认 7
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS http_cache (
+    url           TEXT PRIMARY KEY,
+    etag          TEXT,
+    last_modified TEXT,
+    body_hash     TEXT,
+    body          BLOB,
+    size          INTEGER,
+    fetched_at    REAL
+)
+"""
+
+_conn = None
+_conn_path = None
+_lock = threading.RLock()
+_stats = {"fresh": 0, "revalidated": 0, "miss": 0, "unchanged": 0, "bytes_saved": 0}
+
+
+def enabled() -> bool:
+    return os.getenv("HTTP_CACHE", "true").strip().lower() == "true"
+
+
+def _db_path() -> str:
+    return os.getenv("HTTP_CACHE_DB", os.path.join(".state", "http_cache.db"))
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _connect():
+    global _conn, _conn_path
+    path = _db_path()
+    if _conn is not None and _conn_path == path:
+        return _conn
+    close()
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    # main_gsheets 并发模式会在多个线程里调用 fetch_requests，统一用 _lock 串行化
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(_SCHEMA)
+    max_age = _env_float("HTTP_CACHE_MAX_AGE_DAYS", 7)
+    if max_age > 0:
+        conn.execute("DELETE FROM http_cache WHERE fetched_at < ?", (time.time() - max_age * 86400,))
+    conn.commit()
+    _conn, _conn_path = conn, path
+    return conn
+
+
+def ttl_for(url: str) -> float:
+    """该 URL 的新鲜期（秒）：HTTP_CACHE_TTL_<SITE> 优先，其次 HTTP_CACHE_TTL。"""
+    from sites import classify
+    site = classify(url)
+    if site:
+        raw = os.getenv(f"HTTP_CACHE_TTL_{site.upper()}")
+        if raw is not None:
+            try:
+                return float(raw)
+            except ValueError:
+                pass
+    return _env_float("HTTP_CACHE_TTL", 0)
+
+
+def lookup(url: str):
+    """返回缓存条目 dict（body 已解压成 str）；没有返回 None。"""
+    if not enabled():
+        return None
+    with _lock:
+        row = _connect().execute(
+            "SELECT etag, last_modified, body_hash, body, size, fetched_at FROM http_cache WHERE url=?",
+            (url,),
+        ).fetchone()
+    if row is None:
+        return None
+    etag, last_modified, body_hash, body, size, fetched_at = row
+    return {
+        "etag": etag,
+        "last_modified": last_modified,
+        "body_hash": body_hash,
+        "body": zlib.decompress(body).decode("utf-8") if body else None,
+        "size": size or 0,
+        "fetched_at": fetched_at or 0,
+    }
+
+
+def fresh(url: str, entry) -> bool:
+    """条目还在新鲜期内且带正文 → 可以不发请求直接用。"""
+    if not entry or entry["body"] is None:
+        return False
+    ttl = ttl_for(url)
+    return ttl > 0 and time.time() - entry["fetched_at"] < ttl
+
+
+def conditional_headers(entry) -> dict:
+    if not entry or entry["body"] is None:
+        return {}
+    headers = {}
+    if entry["etag"]:
+        headers["If-None-Match"] = entry["etag"]
+    if entry["last_modified"]:
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def serve_fresh(entry) -> str:
+    with _lock:
+        _stats["fresh"] += 1
+        _stats["bytes_saved"] += entry["size"]
+    return entry["body"]
+
+
+def revalidated(url: str, entry) -> str:
+    """304：刷新时间戳，返回上次的正文。"""
+    with _lock:
+        conn = _connect()
+        conn.execute("UPDATE http_cache SET fetched_at=? WHERE url=?", (time.time(), url))
+        conn.commit()
+        _stats["revalidated"] += 1
+        _stats["bytes_saved"] += entry["size"]
+    return entry["body"]
+
+
+def store(url: str, headers, html: str, entry=None):
+    """200：写入/更新缓存。没有校验头且 TTL=0 时正文用不上，只存哈希。"""
+    if not enabled():
+        return
+    raw = html.encode("utf-8")
+    body_hash = hashlib.sha1(raw).hexdigest()
+    etag = headers.get("ETag")
+    last_modified = headers.get("Last-Modified")
+    keep_body = bool(etag or last_modified) or ttl_for(url) > 0
+    with _lock:
+        _stats["miss"] += 1
+        if entry and entry["body_hash"] == body_hash:
+            _stats["unchanged"] += 1
+        conn = _connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO http_cache (url, etag, last_modified, body_hash, body, size, fetched_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (url, etag, last_modified, body_hash,
+             zlib.compress(raw, 6) if keep_body else None, len(raw), time.time()),
+        )
+        conn.commit()
+
+
+def close():
+    global _conn, _conn_path
+    with _lock:
+        if _conn is not None:
+            try:
+                _conn.close()
+            except Exception:
+                pass
+        _conn, _conn_path = None, None
+
+
+def stats() -> dict:
+    return dict(_stats)
+
+
+def report(tag: str = "[HTTP_CACHE]"):
+    """打印本轮缓存统计并清零（每个 run_once 结束时调用一次）。"""
+    if any(_stats.values()):
+        print(
+            f"{tag} fresh={_stats['fresh']} not_modified={_stats['revalidated']} "
+            f"downloaded={_stats['miss']} (same_body={_stats['unchanged']}) "
+            f"saved≈{_stats['bytes_saved'] / 1024:.0f}KB"
+        )
+    _stats.update({"fresh": 0, "revalidated": 0, "miss": 0, "unchanged": 0, "bytes_saved": 0})
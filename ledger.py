@@ -0,0 +1,143 @@
+# ledger.py
+# 表格预处理：空值归一、trigger 归一、URL 小写、域名 → 站点，全部按列一次算完（不再逐行 iterrows）。
+# 各站点 run_once 用 rows(df, domains) 拿到轻量的 namedtuple 行流：
+#   for r in ledger.rows(df, ("yahoo.co.jp",)):
+#       r.url / r.item_id / r.sku / r.trigger / r.site
+# trigger 只做 strip + lower + 空值 → ""；空 trigger 的默认含义（soldout 还是“无”）由各站点自己决定。
+# rows() 产出的顺序按主机名轮流交错（见 interleave），同一主机的行保持表格顺序；LEDGER_INTERLEAVE=false 关闭。
+#
+# 分片（workflow matrix 并行跑）：
+#   SHARD_COUNT   分片总数，默认 1（不分片）
+#   SHARD_INDEX   本进程处理第几片，0 ≤ SHARD_INDEX < SHARD_COUNT
+#   SHARD_KEY     url（默认）| sku：按哪个字段的稳定哈希（crc32）分片；sku 为空的行按 url
+# 同一个 key 永远落在同一片，各片互不重叠、合起来正好是整张表。
+import os
+import re
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from sites import SITES
+
+# _is_blank 认为是空的取值（strip + lower 之后）
+BLANKS = ("", "nan", "none", "null")
+
+COLUMNS = ["url", "url_lower", "item_id", "sku", "trigger", "site"]
+
+
+def _clean(df, col: str):
+    """整列转成 strip 过的 str；None/NaN/'nan'/'none'/'null' → ""。列不存在时返回全空列。"""
+    if col not in df.columns:
+        return pd.Series([""] * len(df), index=df.index, dtype=object)
+    s = df[col]
+    if s.dtype.kind == "f":
+        # 带空格子的数字列会被 read_csv 读成 float（123 → "123.0"）；整数值还原成整数写法
+        vals = s.dropna()
+        if (vals == vals.round()).all():
+            s = s.astype("Int64")
+    s = s.astype(object)
+    s = s.where(s.notna(), "").astype(str).str.strip()
+    return s.where(~s.str.lower().isin(BLANKS), "")
+
+
+def _pattern(domains) -> str:
+    return "|".join(re.escape(d) for d in domains)
+
+
+def classify(url_lower):
+    """向量化版 sites.classify：按 SITES 顺序取第一个匹配的站点名，都不匹配为 None。"""
+    conds = [url_lower.str.contains(_pattern(site["domains"]), regex=True)
+             for site in SITES]
+    names = [site["name"] for site in SITES]
+    if not conds:
+        return pd.Series([None] * len(url_lower), index=url_lower.index, dtype=object)
+    out = np.select(conds, names, default="")
+    return pd.Series(out, index=url_lower.index, dtype=object).replace("", None)
+
+
+def shard_spec() -> tuple:
+    """(SHARD_INDEX, SHARD_COUNT)；配置不合法直接报错，免得某一片的行悄悄没人处理。"""
+    try:
+        count = int(os.getenv("SHARD_COUNT", "1") or 1)
+        index = int(os.getenv("SHARD_INDEX", "0") or 0)
+    except ValueError:
+        raise RuntimeError("SHARD_INDEX / SHARD_COUNT must be integers")
+    if count < 1 or not 0 <= index < count:
+        raise RuntimeError(f"invalid shard {index}/{count}: need 0 <= SHARD_INDEX < SHARD_COUNT")
+    return index, count
+
+
+def shard_of(keys, count: int):
+    """每个 key 的分片号（crc32 % count，跨进程/机器稳定，不受 PYTHONHASHSEED 影响）。"""
+    return np.fromiter((zlib.crc32(k.encode("utf-8")) % count for k in keys), dtype=np.int64, count=len(keys))
+
+
+def shard(df):
+    """只保留属于本分片的行（SHARD_COUNT<=1 时原样返回）。df 须是 prepare 过的。"""
+    index, count = shard_spec()
+    if count <= 1 or df.empty:
+        return df
+    if os.getenv("SHARD_KEY", "url").strip().lower() == "sku":
+        keys = df["sku"].where(df["sku"] != "", df["url_lower"])
+    else:
+        keys = df["url_lower"]
+    kept = df[shard_of(keys.tolist(), count) == index]
+    print(f"[LEDGER] shard {index}/{count}: {len(kept)} of {len(df)} rows")
+    return kept
+
+
+def prepare(df):
+    """
+    原始表 → 规范化后的 DataFrame（列见 COLUMNS），source_url 为空的行直接丢掉，
+    设置了 SHARD_COUNT 时只留本分片的行。
+    已经 prepare 过的（main_all 传进来的分片）原样返回。
+    """
+    if df is None:
+        return pd.DataFrame(columns=COLUMNS)
+    if all(c in df.columns for c in COLUMNS):
+        return df
+    url = _clean(df, "source_url")
+    out = pd.DataFrame({
+        "url": url,
+        "url_lower": url.str.lower(),
+        "item_id": _clean(df, "ebay_item_id"),
+        "sku": _clean(df, "sku"),
+        "trigger": _clean(df, "trigger").str.lower(),
+    }, index=df.index)
+    out = out[out["url"] != ""]
+    out["site"] = classify(out["url_lower"])
+    return shard(out)
+
+
+def select(df, domains):
+    """只保留 URL 含 domains 任一子串的行（与原来各 main_* 的 `"xxx" in url.lower()` 判定一致）。"""
+    df = prepare(df)
+    if df.empty:
+        return df
+    mask = df["url_lower"].str.contains(_pattern(domains), regex=True)
+    return df[mask]
+
+
+def interleave(df):
+    """
+    按主机名（去掉 www.）轮流排行：a1 b1 c1 a2 b2 c2 ...，同一主机内保持原顺序。
+    连续的请求分散到不同主机，多个抓取线程同时取令牌时各用各的桶（ratelimit.py），不挤在同一个域名上等。
+    """
+    if len(df) < 2 or os.getenv("LEDGER_INTERLEAVE", "true").strip().lower() != "true":
+        return df
+    host = df["url_lower"].str.extract(r"^[a-z][a-z0-9+.\-]*://(?:www\.)?([^/:?#]+)", expand=False).fillna("")
+    if host.nunique() < 2:
+        return df
+    order = pd.DataFrame({
+        "turn": host.groupby(host).cumcount().to_numpy(),
+        "host": pd.factorize(host)[0],
+        "pos": np.arange(len(df)),
+    })
+    return df.iloc[order.sort_values(["turn", "host", "pos"]).index.to_numpy()]
+
+
+def rows(df, domains=None):
+    """逐行产出 namedtuple（url, url_lower, item_id, sku, trigger, site），按主机名交错；domains 为空则不过滤。"""
+    df = prepare(df) if domains is None else select(df, domains)
+    return interleave(df)[COLUMNS].itertuples(index=False, name="LedgerRow")
@@ -0,0 +1,75 @@
+# main_all.py
+# 单次运行处理所有站点：只读一次表，按域名把行分给各站点的 run_once(df=...)。
+# 同一进程内共用常驻浏览器池 / requests Session / eBay / Telegram，
+# 一个 workflow 只需安装一次 Chromium。
+#
+# RUN_SITES=amazon,yahoo  只跑指定站点（默认全部，名字见 sites.SITE_NAMES）
+# SHARD_INDEX/SHARD_COUNT  只处理表格的第 i 片（见 ledger.py；workflow matrix 并行，merge_summaries.py 合并各片结果）
+import os
+import importlib
+import traceback
+from dotenv import load_dotenv
+
+from sheet_reader import read_ledger
+from sites import SITES, SITE_NAMES
+import ledger
+import metrics
+
+load_dotenv()
+
+
+def _enabled_sites() -> list:
+    raw = os.getenv("RUN_SITES", "").strip().lower()
+    if not raw:
+        return list(SITE_NAMES)
+    wanted = [x.strip() for x in raw.split(",") if x.strip()]
+    unknown = [x for x in wanted if x not in SITE_NAMES]
+    if unknown:
+        print(f"[ALL] unknown RUN_SITES ignored: {unknown}")
+    return [x for x in SITE_NAMES if x in wanted]
+
+
+def partition(df) -> dict:
+    """按站点拆分 DataFrame：{site_name: sub_df}；不认识的域名丢弃。"""
+    if "source_url" not in df.columns:
+        return {}
+    # 空值归一 / URL 小写 / 站点分类按列一次算完，各站点拿到的是已预处理的分片
+    df = ledger.prepare(df)
+    site_col = df["site"]
+    return {name: df[site_col == name] for name in SITE_NAMES if (site_col == name).any()}
+
+
+def run_once():
+    with metrics.run_stage("ledger_read", "all"):
+        df = read_ledger()
+    with metrics.run_stage("partition", "all"):
+        parts = partition(df)
+    counts = " ".join(f"{k}={len(v)}" for k, v in parts.items())
+    print(f"[ALL] ledger rows={len(df)} {counts or '(no site matched)'}")
+
+    enabled = _enabled_sites()
+    failed = []
+    for site in SITES:
+        name = site["name"]
+        if name not in enabled:
+            continue
+        part = parts.get(name)
+        if part is None or part.empty:
+            continue
+        print(f"[ALL] ===== {name}: {len(part)} rows =====")
+        runner = importlib.import_module(site["runner"])
+        try:
+            with metrics.run_stage(f"run_once:{name}", "all"):
+                runner.run_once(df=part)
+        except Exception:
+            # 一个站点出错不影响其它站点；最后统一报错让 workflow 标红
+            traceback.print_exc()
+            failed.append(name)
+
+    metrics.report("[ALL] METRICS", "all")
+    if failed:
+        raise RuntimeError(f"sites failed: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    run_once()
@@ -13,21 +13,21 @@ import os
 from dotenv import load_dotenv
 
 from sheet_reader import read_ledger
+import ledger
 from fetcher import fetch
-from detectors import amazon
-from ebay_updater import update_qty_with_fallback
-from notify import notify
+from ebay_updater import ZeroBatch
+from notify import notify, flush_digest, outbox_report
+import resource_blocker
+import http_cache
+import ratelimit
+import state_store
+import metrics
+import profiling
+import pipeline
 
 load_dotenv()
 
 
-def _is_blank(v) -> bool:
-    if v is None:
-        return True
-    s = str(v).strip().lower()
-    return s in ("", "nan", "none", "null")
-
-
 def norm_trigger(v: str) -> str:
     s = str(v or "").strip().lower()
     if s in ("nan", "none", "null"):
@@ -35,8 +35,8 @@ def norm_trigger(v: str) -> str:
     return s
 
 
-def _looks_amazon(url: str) -> bool:
-    return "amazon.co.jp" in (url or "").lower()
+# source_url 含任一子串即归本站点处理
+DOMAINS = ("amazon.co.jp",)
 
 
 def should_zero(trigger: str, status: str, http_code: int) -> bool:
@@ -63,51 +63,80 @@ def should_zero(trigger: str, status: str, http_code: int) -> bool:
     return False
 
 
-def run_once():
-    df = read_ledger()
-    matched = 0
+@profiling.profiled("amazon")
+def run_once(df=None):
+    if df is None:
+        with metrics.run_stage("ledger_read", "amazon"):
+            df = read_ledger()
+    # 清零请求攒批交给流水线的 eBay 段发送（每次最多 4 个商品），通知在每批返回后按商品逐个发
+    batch = ZeroBatch(site="amazon")
 
-    for _, row in df.iterrows():
-        url = str(row.get("source_url", "") or "").strip()
-        if not url or not _looks_amazon(url):
-            continue
-        matched += 1
+    # 表格已按列预处理（空值/trigger 归一、域名筛选），这里只是遍历轻量的行元组
+    rows = list(ledger.rows(df, DOMAINS))
+    matched = len(rows)
 
-        item_id = "" if _is_blank(row.get("ebay_item_id")) else str(row.get("ebay_item_id")).strip()
-        sku     = "" if _is_blank(row.get("sku")) else str(row.get("sku")).strip()
-        trigger = norm_trigger(row.get("trigger", ""))  # 你在表格里手工填写
+    def _start(r):
+        url, item_id, sku = r.url, r.item_id, r.sku
+        trigger = norm_trigger(r.trigger)  # 你在表格里手工填写
 
-        ident = sku if sku else (item_id if item_id else "(no-id)")
+        # 自适应复查：状态长期稳定/已清零的商品没到复查时间，本轮不抓
+        if not state_store.is_due(url, item_id, sku):
+            return None
+        metrics.row("amazon", url, item_id=item_id, sku=sku, trigger=trigger)
+
+        # 流水线 fetch 段（在抓取线程里跑）：只取页面；解析/判定和 AUTO 升级交给 parse_pool
+        with metrics.stage("fetch"):
+            code, html = fetch(url, escalate=False)
+        metrics.note(http=code, bytes=len(html))
+        return (url, item_id, sku, trigger), url, code, html
 
-        # 抓页面
-        code, html = fetch(url)
+    def _finish(ctx, code, html, analysis):
+        url, item_id, sku, trigger = ctx
+        ident = sku if sku else (item_id if item_id else "(no-id)")
 
-        # 解析状态/价格（价格仅供日志参考，不触发清零）
-        status = "UNKNOWN" if code != 200 else amazon.detect(html)
-        price  = None if code != 200 else amazon.extract_price(html)
+        # 状态/价格（价格仅供日志参考，不触发清零）；页面只解析一次，两者共用
+        status = "UNKNOWN" if analysis is None else analysis["status"]
+        price  = None if analysis is None else analysis.get("price")
 
         print(f"[AMAZON] {url} HTTP={code} status={status} price={price} trigger={trigger or '∅'} sku={sku or '∅'}")
+        state_store.observe(url, item_id, sku, "DELETED" if code in (404, 410) else status)
+        metrics.note(status="DELETED" if code in (404, 410) else status)
 
         # 判断是否需要清 0
         if not should_zero(trigger, status, code):
             print(f"SKIP: {ident} (no clear). trigger={trigger or '∅'} status={status}\n")
-            continue
+            return
+        if not state_store.needs_push(url, item_id, sku, 0):
+            print(f"[AMAZON] already zeroed, status unchanged → skip: {ident}")
+            return
 
         # 执行清 0（SKU 优先，SKU无效则自动回退到 ItemID）
         reason = "link_deleted" if code in (404, 410) else f"trigger_match:{trigger or 'auto'}"
         print(f"[AMAZON] CLEAR_ZERO attempt: {ident} reason={reason}")
 
-        res = update_qty_with_fallback(item_id=item_id, sku=sku, quantity=0)
-        print("eBay update:", res)
-
-        # 通知结果（只在真正执行清 0 后才通知）
-        if res.get("ok"):
-            notify(f"✅ eBay 库存已清零：{ident}\n原因：{reason}\n{url}")
-        else:
-            status_code = res.get("status")
-            body = res.get("body") or res.get("error") or ""
-            snippet = str(body)[:500]
-            notify(f"❌ eBay 清零失败：{ident}\n原因：{reason}\nHTTP={status_code}\n{snippet}\n{url}")
+        def _on_done(res, ident=ident, reason=reason, url=url):
+            print("eBay update:", res)
+
+            # 通知结果（只在真正执行清 0 后才通知）
+            if res.get("ok"):
+                notify(f"✅ eBay 库存已清零：{ident}\n原因：{reason}\n{url}")
+            else:
+                status_code = res.get("status")
+                body = res.get("body") or res.get("error") or ""
+                snippet = str(body)[:500]
+                notify(f"❌ eBay 清零失败：{ident}\n原因：{reason}\nHTTP={status_code}\n{snippet}\n{url}", critical=True)
+
+        batch.add(item_id, sku, on_done=_on_done, url=url)
+
+    pipeline.run("amazon", rows, _start, _finish)
+    batch.flush()
+    resource_blocker.report("[AMAZON] PW_BLOCK")
+    http_cache.report("[AMAZON] HTTP_CACHE")
+    ratelimit.report("[AMAZON] RATE", "amazon")
+    state_store.report("[AMAZON] STATE")
+    metrics.report("[AMAZON] METRICS", "amazon")
+    flush_digest("[AMAZON]")
+    outbox_report("[AMAZON] OUTBOX")
 
     if matched == 0:
         print("No Amazon rows matched. Check headers/domains.")
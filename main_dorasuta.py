@@ -2,21 +2,21 @@ import os
 from dotenv import load_dotenv
 
 from sheet_reader import read_ledger
+import ledger
 from fetcher import fetch
-from detectors import dorasuta
-from ebay_updater import update_qty_with_fallback
-from notify import notify
+from ebay_updater import ZeroBatch
+from notify import notify, flush_digest, outbox_report
+import resource_blocker
+import http_cache
+import ratelimit
+import state_store
+import metrics
+import profiling
+import pipeline
 
 load_dotenv()
 
 
-def _is_blank(v) -> bool:
-    if v is None:
-        return True
-    s = str(v).strip().lower()
-    return s in ("", "nan", "none", "null", "")
-
-
 def norm_trigger(v: str) -> str:
     s = str(v or "").strip().lower()
     return "soldout" if s in ("", "nan", "none", "null", "") else s
@@ -34,49 +34,87 @@ def should_zero(trigger: str, status: str) -> bool:
     return False
 
 
-def _looks_dorasuta(url: str) -> bool:
-    u = (url or "").lower()
-    return "dorasuta.jp" in u
+# source_url 含任一子串即归本站点处理
+DOMAINS = ("dorasuta.jp",)
 
 
-def run_once():
-    df = read_ledger()
-    matched = 0
+@profiling.profiled("dorasuta")
+def run_once(df=None):
+    if df is None:
+        with metrics.run_stage("ledger_read", "dorasuta"):
+            df = read_ledger()
+    # 清零请求攒批交给流水线的 eBay 段发送（每次最多 4 个商品），通知在每批返回后按商品逐个发
+    batch = ZeroBatch(site="dorasuta")
 
-    for _, row in df.iterrows():
-        url = str(row.get("source_url", "") or "").strip()
-        if not url or not _looks_dorasuta(url):
-            continue
-        matched += 1
+    # 表格已按列预处理（空值/trigger 归一、域名筛选），这里只是遍历轻量的行元组
+    rows = list(ledger.rows(df, DOMAINS))
+    matched = len(rows)
 
-        item_id = "" if _is_blank(row.get("ebay_item_id")) else str(row.get("ebay_item_id")).strip()
-        sku     = "" if _is_blank(row.get("sku")) else str(row.get("sku")).strip()
-        trigger = norm_trigger(row.get("trigger", ""))
+    def _start(r):
+        url, item_id, sku = r.url, r.item_id, r.sku
+        trigger = norm_trigger(r.trigger)
 
-        ident = sku if sku else (item_id if item_id else "(no-id)")
+        # 自适应复查：状态长期稳定/已清零的商品没到复查时间，本轮不抓
+        if not state_store.is_due(url, item_id, sku):
+            return None
+        metrics.row("dorasuta", url, item_id=item_id, sku=sku, trigger=trigger)
+
+        # 流水线 fetch 段（在抓取线程里跑）：只取页面；解析/判定和 AUTO 升级交给 parse_pool
+        with metrics.stage("fetch"):
+            code, html = fetch(url, escalate=False)
+        metrics.note(http=code, bytes=len(html))
+        return (url, item_id, sku, trigger), url, code, html
 
-        code, html = fetch(url)
+    def _finish(ctx, code, html, analysis):
+        url, item_id, sku, trigger = ctx
+        ident = sku if sku else (item_id if item_id else "(no-id)")
         if code in (404, 410):
             print(f"[DORASUTA] {url} HTTP={code} status=DELETED trigger={trigger} sku={sku or '∅'}")
-            res = update_qty_with_fallback(item_id=item_id, sku=sku, quantity=0)
-            if res.get("ok"):
-                notify(f"🗑️ [DORASUTA] 链接失效 → eBay 已清零：{ident}\nSKU: {sku or '-'}\n{url}")
-            else:
-                notify(f"❌ [DORASUTA] 链接失效但 eBay 清零失败：{ident}\n{url}")
-            continue
-
-        status = "UNKNOWN" if code != 200 else dorasuta.detect(html)
+            state_store.observe(url, item_id, sku, "DELETED")
+            metrics.note(status="DELETED")
+            if not state_store.needs_push(url, item_id, sku, 0):
+                print(f"[DORASUTA] already zeroed, status unchanged → skip: {ident}")
+                return
+            def _on_deleted(res, ident=ident, sku=sku, url=url):
+                if res.get("ok"):
+                    notify(f"🗑️ [DORASUTA] 链接失效 → eBay 已清零：{ident}\nSKU: {sku or '-'}\n{url}")
+                else:
+                    notify(f"❌ [DORASUTA] 链接失效但 eBay 清零失败：{ident}\n{url}", critical=True)
+
+            batch.add(item_id, sku, on_done=_on_deleted, url=url)
+            return
+
+        status = "UNKNOWN" if analysis is None else analysis["status"]
         print(f"[DORASUTA] {url} HTTP={code} status={status} trigger={trigger} sku={sku or '∅'}")
+        state_store.observe(url, item_id, sku, status)
+        metrics.note(status=status)
 
         if not should_zero(trigger, status):
-            continue
+            return
+        if not state_store.needs_push(url, item_id, sku, 0):
+            print(f"[DORASUTA] already zeroed, status unchanged → skip: {ident}")
+            return
 
         notify(f"⚠️ [DORASUTA] 检测到售罄：{ident}\nSKU: {sku or '-'}\n{url}")
-        res = update_qty_with_fallback(item_id=item_id, sku=sku, quantity=0)
-        if res.get("ok"):
-            notify(f"✅ [DORASUTA] eBay 已清零：{ident}\nSKU: {sku or '-'}\n{url}")
-        else:
-            notify(f"❌ [DORASUTA] eBay 清零失败：{ident}\n{url}")
+
+        def _on_done(res, ident=ident, sku=sku, url=url):
+            if res.get("ok"):
+                notify(f"✅ [DORASUTA] eBay 已清零：{ident}\nSKU: {sku or '-'}\n{url}")
+            else:
+                notify(f"❌ [DORASUTA] eBay 清零失败：{ident}\n{url}", critical=True)
+
+        batch.add(item_id, sku, on_done=_on_done, url=url)
+
+    pipeline.run("dorasuta", rows, _start, _finish)
+    batch.flush()
+
+    resource_blocker.report("[DORASUTA] PW_BLOCK")
+    http_cache.report("[DORASUTA] HTTP_CACHE")
+    ratelimit.report("[DORASUTA] RATE", "dorasuta")
+    state_store.report("[DORASUTA] STATE")
+    metrics.report("[DORASUTA] METRICS", "dorasuta")
+    flush_digest("[DORASUTA]")
+    outbox_report("[DORASUTA] OUTBOX")
 
     if matched == 0:
         print("No Dorasuta rows matched. Check source_url/domain.")
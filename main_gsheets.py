@@ -2,29 +2,29 @@
 # -*- coding: utf-8 -*-
 
 import os
+import time
+import asyncio
 from dotenv import load_dotenv
 
 from sheet_reader import read_ledger
-from fetcher import fetch
+import ledger
+from fetcher import fetch, fetch_requests
 from detectors import mercari
-from ebay_updater import update_qty_with_fallback
-from notify import notify
-
-from playwright.sync_api import sync_playwright
+from ebay_updater import ZeroBatch
+from notify import notify, flush_digest, outbox_report
+import resource_blocker
+import http_cache
+import ratelimit
+import state_store
+import metrics
+import profiling
+import browser_pool
 
 load_dotenv()
 
 
 # -------------------- 辅助函数 --------------------
 
-def _is_blank(value) -> bool:
-    """将 None / 空串 / 'nan' / 'none' / 'null' 统一当作空"""
-    if value is None:
-        return True
-    s = str(value).strip().lower()
-    return s in ("", "nan", "none", "null")
-
-
 def norm_trigger(v: str) -> str:
     """把 trigger 标准化：空/无效 视作 'soldout'；其它统一转小写"""
     s = str(v or "").strip().lower()
@@ -65,139 +65,358 @@ def _format_used(res: dict) -> str:
     return u1 or u2 or ""
 
 
-# -------------------- 主流程 --------------------
+# -------------------- 单行处理（同步/并发两种模式共用） --------------------
+
+UA = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+      "(KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36")
+
+CTX_OPTIONS = dict(
+    locale="ja-JP",
+    user_agent=UA,
+    viewport={"width": 1280, "height": 900},
+    java_script_enabled=True,
+)
 
-def run_once():
-    # 读取清单（你的 sheet_reader 已做了重试/超时）
-    df = read_ledger()
 
+def _concurrency() -> int:
+    """MERCARI_CONCURRENCY：同时在跑的页面数；<=1 时走原来的逐条同步模式。"""
+    try:
+        return max(1, int(os.getenv("MERCARI_CONCURRENCY", "1")))
+    except ValueError:
+        return 1
+
+
+def _collect_rows(df):
+    """筛出 Mercari 行，返回 ([(url, item_id, sku, rule_trigger), ...], matched)。"""
+    rows = []
     matched = 0
-    UA = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-          "(KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36")
-
-    with sync_playwright() as pw:
-        browser = pw.chromium.launch(headless=True)
-        ctx = browser.new_context(
-            locale="ja-JP",
-            user_agent=UA,
-            viewport={"width": 1280, "height": 900},
-            java_script_enabled=True,
+    # 表格已按列预处理（空值/trigger 归一、域名筛选），这里只是遍历轻量的行元组
+    for r in ledger.rows(df, ("mercari.com", "jp.mercari.com")):
+        matched += 1
+
+        url, item_id, sku = r.url, r.item_id, r.sku
+        rule_trigger = norm_trigger(r.trigger)  # 表格里的“规则触发词”
+
+        if (not sku) and (not item_id):
+            print(f"[MERCARI] {url} both SKU & ItemID missing, skip.\n")
+            continue
+
+        # 自适应复查：状态长期稳定/已清零的商品没到复查时间，本轮不抓
+        if not state_store.is_due(url, item_id, sku):
+            continue
+
+        rows.append((url, item_id, sku, rule_trigger))
+    return rows, matched
+
+
+def _check_page(page, url: str):
+    """同步 Page：导航 + 判定，返回 (http_code, det_status, det_trigger, ttd_ms)。"""
+    # —— 先 Playwright 导航（主路径）——
+    det_status, det_trigger = "UNKNOWN", "navigate-fail"
+    http_code = 0
+    t0 = time.monotonic()
+    try:
+        ratelimit.wait(url)
+        resp = page.goto(url, wait_until="domcontentloaded", timeout=35000)
+        http_code = resp.status if resp else 0
+
+        # 所有在售/售罄信号同时等待，先到先判（上限 MERCARI_DEADLINE_MS）
+        det_status, det_trigger = mercari.detect(page)
+
+        # 极少数水合异常：再用当前 DOM 的 HTML 做一次兜底
+        # （截止时间到了仍无信号的不兜底：整页 HTML 里推荐卡片的 SOLD 缎带会把在售商品判成售罄）
+        if det_status == "UNKNOWN" and det_trigger != mercari.TRIGGER_NO_SIGNAL:
+            html_now = page.content()
+            _s, _t = mercari.detect(html_now)
+            if _s != "UNKNOWN":
+                det_status, det_trigger = _s, f"fallback:{_t}"
+
+    except Exception as e:
+        # Playwright 导航失败：最后尝试 requests 兜底（也把 HTTP 码带上）
+        try:
+            http_code, html2 = fetch(url, detect=mercari.detect)
+            _s, _t = mercari.detect(html2)
+            det_status = _s
+            det_trigger = f"html:{_t}"
+        except Exception:
+            det_status, det_trigger = "UNKNOWN", f"exception:{type(e).__name__}"
+    # time-to-decision：从开始导航到得出结论
+    return http_code, det_status, det_trigger, int((time.monotonic() - t0) * 1000)
+
+
+async def _check_page_async(page, url: str):
+    """async Page 版 _check_page；兜底只走 requests（事件循环里不能再开同步 Playwright）。"""
+    det_status, det_trigger = "UNKNOWN", "navigate-fail"
+    http_code = 0
+    t0 = time.monotonic()
+    try:
+        await ratelimit.wait_async(url)
+        resp = await page.goto(url, wait_until="domcontentloaded", timeout=35000)
+        http_code = resp.status if resp else 0
+
+        det_status, det_trigger = await mercari.detect_async(page)
+
+        if det_status == "UNKNOWN" and det_trigger != mercari.TRIGGER_NO_SIGNAL:
+            html_now = await page.content()
+            _s, _t = mercari.detect(html_now)
+            if _s != "UNKNOWN":
+                det_status, det_trigger = _s, f"fallback:{_t}"
+
+    except Exception as e:
+        try:
+            http_code, html2 = await asyncio.to_thread(fetch_requests, url)
+            _s, _t = mercari.detect(html2)
+            det_status = _s
+            det_trigger = f"html:{_t}"
+        except Exception:
+            det_status, det_trigger = "UNKNOWN", f"exception:{type(e).__name__}"
+    return http_code, det_status, det_trigger, int((time.monotonic() - t0) * 1000)
+
+
+def _fast_path_enabled() -> bool:
+    return os.getenv("MERCARI_FAST_PATH", "true").strip().lower() == "true"
+
+
+def _check_fast(url: str):
+    """
+    免渲染快速路径：requests 取静态 HTML，只按结构化字段（ld+json / meta availability）判定。
+    返回与 _check_page 相同的 (http_code, det_status, det_trigger, ttd_ms)；判不出返回 None。
+    非 200（包括 404/410）一律返回 None：不经浏览器的请求可能被反爬过滤 / 临时路由错误拿到 404，
+    _handle_result 见到 404/410 会直接按删除清零，所以删除只认 _check_page 渲染时拿到的状态码。
+    """
+    t0 = time.monotonic()
+    http_code, html = fetch_requests(url)
+    ttd_ms = int((time.monotonic() - t0) * 1000)
+    if http_code != 200:
+        return None
+    det_status, det_trigger = mercari.detect_structured(html)
+    if det_status == "UNKNOWN":
+        return None
+    return http_code, det_status, det_trigger, ttd_ms
+
+
+def _notify_deleted(res, url, item_id, sku, http_code):
+    print("eBay update (deleted link):", res)
+    used_path = _format_used(res)
+    if res.get("ok"):
+        notify(
+            f"🗑️ [MERCARI] 链接失效（HTTP {http_code}）→ eBay 已清零\n"
+            f"SKU={sku or '∅'}  ItemID={item_id or '∅'}  方式={used_path}\n{url}"
         )
-        page = ctx.new_page()
-
-        for _, row in df.iterrows():
-            url = str(row.get("source_url", "") or "").strip()
-            if not url:
-                continue
-            low_url = url.lower()
-            if ("mercari.com" not in low_url) and ("jp.mercari.com" not in low_url):
-                # 只处理 Mercari
-                continue
-
-            matched += 1
-
-            item_id_raw = row.get("ebay_item_id", "")
-            sku_raw = row.get("sku", "")
-            rule_trigger_raw = row.get("trigger", "")  # 表格里的“规则触发词”
-
-            item_id = "" if _is_blank(item_id_raw) else str(item_id_raw).strip()
-            sku = "" if _is_blank(sku_raw) else str(sku_raw).strip()
-            rule_trigger = norm_trigger(rule_trigger_raw)
-
-            if (not sku) and (not item_id):
-                print(f"[MERCARI] {url} both SKU & ItemID missing, skip.\n")
-                continue
-
-            # —— 先 Playwright 导航（主路径）——
-            det_status, det_trigger = "UNKNOWN", "navigate-fail"
-            http_code = 0
-            try:
-                resp = page.goto(url, wait_until="domcontentloaded", timeout=35000)
-                http_code = resp.status if resp else 0
-
-                # 强判定：可点击“購入手続きへ”才判在售
-                det_status, det_trigger = mercari.detect(page)
-
-                # 极少数水合异常：再用当前 DOM 的 HTML 做一次兜底
-                if det_status == "UNKNOWN":
-                    html_now = page.content()
-                    _s, _t = mercari.detect(html_now)
-                    if _s != "UNKNOWN":
-                        det_status, det_trigger = _s, f"fallback:{_t}"
-
-            except Exception as e:
-                # Playwright 导航失败：最后尝试 requests 兜底（也把 HTTP 码带上）
-                try:
-                    http_code, html2 = fetch(url)
-                    _s, _t = mercari.detect(html2)
-                    det_status = _s
-                    det_trigger = f"html:{_t}"
-                except Exception:
-                    det_status, det_trigger = "UNKNOWN", f"exception:{type(e).__name__}"
-
-            # 明确的 404/410（不常见，Playwright也能拿到）
-            if http_code in (404, 410):
-                print(f"[MERCARI] {url} HTTP-{http_code} status=DELETED trigger={rule_trigger} sku={sku or '∅'}")
-                res = update_qty_with_fallback(item_id=item_id, sku=sku, quantity=0)
-                print("eBay update (deleted link):", res)
-                used_path = _format_used(res)
-                if res.get("ok"):
-                    notify(
-                        f"🗑️ [MERCARI] 链接失效（HTTP {http_code}）→ eBay 已清零\n"
-                        f"SKU={sku or '∅'}  ItemID={item_id or '∅'}  方式={used_path}\n{url}"
-                    )
-                else:
-                    last = res.get("second") or res.get("first") or {}
-                    status_code = last.get("status")
-                    body = last.get("body") or last.get("error") or res.get("error") or ""
-                    snippet = str(body)[:500]
-                    used = last.get("used") or used_path
-                    notify(
-                        f"❌ [MERCARI] 链接失效但 eBay 清零失败\n"
-                        f"SKU={sku or '∅'}  ItemID={item_id or '∅'}  方式={used}\n"
-                        f"HTTP={status_code}\n{snippet}\n{url}"
-                    )
-                # 删除型处理完就进入下一条
-                continue
-
-            print(f"[MERCARI] {url} HTTP-{http_code} status={det_status} trigger={det_trigger} sku={sku}")
-
-            # —— 根据“表格里的规则触发词”决定是否清 0 —— #
-            if not should_zero(rule_trigger, det_status):
-                continue
-
-            # ① 提示
-            notify(
-                f"⚠️ [MERCARI] 检测到售罄/失效，准备清零\n"
-                f"SKU={sku or '∅'}  ItemID={item_id or '∅'}\n"
-                f"检测={det_status}/{det_trigger}\n{url}"
-            )
+    else:
+        last = res.get("second") or res.get("first") or {}
+        status_code = last.get("status")
+        body = last.get("body") or last.get("error") or res.get("error") or ""
+        snippet = str(body)[:500]
+        used = last.get("used") or used_path
+        notify(
+            f"❌ [MERCARI] 链接失效但 eBay 清零失败\n"
+            f"SKU={sku or '∅'}  ItemID={item_id or '∅'}  方式={used}\n"
+            f"HTTP={status_code}\n{snippet}\n{url}",
+            critical=True,
+        )
+
 
-            # ② eBay 清 0（SKU 优先，必要时回退 ItemID）
-            res = update_qty_with_fallback(item_id=item_id, sku=sku, quantity=0)
-            print("eBay update:", res)
-
-            # ③ 根据结果通知
-            used_path = _format_used(res)
-            if res.get("ok"):
-                notify(
-                    f"✅ eBay 库存已清零\n"
-                    f"SKU={sku or '∅'}  ItemID={item_id or '∅'}  方式={used_path}\n{url}"
-                )
+def _notify_zeroed(res, url, item_id, sku):
+    print("eBay update:", res)
+    used_path = _format_used(res)
+    if res.get("ok"):
+        notify(
+            f"✅ eBay 库存已清零\n"
+            f"SKU={sku or '∅'}  ItemID={item_id or '∅'}  方式={used_path}\n{url}"
+        )
+    else:
+        last = res.get("second") or res.get("first") or {}
+        status_code = last.get("status")
+        body = last.get("body") or last.get("error") or res.get("error") or ""
+        snippet = str(body)[:500]
+        used = last.get("used") or used_path
+        notify(
+            f"❌ eBay 清零失败\n"
+            f"SKU={sku or '∅'}  ItemID={item_id or '∅'}  方式={used}\n"
+            f"HTTP={status_code}\n{snippet}\n{url}",
+            critical=True,
+        )
+
+
+def _handle_result(batch, url, item_id, sku, rule_trigger, http_code, det_status, det_trigger, ttd_ms=0):
+    """
+    拿到判定结果后：should_zero → eBay 清零 → 通知。
+    清零请求交给 batch（ZeroBatch）攒批发送，结果通知在该批返回后发出。
+    """
+    # 明确的 404/410（不常见，Playwright也能拿到）
+    if http_code in (404, 410):
+        print(f"[MERCARI] {url} HTTP-{http_code} status=DELETED trigger={rule_trigger} sku={sku or '∅'}")
+        state_store.observe(url, item_id, sku, "DELETED")
+        metrics.note(status="DELETED")
+        if not state_store.needs_push(url, item_id, sku, 0):
+            print(f"[MERCARI] already zeroed, status unchanged → skip: {sku or item_id}")
+            return
+        batch.add(item_id, sku, on_done=lambda res: _notify_deleted(res, url, item_id, sku, http_code), url=url)
+        # 删除型处理完就进入下一条
+        return
+
+    print(f"[MERCARI] {url} HTTP-{http_code} status={det_status} trigger={det_trigger} sku={sku} ttd={ttd_ms}ms")
+    state_store.observe(url, item_id, sku, det_status)
+    metrics.note(status=det_status)
+
+    # —— 根据“表格里的规则触发词”决定是否清 0 —— #
+    if not should_zero(rule_trigger, det_status):
+        return
+    if not state_store.needs_push(url, item_id, sku, 0):
+        print(f"[MERCARI] already zeroed, status unchanged → skip: {sku or item_id}")
+        return
+
+    # ① 提示
+    notify(
+        f"⚠️ [MERCARI] 检测到售罄/失效，准备清零\n"
+        f"SKU={sku or '∅'}  ItemID={item_id or '∅'}\n"
+        f"检测={det_status}/{det_trigger}\n{url}"
+    )
+
+    # ② eBay 清 0（SKU 优先，必要时回退 ItemID）；③ 结果通知在回调里
+    batch.add(item_id, sku, on_done=lambda res: _notify_zeroed(res, url, item_id, sku), url=url)
+
+
+# -------------------- 主流程 --------------------
+
+def _run_sync(rows, batch, stats):
+    # 浏览器来自常驻池（main_loop 多轮之间复用）；本轮的 context 等第一次真正需要渲染时才建
+    ctx = None
+    page = None
+    try:
+        for url, item_id, sku, rule_trigger in rows:
+            metrics.row("mercari", url, item_id=item_id, sku=sku, trigger=rule_trigger)
+            result = None
+            if _fast_path_enabled():
+                with metrics.stage("fast"):
+                    result = _check_fast(url)
+            if result is not None:
+                stats["fast"] += 1
             else:
-                last = res.get("second") or res.get("first") or {}
-                status_code = last.get("status")
-                body = last.get("body") or last.get("error") or res.get("error") or ""
-                snippet = str(body)[:500]
-                used = last.get("used") or used_path
-                notify(
-                    f"❌ eBay 清零失败\n"
-                    f"SKU={sku or '∅'}  ItemID={item_id or '∅'}  方式={used}\n"
-                    f"HTTP={status_code}\n{snippet}\n{url}"
-                )
-
-        ctx.close()
-        browser.close()
+                if page is None:
+                    ctx = browser_pool.new_context(**CTX_OPTIONS)
+                    page = ctx.new_page()
+                stats["rendered"] += 1
+                metrics.fallback("browser")
+                with metrics.stage("render"):
+                    result = _check_page(page, url)
+            http_code, det_status, det_trigger, ttd_ms = result
+            metrics.note(http=http_code, detector=det_trigger, ttd_ms=ttd_ms)
+            _handle_result(batch, url, item_id, sku, rule_trigger, http_code, det_status, det_trigger, ttd_ms)
+        metrics.end()
+    finally:
+        # 持久 profile（PW_PROFILE_DIR）的 context 是共用的，只关本轮开的页面
+        browser_pool.release_context(ctx, pages=[page])
+
+
+async def _run_async(rows, batch, concurrency: int, stats):
+    """
+    并发模式：同一个 context 里开 concurrency 个页面，Semaphore 限制同时在途的 URL 数。
+    页面判定在事件循环里并发；eBay 清零/通知是阻塞调用，丢到线程里跑，不占用页面。
+    快速路径（纯 HTTP）单独限流，判不出的行才去排队等页面；浏览器第一次需要时才启动。
+    """
+    from playwright.async_api import async_playwright
+
+    async with async_playwright() as pw:
+        state = {"browser": None, "ctx": None}
+        pages = asyncio.Queue()
+        launch_lock = asyncio.Lock()
+
+        async def _ensure_browser():
+            async with launch_lock:
+                if state["ctx"] is None:
+                    if browser_pool.profile_dir():
+                        # 持久 profile：HTTP 缓存 / cookie 跨 run 复用（目录与上限见 browser_pool）
+                        ctx = await pw.chromium.launch_persistent_context(
+                            browser_pool.prepare_profile(), headless=True,
+                            args=browser_pool.profile_args(), **CTX_OPTIONS)
+                    else:
+                        state["browser"] = await pw.chromium.launch(headless=True)
+                        ctx = await state["browser"].new_context(**CTX_OPTIONS)
+                    await resource_blocker.install_async(ctx)
+                    for _ in range(concurrency):
+                        pages.put_nowait(await ctx.new_page())
+                    state["ctx"] = ctx
+            return state["ctx"]
+
+        sem = asyncio.Semaphore(concurrency)
+        http_sem = asyncio.Semaphore(concurrency)
+
+        async def _one(url, item_id, sku, rule_trigger):
+            # 每个 _one 是独立的 Task（各自一份 contextvars），当前行互不干扰
+            metrics.row("mercari", url, item_id=item_id, sku=sku, trigger=rule_trigger)
+            result = None
+            if _fast_path_enabled():
+                async with http_sem:
+                    with metrics.stage("fast"):
+                        result = await asyncio.to_thread(_check_fast, url)
+            if result is not None:
+                stats["fast"] += 1
+            else:
+                stats["rendered"] += 1
+                metrics.fallback("browser")
+                ctx = await _ensure_browser()
+                async with sem:
+                    page = await pages.get()
+                    try:
+                        with metrics.stage("render"):
+                            result = await _check_page_async(page, url)
+                    finally:
+                        # 页面被关掉/崩了就换一个新的，保证池里始终有 concurrency 个页面
+                        if page.is_closed():
+                            page = await ctx.new_page()
+                        pages.put_nowait(page)
+            http_code, det_status, det_trigger, ttd_ms = result
+            metrics.note(http=http_code, detector=det_trigger, ttd_ms=ttd_ms)
+            await asyncio.to_thread(
+                _handle_result, batch, url, item_id, sku, rule_trigger,
+                http_code, det_status, det_trigger, ttd_ms
+            )
+            metrics.end()
+
+        try:
+            await asyncio.gather(*(_one(*r) for r in rows))
+        finally:
+            if state["ctx"] is not None:
+                await state["ctx"].close()
+            if state["browser"] is not None:
+                await state["browser"].close()
+
+
+@profiling.profiled("mercari")
+def run_once(df=None):
+    # 读取清单（你的 sheet_reader 已做了重试/超时）；main_all 会把已读好的分片传进来
+    if df is None:
+        with metrics.run_stage("ledger_read", "mercari"):
+            df = read_ledger()
+    rows, matched = _collect_rows(df)
+
+    batch = ZeroBatch(site="mercari")
+    stats = {"fast": 0, "rendered": 0}
+    concurrency = _concurrency()
+    try:
+        if concurrency > 1 and rows:
+            print(f"[MERCARI] concurrent mode: {concurrency} pages in flight, {len(rows)} rows")
+            if browser_pool.profile_dir():
+                # 同一个 profile 目录同时只能被一个浏览器打开，先关掉常驻池里的
+                browser_pool.close()
+            asyncio.run(_run_async(rows, batch, concurrency, stats))
+        else:
+            _run_sync(rows, batch, stats)
+    finally:
+        # 把没凑满一批的清零请求发出去
+        batch.flush()
+
+    if rows:
+        print(f"[MERCARI] resolved without rendering={stats['fast']} rendered={stats['rendered']}")
+    resource_blocker.report("[MERCARI] PW_BLOCK")
+    http_cache.report("[MERCARI] HTTP_CACHE")
+    ratelimit.report("[MERCARI] RATE", "mercari")
+    state_store.report("[MERCARI] STATE")
+    metrics.report("[MERCARI] METRICS", "mercari")
+    flush_digest("[MERCARI]")
+    outbox_report("[MERCARI] OUTBOX")
 
     if matched == 0:
         print("No Mercari rows matched. Check headers/domains.")
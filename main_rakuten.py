@@ -0,0 +1,131 @@
+# main_rakuten.py
+import os
+from dotenv import load_dotenv
+
+from sheet_reader import read_ledger
+import ledger
+from fetcher import fetch
+from ebay_updater import ZeroBatch
+from notify import notify, flush_digest, outbox_report
+import resource_blocker
+import http_cache
+import ratelimit
+import state_store
+import metrics
+import profiling
+import pipeline
+
+load_dotenv()
+
+
+def norm_trigger(v: str) -> str:
+    s = str(v or "").strip().lower()
+    return "soldout" if s in ("", "nan", "none", "null") else s
+
+
+def should_zero(trigger: str, status: str) -> bool:
+    """售罄逻辑与 Yahoo 版保持一致；rakuten.detect 额外会返回 DELETED（下架）"""
+    if status == "UNKNOWN":
+        return False
+    if status == "DELETED":
+        return True
+    t = norm_trigger(trigger)
+    if t == "soldout":
+        return status == "OUT_OF_STOCK"
+    if t == "lowstock":
+        return status in ("OUT_OF_STOCK", "LOW_STOCK")
+    return False
+
+
+# source_url 含任一子串即归本站点处理
+DOMAINS = ("rakuten.co.jp",)
+
+
+@profiling.profiled("rakuten")
+def run_once(df=None):
+    if df is None:
+        with metrics.run_stage("ledger_read", "rakuten"):
+            df = read_ledger()
+    # 清零请求攒批交给流水线的 eBay 段发送（每次最多 4 个商品），通知在每批返回后按商品逐个发
+    batch = ZeroBatch(site="rakuten")
+
+    # 表格已按列预处理（空值/trigger 归一、域名筛选），这里只是遍历轻量的行元组
+    rows = list(ledger.rows(df, DOMAINS))
+    matched = len(rows)
+
+    def _start(r):
+        url, item_id, sku = r.url, r.item_id, r.sku
+        trigger = norm_trigger(r.trigger)
+
+        # 自适应复查：状态长期稳定/已清零的商品没到复查时间，本轮不抓
+        if not state_store.is_due(url, item_id, sku):
+            return None
+        metrics.row("rakuten", url, item_id=item_id, sku=sku, trigger=trigger)
+
+        # 流水线 fetch 段（在抓取线程里跑）：只取页面；解析/判定和 AUTO 升级交给 parse_pool
+        with metrics.stage("fetch"):
+            code, html = fetch(url, escalate=False)
+        metrics.note(http=code, bytes=len(html))
+        return (url, item_id, sku, trigger), url, code, html
+
+    def _finish(ctx, code, html, analysis):
+        url, item_id, sku, trigger = ctx
+        ident = sku if sku else (item_id if item_id else "(no-id)")
+        if code in (404, 410):
+            print(f"[RAKUTEN] {url} HTTP={code} status=DELETED trigger={trigger} sku={sku or '∅'}")
+            state_store.observe(url, item_id, sku, "DELETED")
+            metrics.note(status="DELETED")
+            if not state_store.needs_push(url, item_id, sku, 0):
+                print(f"[RAKUTEN] already zeroed, status unchanged → skip: {ident}")
+                return
+            def _on_deleted(res, ident=ident, sku=sku, url=url):
+                if res.get("ok"):
+                    notify(f"🗑️ [RAKUTEN] 链接失效 → eBay 已清零：{ident}\nSKU: {sku or '-'}\n{url}")
+                    print(f"EBAY_ZERO_OK sku={sku or ident} url={url}")
+                else:
+                    notify(f"❌ [RAKUTEN] 链接失效但 eBay 清零失败：{ident}\n{url}", critical=True)
+                    print(f"EBAY_ZERO_FAIL sku={sku or ident} url={url}")
+
+            batch.add(item_id, sku, on_done=_on_deleted, url=url)
+            return
+
+        status = "UNKNOWN" if analysis is None else analysis["status"]
+        print(f"[RAKUTEN] {url} HTTP={code} status={status} trigger={trigger} sku={sku or '∅'}")
+        state_store.observe(url, item_id, sku, status)
+        metrics.note(status=status)
+
+        if not should_zero(trigger, status):
+            return
+        if not state_store.needs_push(url, item_id, sku, 0):
+            print(f"[RAKUTEN] already zeroed, status unchanged → skip: {ident}")
+            return
+
+        notify(f"⚠️ [RAKUTEN] 检测到售罄/下架：{ident}\nSKU: {sku or '-'}\n检测={status}\n{url}")
+
+        def _on_done(res, ident=ident, sku=sku, url=url):
+            if res.get("ok"):
+                notify(f"✅ [RAKUTEN] eBay 已清零：{ident}\nSKU: {sku or '-'}\n{url}")
+                print(f"EBAY_ZERO_OK sku={sku or ident} url={url}")
+            else:
+                notify(f"❌ [RAKUTEN] eBay 清零失败：{ident}\n{url}", critical=True)
+                print(f"EBAY_ZERO_FAIL sku={sku or ident} url={url}")
+
+        batch.add(item_id, sku, on_done=_on_done, url=url)
+
+    pipeline.run("rakuten", rows, _start, _finish)
+    batch.flush()
+
+    resource_blocker.report("[RAKUTEN] PW_BLOCK")
+    http_cache.report("[RAKUTEN] HTTP_CACHE")
+    ratelimit.report("[RAKUTEN] RATE", "rakuten")
+    state_store.report("[RAKUTEN] STATE")
+    metrics.report("[RAKUTEN] METRICS", "rakuten")
+    flush_digest("[RAKUTEN]")
+    outbox_report("[RAKUTEN] OUTBOX")
+
+    if matched == 0:
+        print("No Rakuten rows matched. Check source_url/domain.")
+
+
+if __name__ == "__main__":
+    run_once()
@@ -3,21 +3,21 @@ import os
 from dotenv import load_dotenv
 
 from sheet_reader import read_ledger
+import ledger
 from fetcher import fetch
-from detectors import yahoo
-from ebay_updater import update_qty_with_fallback
-from notify import notify
+from ebay_updater import ZeroBatch
+from notify import notify, flush_digest, outbox_report
+import resource_blocker
+import http_cache
+import ratelimit
+import state_store
+import metrics
+import profiling
+import pipeline
 
 load_dotenv()
 
 
-def _is_blank(value) -> bool:
-    if value is None:
-        return True
-    s = str(value).strip().lower()
-    return s in ("", "nan", "none", "null")
-
-
 def norm_trigger(v: str) -> str:
     s = str(v or "").strip().lower()
     return "soldout" if s in ("", "nan", "none", "null") else s
@@ -35,54 +35,91 @@ def should_zero(trigger: str, status: str) -> bool:
     return False
 
 
-def run_once():
-    df = read_ledger()
-    matched = 0
+@profiling.profiled("yahoo")
+def run_once(df=None):
+    if df is None:
+        with metrics.run_stage("ledger_read", "yahoo"):
+            df = read_ledger()
+    # 清零请求攒批交给流水线的 eBay 段发送（每次最多 4 个商品），通知在每批返回后按商品逐个发
+    batch = ZeroBatch(site="yahoo")
 
-    for _, row in df.iterrows():
-        url = str(row.get("source_url", "") or "").strip()
-        low = url.lower()
-        if not url or ("yahoo.co.jp" not in low and "auctions.yahoo.co.jp" not in low):
-            continue
+    # 表格已按列预处理（空值/trigger 归一、域名筛选），这里只是遍历轻量的行元组
+    rows = list(ledger.rows(df, ("yahoo.co.jp", "auctions.yahoo.co.jp")))
+    matched = len(rows)
 
-        matched += 1
-        item_id = str(row.get("ebay_item_id", "") or "").strip()
-        sku     = str(row.get("sku", "") or "").strip()
-        trigger = norm_trigger(row.get("trigger", ""))
+    def _start(r):
+        url, item_id, sku = r.url, r.item_id, r.sku
+        trigger = norm_trigger(r.trigger)
 
-        ident = sku if sku else item_id
+        # 自适应复查：状态长期稳定/已清零的商品没到复查时间，本轮不抓
+        if not state_store.is_due(url, item_id, sku):
+            return None
+        metrics.row("yahoo", url, item_id=item_id, sku=sku, trigger=trigger)
+
+        # 流水线 fetch 段（在抓取线程里跑）：只取页面；解析/判定和 AUTO 升级交给 parse_pool
+        with metrics.stage("fetch"):
+            code, html = fetch(url, escalate=False)
+        metrics.note(http=code, bytes=len(html))
+        return (url, item_id, sku, trigger), url, code, html
 
-        code, html = fetch(url)
+    def _finish(ctx, code, html, analysis):
+        url, item_id, sku, trigger = ctx
+        ident = sku if sku else item_id
 
         # ① 链接失效（404/410）→ 必清零 & 发通知（含 SKU + 链接）
         if code in (404, 410):
             print(f"[YAHOO] {url} HTTP={code} status=DELETED trigger={trigger} sku={sku or '∅'}")
-            res = update_qty_with_fallback(item_id=item_id, sku=sku, quantity=0)
-            if res.get("ok"):
-                notify(f"🗑️ [YAHOO] 链接失效 → eBay 已清零：{ident}\nSKU: {sku or '(no-sku)'}\n{url}")
-                # 机器可识别锚点，供工作流检出“真清零”
-                print(f"EBAY_ZERO_OK sku={sku or ident} url={url}")
-            else:
-                notify(f"❌ [YAHOO] 链接失效但 eBay 清零失败：{ident}\nSKU: {sku or '(no-sku)'}\n{url}")
-                print(f"EBAY_ZERO_FAIL sku={sku or ident} url={url}")
-            continue
+            state_store.observe(url, item_id, sku, "DELETED")
+            metrics.note(status="DELETED")
+            if not state_store.needs_push(url, item_id, sku, 0):
+                print(f"[YAHOO] already zeroed, status unchanged → skip: {ident}")
+                return
+            def _on_deleted(res, ident=ident, sku=sku, url=url):
+                if res.get("ok"):
+                    notify(f"🗑️ [YAHOO] 链接失效 → eBay 已清零：{ident}\nSKU: {sku or '(no-sku)'}\n{url}")
+                    # 机器可识别锚点，供工作流检出“真清零”
+                    print(f"EBAY_ZERO_OK sku={sku or ident} url={url}")
+                else:
+                    notify(f"❌ [YAHOO] 链接失效但 eBay 清零失败：{ident}\nSKU: {sku or '(no-sku)'}\n{url}", critical=True)
+                    print(f"EBAY_ZERO_FAIL sku={sku or ident} url={url}")
+
+            batch.add(item_id, sku, on_done=_on_deleted, url=url)
+            return
 
         # ② 正常页面：判定状态
-        status = "UNKNOWN" if code != 200 else yahoo.detect(html)
+        status = "UNKNOWN" if analysis is None else analysis["status"]
         print(f"[YAHOO] {url} HTTP={code} status={status} trigger={trigger} sku={sku or '∅'}")
+        state_store.observe(url, item_id, sku, status)
+        metrics.note(status=status)
 
         # ③ 若不满足清零规则则跳过（不发通知）
         if not should_zero(trigger, status):
-            continue
+            return
+        if not state_store.needs_push(url, item_id, sku, 0):
+            print(f"[YAHOO] already zeroed, status unchanged → skip: {ident}")
+            return
 
         # ④ 满足清零规则：直接尝试清 0，并在成功/失败时发通知（含 SKU + 链接）
-        res = update_qty_with_fallback(item_id=item_id, sku=sku, quantity=0)
-        if res.get("ok"):
-            notify(f"✅ [YAHOO] eBay 已清零：{ident}\nSKU: {sku or '(no-sku)'}\n{url}")
-            print(f"EBAY_ZERO_OK sku={sku or ident} url={url}")
-        else:
-            notify(f"❌ [YAHOO] eBay 清零失败：{ident}\nSKU: {sku or '(no-sku)'}\n{url}")
-            print(f"EBAY_ZERO_FAIL sku={sku or ident} url={url}")
+        def _on_done(res, ident=ident, sku=sku, url=url):
+            if res.get("ok"):
+                notify(f"✅ [YAHOO] eBay 已清零：{ident}\nSKU: {sku or '(no-sku)'}\n{url}")
+                print(f"EBAY_ZERO_OK sku={sku or ident} url={url}")
+            else:
+                notify(f"❌ [YAHOO] eBay 清零失败：{ident}\nSKU: {sku or '(no-sku)'}\n{url}", critical=True)
+                print(f"EBAY_ZERO_FAIL sku={sku or ident} url={url}")
+
+        batch.add(item_id, sku, on_done=_on_done, url=url)
+
+    pipeline.run("yahoo", rows, _start, _finish)
+    batch.flush()
+
+    resource_blocker.report("[YAHOO] PW_BLOCK")
+    http_cache.report("[YAHOO] HTTP_CACHE")
+    ratelimit.report("[YAHOO] RATE", "yahoo")
+    state_store.report("[YAHOO] STATE")
+    metrics.report("[YAHOO] METRICS", "yahoo")
+    flush_digest("[YAHOO]")
+    outbox_report("[YAHOO] OUTBOX")
 
     if matched == 0:
         print("No Yahoo rows matched. Check headers/domains.")
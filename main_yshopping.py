@@ -3,19 +3,20 @@ import os
 from dotenv import load_dotenv
 
 from sheet_reader import read_ledger
+import ledger
 from fetcher import fetch
-from detectors import yshopping
-from ebay_updater import revise_inventory_status  # 也可换成 update_qty_with_fallback
-from notify import notify
+from ebay_updater import ZeroBatch  # fallback=False 对应原来的 revise_inventory_status
+from notify import notify, flush_digest, outbox_report
+import resource_blocker
+import http_cache
+import ratelimit
+import state_store
+import metrics
+import profiling
+import pipeline
 
 load_dotenv()
 
-def _is_blank(v) -> bool:
-    if v is None:
-        return True
-    s = str(v).strip().lower()
-    return s in ("", "nan", "none", "null", "")
-
 def norm_trigger(v: str) -> str:
     s = str(v or "").strip().lower()
     return "soldout" if s in ("", "nan", "none", "null") else s
@@ -30,65 +31,93 @@ def should_zero(trigger: str, status: str) -> bool:
         return status in ("OUT_OF_STOCK", "LOW_STOCK")
     return False
 
-def _looks_yshopping(url: str) -> bool:
-    u = (url or "").lower()
-    return ("shopping.yahoo.co.jp" in u) or ("store.shopping.yahoo.co.jp" in u)
-
-def run_once():
-    df = read_ledger()
-    matched = 0
-
-    for _, row in df.iterrows():
-        url = str(row.get("source_url", "") or "").strip()
-        if not url or not _looks_yshopping(url):
-            continue
-        matched += 1
-
-        item_id = "" if _is_blank(row.get("ebay_item_id")) else str(row.get("ebay_item_id")).strip()
-        sku     = "" if _is_blank(row.get("sku")) else str(row.get("sku")).strip()
-        trigger = norm_trigger(row.get("trigger", ""))
-
+# source_url 含任一子串即归本站点处理
+DOMAINS = ("shopping.yahoo.co.jp", "store.shopping.yahoo.co.jp")
+
+@profiling.profiled("yshopping")
+def run_once(df=None):
+    if df is None:
+        with metrics.run_stage("ledger_read", "yshopping"):
+            df = read_ledger()
+    # 清零请求攒批交给流水线的 eBay 段发送（每次最多 4 个商品）；不做 SKU→ItemID 回退，与原 revise_inventory_status 一致
+    batch = ZeroBatch(fallback=False, site="yshopping")
+
+    # 表格已按列预处理（空值/trigger 归一、域名筛选），这里只是遍历轻量的行元组
+    rows = list(ledger.rows(df, DOMAINS))
+    matched = len(rows)
+
+    def _start(r):
+        url, item_id, sku = r.url, r.item_id, r.sku
+        trigger = norm_trigger(r.trigger)
+
+        # 自适应复查：状态长期稳定/已清零的商品没到复查时间，本轮不抓
+        if not state_store.is_due(url, item_id, sku):
+            return None
+        metrics.row("yshopping", url, item_id=item_id, sku=sku, trigger=trigger)
+
+        # 流水线 fetch 段（在抓取线程里跑）：只取页面；解析/判定和 AUTO 升级交给 parse_pool
+        with metrics.stage("fetch"):
+            code, html = fetch(url, escalate=False)
+        metrics.note(http=code, bytes=len(html))
+        return (url, item_id, sku, trigger), url, code, html
+
+    def _finish(ctx, code, html, analysis):
+        url, item_id, sku, trigger = ctx
         ident = sku if sku else (item_id if item_id else "(no-id)")
 
-        code, html = fetch(url)
-
         # 链接失效：404/410 -> 必清零 + 通知
         if code in (404, 410):
             print(f"[Y!SHOP] {url} HTTP={code} status=DELETED trigger={trigger} sku={sku or '∅'}")
-            res = revise_inventory_status(item_id=item_id, sku=sku, quantity=0)
-            print("eBay update (deleted link):", res)
-            if res.get("ok"):
-                notify(f"🗑️ [Y!Shopping] 链接失效（HTTP {code}）→ eBay 已清零：{ident}\n{url}")
-            else:
-                status_code = res.get("status")
-                body = res.get("body") or res.get("error") or ""
-                snippet = str(body)[:500]
-                notify(f"❌ [Y!Shopping] 链接失效但 eBay 清零失败：{ident}\nHTTP={status_code}\n{snippet}\n{url}")
-            continue
-
-        status = "UNKNOWN" if code != 200 else yshopping.detect(html)
-        price  = None if code != 200 else yshopping.extract_price(html)
+            state_store.observe(url, item_id, sku, "DELETED")
+            metrics.note(status="DELETED")
+            if not state_store.needs_push(url, item_id, sku, 0):
+                print(f"[Y!SHOP] already zeroed, status unchanged → skip: {ident}")
+                return
+            def _on_deleted(res, ident=ident, code=code, url=url):
+                print("eBay update (deleted link):", res)
+                if res.get("ok"):
+                    notify(f"🗑️ [Y!Shopping] 链接失效（HTTP {code}）→ eBay 已清零：{ident}\n{url}")
+                else:
+                    status_code = res.get("status")
+                    body = res.get("body") or res.get("error") or ""
+                    snippet = str(body)[:500]
+                    notify(f"❌ [Y!Shopping] 链接失效但 eBay 清零失败：{ident}\nHTTP={status_code}\n{snippet}\n{url}", critical=True)
+
+            batch.add(item_id, sku, on_done=_on_deleted, url=url)
+            return
+
+        # 页面只解析一次，detect / extract_price 共用
+        status = "UNKNOWN" if analysis is None else analysis["status"]
+        price  = None if analysis is None else analysis.get("price")
 
         print(f"[Y!SHOP] {url} HTTP={code} status={status} price={price} trigger={trigger} sku={sku or '∅'}")
+        state_store.observe(url, item_id, sku, status)
+        metrics.note(status=status)
 
         # 状态未知：跳过（不动作，不通知）
         if status == "UNKNOWN":
             print(f"SKIP: {ident} status UNKNOWN, no action.\n")
-            continue
+            return
 
         # 一、售罄/无货规则 → 清 0 + 通知
         if should_zero(trigger, status):
+            if not state_store.needs_push(url, item_id, sku, 0):
+                print(f"[Y!SHOP] already zeroed, status unchanged → skip: {ident}")
+                return
             notify(f"⚠️ [Y!Shopping] 检测到售罄：{ident}\n{url}")
-            res = revise_inventory_status(item_id=item_id, sku=sku, quantity=0)
-            print("eBay update (zero):", res)
-            if res.get("ok"):
-                notify(f"✅ eBay 库存已清零：{ident}")
-            else:
-                status_code = res.get("status")
-                body = res.get("body") or res.get("error") or ""
-                snippet = str(body)[:500]
-                notify(f"❌ eBay 清零失败：{ident}\nHTTP={status_code}\n{snippet}")
-            continue
+
+            def _on_done(res, ident=ident):
+                print("eBay update (zero):", res)
+                if res.get("ok"):
+                    notify(f"✅ eBay 库存已清零：{ident}")
+                else:
+                    status_code = res.get("status")
+                    body = res.get("body") or res.get("error") or ""
+                    snippet = str(body)[:500]
+                    notify(f"❌ eBay 清零失败：{ident}\nHTTP={status_code}\n{snippet}", critical=True)
+
+            batch.add(item_id, sku, on_done=_on_done, url=url)
+            return
 
         # 二、价格联动（仅当能取到 current_price 才处理）
         # 你的表里建议再加一列：y_price_last（上次记录的 Yahoo 价），也可简单用 eBay 现价去对比。
@@ -102,6 +131,17 @@ def run_once():
             # 你可以后续把逻辑换成：若 price > last_price => 计算差额×1.3 调整 eBay
             notify(f"ℹ️ [Y!Shopping] 当前价 ¥{price}：{ident}\n（如需自动联动涨价，请提供 eBay 当前售价来源）\n{url}")
 
+    pipeline.run("yshopping", rows, _start, _finish)
+    batch.flush()
+
+    resource_blocker.report("[Y!SHOP] PW_BLOCK")
+    http_cache.report("[Y!SHOP] HTTP_CACHE")
+    ratelimit.report("[Y!SHOP] RATE", "yshopping")
+    state_store.report("[Y!SHOP] STATE")
+    metrics.report("[Y!SHOP] METRICS", "yshopping")
+    flush_digest("[Y!SHOP]")
+    outbox_report("[Y!SHOP] OUTBOX")
+
     if matched == 0:
         print("No Yahoo Shopping rows matched. Check headers/domains.")
 
@@ -0,0 +1,172 @@
+# merge_summaries.py
+# 合并各分片（SHARD_INDEX/SHARD_COUNT）写出的 metrics JSONL，给出整轮的汇总：
+#   python merge_summaries.py shards/*/metrics.jsonl
+#   python merge_summaries.py shards/ --json merged.json      # 目录会递归找 *.jsonl
+# 每个站点：处理行数 / 各状态数 / eBay 清零成功失败 / 走兜底的行数 / 各阶段 p50/p95/max；
+# 每个分片：行数与墙钟时间（main_all 记录的 run_once:<site>）；流水线各段：队列最大深度与 put 阻塞时间（pipeline.py）。
+# 缺了某个分片、或同一个 URL 出现在多个分片里，都会打出 WARN 并以退出码 1 结束。
+# 在 GitHub Actions 里（有 GITHUB_STEP_SUMMARY）同时写一份 Markdown 到 job summary。
+import os
+import sys
+import json
+import glob
+import argparse
+
+from metrics import STAGE_ORDER
+
+
+def _pct(sorted_vals, q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(len(sorted_vals) * q))]
+
+
+def _files(paths) -> list:
+    out = []
+    for p in paths:
+        if os.path.isdir(p):
+            out += sorted(glob.glob(os.path.join(p, "**", "*.jsonl"), recursive=True))
+        else:
+            out.append(p)
+    return out
+
+
+def load(paths):
+    rows, runs, queues = [], [], []
+    for path in _files(paths):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    print(f"[MERGE] bad line in {path}, skipped")
+                    continue
+                kind = rec.get("kind")
+                (runs if kind == "run" else queues if kind == "queue" else rows).append(rec)
+    return rows, runs, queues
+
+
+def merge(rows, runs, queues=()) -> dict:
+    sites = {}
+    for r in rows:
+        s = sites.setdefault(r["site"], {"rows": 0, "status": {}, "ebay_ok": 0, "ebay_fail": 0,
+                                         "with_fallback": 0, "stages": {}, "shards": {}, "queues": {}})
+        s["rows"] += 1
+        st = str(r.get("status", "?"))
+        s["status"][st] = s["status"].get(st, 0) + 1
+        if "ebay_ok" in r:
+            s["ebay_ok" if r["ebay_ok"] else "ebay_fail"] += 1
+        if r.get("fallbacks"):
+            s["with_fallback"] += 1
+        for name, ms in r.get("stages", {}).items():
+            s["stages"].setdefault(name, []).append(ms)
+        sh = r.get("shard") or "-"
+        s["shards"][sh] = s["shards"].get(sh, 0) + 1
+
+    for s in sites.values():
+        for name, vals in s["stages"].items():
+            vals.sort()
+            s["stages"][name] = {"n": len(vals), "p50": _pct(vals, 0.5), "p95": _pct(vals, 0.95),
+                                 "max": vals[-1], "sum_s": sum(vals) / 1000}
+
+    for q in queues:
+        s = sites.setdefault(q["site"], {"rows": 0, "status": {}, "ebay_ok": 0, "ebay_fail": 0,
+                                         "with_fallback": 0, "stages": {}, "shards": {}, "queues": {}})
+        v = s["queues"].setdefault(q["stage"], {"max_depth": 0, "cap": q.get("cap", 0), "blocked_s": 0.0, "busy_s": 0.0})
+        v["max_depth"] = max(v["max_depth"], q.get("max_depth", 0))
+        v["blocked_s"] += q.get("blocked_ms", 0.0) / 1000
+        v["busy_s"] += q.get("busy_ms", 0.0) / 1000
+
+    shards = {}
+    for r in runs:
+        sh = shards.setdefault(r.get("shard") or "-", {"stages": {}})
+        sh["stages"][r["stage"]] = sh["stages"].get(r["stage"], 0.0) + r["ms"]
+
+    warnings = []
+    counts = {int(k.split("/")[1]) for k in list(shards) + [k for s in sites.values() for k in s["shards"]] if "/" in k}
+    if len(counts) > 1:
+        warnings.append(f"mixed SHARD_COUNT values: {sorted(counts)}")
+    for n in counts:
+        seen = {k for k in shards if k.endswith(f"/{n}")} | {k for s in sites.values() for k in s["shards"] if k.endswith(f"/{n}")}
+        missing = [f"{i}/{n}" for i in range(n) if f"{i}/{n}" not in seen]
+        if missing:
+            warnings.append(f"no records from shard(s) {', '.join(missing)} (failed or not downloaded?)")
+    owner = {}
+    dup = 0
+    for r in rows:
+        key = (r["site"], r["url"], r.get("sku", ""), r.get("item_id", ""))
+        sh = r.get("shard") or "-"
+        if owner.setdefault(key, sh) != sh:
+            dup += 1
+    if dup:
+        warnings.append(f"{dup} rows processed by more than one shard (SHARD_KEY / SHARD_COUNT mismatch?)")
+    return {"sites": sites, "shards": shards, "warnings": warnings}
+
+
+def print_text(m: dict):
+    for site, s in sorted(m["sites"].items()):
+        status = " ".join(f"{k}={v}" for k, v in sorted(s["status"].items()))
+        print(f"[MERGE] {site}: rows={s['rows']} shards={len(s['shards'])} {status} "
+              f"ebay_ok={s['ebay_ok']} ebay_fail={s['ebay_fail']} with_fallback={s['with_fallback']}")
+        order = [x for x in STAGE_ORDER if x in s["stages"]] + sorted(x for x in s["stages"] if x not in STAGE_ORDER)
+        for name in order:
+            v = s["stages"][name]
+            print(f"[MERGE] {site} {name:<7} n={v['n']:<6} p50={v['p50']:.0f}ms p95={v['p95']:.0f}ms "
+                  f"max={v['max']:.0f}ms sum={v['sum_s']:.1f}s")
+        for name, v in s["queues"].items():
+            print(f"[MERGE] {site} queue {name:<7} max_depth={v['max_depth']}/{v['cap']} "
+                  f"blocked={v['blocked_s']:.1f}s busy={v['busy_s']:.1f}s")
+    for sh, v in sorted(m["shards"].items()):
+        parts = " ".join(f"{k}={ms / 1000:.1f}s" for k, ms in sorted(v["stages"].items()))
+        print(f"[MERGE] shard {sh}: {parts}")
+    for w in m["warnings"]:
+        print(f"[MERGE] WARN {w}")
+
+
+def markdown(m: dict) -> str:
+    lines = ["### Sync summary (merged shards)", "",
+             "| site | rows | shards | statuses | eBay ok / fail | fallback | total p50 / p95 / max (ms) |",
+             "|---|---:|---:|---|---:|---:|---|"]
+    for site, s in sorted(m["sites"].items()):
+        t = s["stages"].get("total", {"p50": 0, "p95": 0, "max": 0})
+        status = ", ".join(f"{k} {v}" for k, v in sorted(s["status"].items()))
+        lines.append(f"| {site} | {s['rows']} | {len(s['shards'])} | {status} | "
+                     f"{s['ebay_ok']} / {s['ebay_fail']} | {s['with_fallback']} | "
+                     f"{t['p50']:.0f} / {t['p95']:.0f} / {t['max']:.0f} |")
+    if m["shards"]:
+        lines += ["", "| shard | wall time |", "|---|---|"]
+        for sh, v in sorted(m["shards"].items()):
+            parts = ", ".join(f"{k} {ms / 1000:.1f}s" for k, ms in sorted(v["stages"].items()))
+            lines.append(f"| {sh} | {parts} |")
+    for w in m["warnings"]:
+        lines.append(f"\n> ⚠️ {w}")
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="merge per-shard metrics JSONL into one run summary")
+    ap.add_argument("paths", nargs="+", help="metrics .jsonl files or directories containing them")
+    ap.add_argument("--json", help="also write the merged summary here")
+    args = ap.parse_args(argv)
+
+    rows, runs, queues = load(args.paths)
+    if not rows and not runs:
+        print("[MERGE] no metrics records found")
+        return 1
+    m = merge(rows, runs, queues)
+    print_text(m)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(m, f, ensure_ascii=False, indent=1)
+    step_summary = os.getenv("GITHUB_STEP_SUMMARY")
+    if step_summary:
+        with open(step_summary, "a", encoding="utf-8") as f:
+            f.write(markdown(m))
+    return 1 if m["warnings"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+# metrics.py
+# 逐行分阶段计时：每个商品一条结构化记录（各阶段耗时 / 字节数 / HTTP 码 / 判定结果 / 走了哪些兜底），
+# run_once 结束时追加写入 JSONL，并打印各阶段 p50/p95/max 与最慢的几个 URL，看 15 分钟预算花在哪。
+#
+#   rec = metrics.row("amazon", url)          # 开始一行（记为“当前行”，contextvars，线程/协程各自独立）
+#   with metrics.stage("fetch"):              # 计时，累加到当前行
+#       code, html = fetch(url)
+#   metrics.note(http=code, bytes=len(html))  # 附加字段
+#   metrics.fallback("playwright")            # 记录兜底路径（fetcher / ebay_updater 里自动记）
+#   metrics.end()                             # 循环结束后调用（下一次 row() 会自动结束上一行）；
+#                                             # eBay 清零是攒批发的，之后仍会记到对应的行上
+#   metrics.report("[AMAZON] METRICS", "amazon")
+#
+# 环境变量（运行时读取）：
+#   METRICS           true/false  总开关（默认 true）
+#   METRICS_FILE      路径        JSONL 输出，默认 logs/metrics.jsonl（workflow 的 Upload logs 会一起上传）；空 = 只打印汇总
+#   METRICS_SLOWEST   条数        汇总里列出最慢的 URL 数，默认 5
+#   METRICS_FILE_MAX_MB  大小     JSONL 超过这么大就轮转成 <METRICS_FILE>.1（只保留一份旧的），默认 50；0 = 不限
+#                                 main_loop 长跑时文件不会无限增长
+# 分片运行（SHARD_INDEX/SHARD_COUNT）时每条记录带 shard 字段，各片的 JSONL 用 merge_summaries.py 合并。
+# pipeline.py 的各段队列统计（深度最大/平均、put 阻塞时间、工作时间）用 metrics.queue() 记下，kind=queue。
+import os
+import json
+import time
+import threading
+import contextlib
+import contextvars
+
+RUN_ID = time.strftime("%Y%m%dT%H%M%S") + f"-{os.getpid()}"
+# 汇总里各阶段的显示顺序；其它阶段名排在后面
+STAGE_ORDER = ("fetch", "throttle", "detect", "parse_wait", "fast", "render", "ebay", "notify", "row", "total")
+
+_current = contextvars.ContextVar("metrics_row", default=None)
+_lock = threading.Lock()
+_rows = []      # 还没 report 的逐行记录
+_runs = []      # 整轮级别的阶段（读表等）：{"site", "stage", "ms"}
+_queues = []    # 流水线各段的队列统计：{"site", "stage", "max_depth", ...}
+
+
+def enabled() -> bool:
+    return os.getenv("METRICS", "true").strip().lower() == "true"
+
+
+def _shard() -> str:
+    """"index/count"（分片运行时写进每条记录，merge_summaries.py 按它合并）；未分片为空串。"""
+    from ledger import shard_spec
+    index, count = shard_spec()
+    return f"{index}/{count}" if count > 1 else ""
+
+
+def row(site: str, url: str, **fields):
+    """
+    开始记录一行并设为当前行（上一行若还没 end 就先结束，循环里的各个 continue 不用逐个补 end）；
+    关闭时返回 None（其余函数对 None 都是空操作）。
+    """
+    end()
+    if not enabled():
+        _current.set(None)
+        return None
+    rec = {"run": RUN_ID, "shard": _shard(), "site": site, "url": url, "ts": round(time.time(), 3),
+           "stages": {}, "fallbacks": [], "_t0": time.perf_counter()}
+    rec.update(fields)
+    with _lock:
+        _rows.append(rec)
+    _current.set(rec)
+    return rec
+
+
+def current():
+    return _current.get()
+
+
+def detach():
+    """取下当前行但不结束它（parse_pool 流水线里先去抓下一行，解析完再 use 回来）。"""
+    rec = _current.get()
+    _current.set(None)
+    return rec
+
+
+def use(rec):
+    _current.set(rec)
+
+
+def add(name: str, ms: float, rec=None):
+    rec = rec if rec is not None else _current.get()
+    if rec is None:
+        return
+    with _lock:
+        rec["stages"][name] = rec["stages"].get(name, 0.0) + ms
+
+
+@contextlib.contextmanager
+def stage(name: str, rec=None):
+    rec = rec if rec is not None else _current.get()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(name, (time.perf_counter() - t0) * 1000, rec)
+
+
+def note(rec=None, **fields):
+    rec = rec if rec is not None else _current.get()
+    if rec is None:
+        return
+    with _lock:
+        rec.update(fields)
+
+
+def fallback(what: str, rec=None):
+    rec = rec if rec is not None else _current.get()
+    if rec is None:
+        return
+    with _lock:
+        rec["fallbacks"].append(what)
+
+
+def end(rec=None):
+    """
+    本行处理完（不含之后攒批发送的 eBay/通知）：记下整行耗时并清掉当前行；重复调用只记一次。
+    parse_pool 流水线里 row 含等待解析时排队的时间。
+    """
+    rec = rec if rec is not None else _current.get()
+    if rec is not None and not rec.get("_ended"):
+        rec["_ended"] = True
+        add("row", (time.perf_counter() - rec["_t0"]) * 1000, rec)
+    _current.set(None)
+
+
+@contextlib.contextmanager
+def run_stage(name: str, site: str):
+    """整轮级别的阶段计时（如读表），汇总时单独一行。"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        if enabled():
+            with _lock:
+                _runs.append({"run": RUN_ID, "shard": _shard(), "site": site, "stage": name,
+                              "ms": (time.perf_counter() - t0) * 1000})
+
+
+def queue(site: str, stage_name: str, stats: dict):
+    """记下流水线某一段本轮的队列统计（见 pipeline.py）。"""
+    if not enabled():
+        return
+    with _lock:
+        _queues.append(dict(stats, run=RUN_ID, shard=_shard(), site=site, stage=stage_name))
+
+
+def _pct(sorted_vals, q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(len(sorted_vals) * q))]
+
+
+def _finalize(rec) -> dict:
+    out = {k: v for k, v in rec.items() if not k.startswith("_")}
+    st = out["stages"] = {k: round(v, 1) for k, v in rec["stages"].items()}
+    # 一行的总耗时 = 行内处理 + 攒批后记到这一行上的 eBay / 通知
+    st["total"] = round(st.get("row", 0.0) + st.get("ebay", 0.0) + st.get("notify", 0.0), 1)
+    return out
+
+
+def _max_bytes() -> int:
+    try:
+        return max(0, int(float(os.getenv("METRICS_FILE_MAX_MB", "50")) * 1024 * 1024))
+    except ValueError:
+        return 50 * 1024 * 1024
+
+
+def _rotate(path: str):
+    """文件超过 METRICS_FILE_MAX_MB 就改名为 <path>.1（覆盖更早的那份），下次写入从新文件开始。"""
+    cap = _max_bytes()
+    try:
+        if cap and os.path.getsize(path) >= cap:
+            os.replace(path, path + ".1")
+            print(f"[METRICS] {path} reached {cap / 1048576:g}MB, rotated to {path}.1")
+    except OSError:
+        pass
+
+
+def _write(records: list):
+    path = os.getenv("METRICS_FILE", os.path.join("logs", "metrics.jsonl")).strip()
+    if not path or not records:
+        return
+    try:
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        _rotate(path)
+        with open(path, "a", encoding="utf-8") as f:
+            for r in records:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"[METRICS] write failed: {e}")
+
+
+def report(tag: str, site: str):
+    """写出该站点本轮的记录，打印各阶段 p50/p95/max 与最慢的 URL，然后清掉。"""
+    with _lock:
+        mine = [r for r in _rows if r["site"] == site]
+        _rows[:] = [r for r in _rows if r["site"] != site]
+        runs = [r for r in _runs if r["site"] == site]
+        _runs[:] = [r for r in _runs if r["site"] != site]
+        queues = [r for r in _queues if r["site"] == site]
+        _queues[:] = [r for r in _queues if r["site"] != site]
+    records = [_finalize(r) for r in mine]
+    _write([dict(r, kind="run") for r in runs] + [dict(r, kind="queue") for r in queues]
+           + [dict(r, kind="row") for r in records])
+    if not records and not runs and not queues:
+        return
+
+    for r in runs:
+        print(f"{tag} {r['stage']}={r['ms']:.0f}ms")
+    for q in queues:
+        print(f"{tag} queue {q['stage']:<7} workers={q.get('workers', '?')} cap={q['cap']} puts={q['puts']} "
+              f"depth max={q['max_depth']} avg={q['avg_depth']:.1f} "
+              f"blocked={q['blocked_ms'] / 1000:.1f}s busy={q.get('busy_ms', 0) / 1000:.1f}s")
+    if not records:
+        return
+
+    by_stage = {}
+    for r in records:
+        for name, ms in r["stages"].items():
+            by_stage.setdefault(name, []).append(ms)
+    order = [s for s in STAGE_ORDER if s in by_stage] + sorted(s for s in by_stage if s not in STAGE_ORDER)
+    fallbacks = sum(1 for r in records if r["fallbacks"])
+    print(f"{tag} rows={len(records)} with_fallback={fallbacks}")
+    for name in order:
+        vals = sorted(by_stage[name])
+        print(f"{tag} {name:<7} n={len(vals):<5} p50={_pct(vals, 0.5):.0f}ms "
+              f"p95={_pct(vals, 0.95):.0f}ms max={vals[-1]:.0f}ms sum={sum(vals) / 1000:.1f}s")
+
+    try:
+        n = int(os.getenv("METRICS_SLOWEST", "5"))
+    except ValueError:
+        n = 5
+    for r in sorted(records, key=lambda r: r["stages"]["total"], reverse=True)[:max(0, n)]:
+        parts = " ".join(f"{k}={v:.0f}" for k, v in r["stages"].items() if k not in ("row", "total"))
+        fb = f" fallback={','.join(r['fallbacks'])}" if r["fallbacks"] else ""
+        print(f"{tag} slow {r['stages']['total']:.0f}ms HTTP={r.get('http', '?')} "
+              f"status={r.get('status', '?')} ({parts}){fb} {r['url']}")
@@ -3,12 +3,25 @@ import os
 import time
 import json
 import html
+import atexit
+import threading
 import requests
 from typing import Optional
 
+import outbox
+
+# 可用环境变量 TG_API 覆盖（同样带 {token} / {method} 占位；bench/replay.py 指向本地的模拟 Bot API）
 TG_API = "https://api.telegram.org/bot{token}/{method}"
 MAX_LEN = 4096  # Telegram 文本消息上限
 
+# NOTIFY_MODE=digest 时，notify() 只把消息攒起来，run_once 结束时 flush_digest() 合并成几条发出
+# （每条不超过 MAX_LEN，按消息边界切分）；critical=True 的消息（清零失败等）仍可立即发送。
+#   NOTIFY_MODE                 immediate（默认）| digest
+#   NOTIFY_CRITICAL_IMMEDIATE   true（默认）：digest 模式下 critical 消息立即发
+#   NOTIFY_DIGEST_WINDOW        秒，>0 时缓冲里最早一条超过这么久就先发一次（main_loop 长跑用），默认 0
+_digest = []          # [(ts, text)]
+_digest_lock = threading.Lock()
+
 def _build_run_url() -> Optional[str]:
     """
     在 GitHub Actions 环境中自动拼 run 链接，否则返回 None
@@ -45,13 +58,47 @@ def _post_json(url: str, payload: dict, tries: int = 3, timeout: int = 15) -> bo
         backoff *= 2
     return False
 
+def _post_once(payload: dict, timeout: int = 15) -> tuple:
+    """
+    outbox 后台线程用的单次发送（重试/退避由 outbox 负责）。
+    返回 (ok, retry_after, permanent)：429 带回 Telegram 给的 retry_after；400/403 等重试也没用的算 permanent。
+    """
+    token = os.getenv("TELEGRAM_BOT_TOKEN", "").strip()
+    if not token:
+        return False, None, True
+    url = os.getenv("TG_API", TG_API).format(token=token, method="sendMessage")
+    try:
+        resp = requests.post(url, json=payload, timeout=timeout)
+    except Exception as e:
+        print(f"[TELEGRAM_WARN] request error: {e}")
+        return False, None, False
+    if resp.status_code == 200:
+        try:
+            if resp.json().get("ok"):
+                return True, None, False
+        except ValueError:
+            pass
+    print(f"[TELEGRAM_WARN] http {resp.status_code}: {resp.text[:200]}")
+    if resp.status_code == 429:
+        try:
+            retry_after = float(resp.json().get("parameters", {}).get("retry_after") or 0)
+        except (ValueError, AttributeError):
+            retry_after = 0
+        return False, retry_after or None, False
+    return False, None, resp.status_code in (400, 401, 403, 404)
+
+
+outbox.set_sender(_post_once)
+
+
 def _send_telegram(token: str, chat_id: str, text: str,
                    parse_mode: Optional[str] = None,
                    disable_preview: bool = True) -> bool:
     """
     将 text 按 4096 长度切片发送；任意一片失败返回 False
+    NOTIFY_OUTBOX=true（默认）时只写入发件箱，由后台线程发送，立即返回 True。
     """
-    url = TG_API.format(token=token, method="sendMessage")
+    url = os.getenv("TG_API", TG_API).format(token=token, method="sendMessage")
 
     # 追加 GitHub Actions 运行链接（如有）
     run_url = _build_run_url()
@@ -74,16 +121,21 @@ def _send_telegram(token: str, chat_id: str, text: str,
         if parse_mode:
             payload["parse_mode"] = parse_mode
 
+        if outbox.enabled():
+            outbox.enqueue(payload)
+            continue
         ok = _post_json(url, payload)
         ok_all = ok_all and ok
     return ok_all
 
 def notify(text: str,
            parse_mode: Optional[str] = None,
-           disable_preview: bool = True) -> bool:
+           disable_preview: bool = True,
+           critical: bool = False) -> bool:
     """
     外部调用的统一入口。
     - 如果没有 TELEGRAM_BOT_TOKEN / TELEGRAM_CHAT_ID，会“静默返回 True”，不打断主流程。
+    - NOTIFY_MODE=digest 时先进缓冲，由 flush_digest() 合并发送；critical=True 的默认仍立即发送。
     - 返回值 True 表示（要么未配置、要么已成功发送）；False 表示尝试发送但失败。
     """
     token = os.getenv("TELEGRAM_BOT_TOKEN", "").strip()
@@ -96,4 +148,96 @@ def notify(text: str,
 
     # 保险起见，防止意外传入非字符串类型
     txt = str(text or "")
+
+    if _digest_mode() and not (critical and _critical_immediate()):
+        with _digest_lock:
+            _digest.append((time.time(), txt))
+            oldest = _digest[0][0]
+        window = _digest_window()
+        if window > 0 and time.time() - oldest >= window:
+            flush_digest()
+        return True
+
     return _send_telegram(token, chat_id, txt, parse_mode=parse_mode, disable_preview=disable_preview)
+
+
+def _digest_mode() -> bool:
+    return os.getenv("NOTIFY_MODE", "immediate").strip().lower() == "digest"
+
+
+def _critical_immediate() -> bool:
+    return os.getenv("NOTIFY_CRITICAL_IMMEDIATE", "true").strip().lower() == "true"
+
+
+def _digest_window() -> float:
+    try:
+        return float(os.getenv("NOTIFY_DIGEST_WINDOW", "0"))
+    except ValueError:
+        return 0.0
+
+
+def _pack(texts, limit: int) -> list:
+    """把多条消息按边界拼成若干段，每段不超过 limit；单条本身超长的按 limit 硬切。"""
+    parts, cur = [], ""
+    for t in texts:
+        while len(t) > limit:
+            if cur:
+                parts.append(cur)
+                cur = ""
+            parts.append(t[:limit])
+            t = t[limit:]
+        if not t:
+            continue
+        if cur and len(cur) + 2 + len(t) > limit:
+            parts.append(cur)
+            cur = ""
+        cur = f"{cur}\n\n{t}" if cur else t
+    if cur:
+        parts.append(cur)
+    return parts
+
+
+def flush_digest(title: str = "") -> bool:
+    """
+    把攒着的消息合并发送（NOTIFY_MODE=digest 时每个 run_once 结束调用一次；immediate 模式下什么也不做）。
+    相同内容的消息合并成一条并标注次数。
+    """
+    with _digest_lock:
+        items = list(_digest)
+        _digest.clear()
+    if not items:
+        return True
+
+    token = os.getenv("TELEGRAM_BOT_TOKEN", "").strip()
+    chat_id = os.getenv("TELEGRAM_CHAT_ID", "").strip()
+    if not token or not chat_id:
+        print(f"[TELEGRAM_DISABLED] no token or chat_id, drop digest of {len(items)} messages")
+        return True
+
+    # 去重（保持首次出现的顺序）
+    counts = {}
+    for _, t in items:
+        counts[t] = counts.get(t, 0) + 1
+    texts = [t if n == 1 else f"{t}\n（×{n}）" for t, n in counts.items()]
+
+    header = f"📋 {title + ' ' if title else ''}通知汇总：{len(items)} 条"
+    # 给 header 和 _send_telegram 追加的运行链接留出空间，保证每段只发一条消息
+    run_url = _build_run_url()
+    reserve = len(header) + 16 + (len(run_url) + 4 if run_url else 0)
+    parts = _pack(texts, MAX_LEN - reserve)
+
+    ok_all = True
+    for i, part in enumerate(parts, 1):
+        head = header if len(parts) == 1 else f"{header}（{i}/{len(parts)}）"
+        ok_all = _send_telegram(token, chat_id, f"{head}\n\n{part}") and ok_all
+    print(f"[TELEGRAM] digest: {len(items)} messages -> {len(parts)} sends, ok={ok_all}")
+    return ok_all
+
+
+def outbox_report(tag: str = "[OUTBOX]"):
+    """打印发件箱队列深度 / 投递延迟（每个 run_once 结束时调用一次）。"""
+    outbox.report(tag)
+
+
+# 进程意外提前退出时也把没发出去的汇总发掉（atexit 后注册先执行：先入发件箱，再由 outbox 等待发完）
+atexit.register(flush_digest)
@@ -0,0 +1,221 @@
+# outbox.py
+# 通知发件箱：消息先落盘（SQLite），由后台线程按 Telegram 的频率限制逐条发送。
+# - 主流程只做一次本地 INSERT，不再被 Telegram 的网络错误/退避 sleep 卡住
+# - Telegram 挂了也不丢：失败的消息留在库里按退避重试；进程重启后继续发
+# - 进程退出前最多等 NOTIFY_DRAIN_TIMEOUT 秒把队列发完，剩下的留给下一次运行
+#
+# 环境变量（运行时读取）：
+#   NOTIFY_OUTBOX          true/false  总开关（默认 true；false = notify 里同步发送，行为同旧版）
+#   NOTIFY_OUTBOX_DB       路径        默认 .state/outbox.db
+#   NOTIFY_MIN_INTERVAL    秒          同一 chat 两条消息的最小间隔，默认 1.05（Telegram 约 1 条/秒/chat）
+#   NOTIFY_MAX_ATTEMPTS    次          超过后丢弃并打印，默认 20
+#   NOTIFY_DRAIN_TIMEOUT   秒          退出前等待发完的上限，默认 60
+import os
+import json
+import time
+import atexit
+import sqlite3
+import threading
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id     TEXT NOT NULL,
+    payload     TEXT NOT NULL,
+    created_at  REAL NOT NULL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    next_try_at REAL NOT NULL
+)
+"""
+
+_conn = None
+_conn_path = None
+_lock = threading.RLock()
+_wake = threading.Event()
+_worker = None
+_sender = None           # payload(dict) -> (ok, retry_after, permanent)；由 notify 注册
+_last_sent = {}          # chat_id -> ts
+_stats = {"queued": 0, "sent": 0, "retried": 0, "dropped": 0, "latency": []}
+
+
+def enabled() -> bool:
+    return os.getenv("NOTIFY_OUTBOX", "true").strip().lower() == "true"
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _connect():
+    global _conn, _conn_path
+    path = os.getenv("NOTIFY_OUTBOX_DB", os.path.join(".state", "outbox.db"))
+    if _conn is not None and _conn_path == path:
+        return _conn
+    if _conn is not None:
+        _conn.close()
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(_SCHEMA)
+    conn.commit()
+    _conn, _conn_path = conn, path
+    return conn
+
+
+def set_sender(fn):
+    global _sender
+    _sender = fn
+
+
+def enqueue(payload: dict):
+    """消息入队（立即落盘），唤醒后台线程。"""
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        conn.execute(
+            "INSERT INTO outbox (chat_id, payload, created_at, next_try_at) VALUES (?, ?, ?, ?)",
+            (str(payload.get("chat_id", "")), json.dumps(payload, ensure_ascii=False), now, now),
+        )
+        conn.commit()
+        _stats["queued"] += 1
+    start()
+    _wake.set()
+
+
+def depth() -> int:
+    with _lock:
+        return _connect().execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+
+def start():
+    """启动后台发送线程（幂等）；上一次运行遗留的消息也会被发出。"""
+    global _worker
+    with _lock:
+        if _worker is not None and _worker.is_alive():
+            return
+        _worker = threading.Thread(target=_run, name="notify-outbox", daemon=True)
+        _worker.start()
+
+
+def _next_due():
+    with _lock:
+        return _connect().execute(
+            "SELECT id, chat_id, payload, created_at, attempts, next_try_at FROM outbox "
+            "ORDER BY next_try_at, id LIMIT 1"
+        ).fetchone()
+
+
+def _run():
+    while True:
+        try:
+            _step()
+        except Exception as e:
+            # 后台线程不能死：库被锁等异常时稍等再试
+            print(f"[OUTBOX] worker error: {e}")
+            time.sleep(1)
+
+
+def _step():
+    """发送一条到期的消息；没有到期的就等一会儿。"""
+    row = _next_due()
+    if row is None:
+        _wake.wait(5)
+        _wake.clear()
+        return
+    msg_id, chat_id, payload, created_at, attempts, next_try_at = row
+
+    # 等到该条的重试时间、以及该 chat 的最小发送间隔
+    gap = _env_float("NOTIFY_MIN_INTERVAL", 1.05)
+    wait = max(next_try_at, _last_sent.get(chat_id, 0) + gap) - time.time()
+    if wait > 0:
+        _wake.wait(min(wait, 5))
+        _wake.clear()
+        return
+
+    try:
+        ok, retry_after, permanent = _sender(json.loads(payload))
+    except Exception as e:
+        print(f"[OUTBOX] sender error: {e}")
+        ok, retry_after, permanent = False, None, False
+    _last_sent[chat_id] = time.time()
+
+    with _lock:
+        conn = _connect()
+        if ok:
+            conn.execute("DELETE FROM outbox WHERE id=?", (msg_id,))
+            _stats["sent"] += 1
+            _stats["latency"].append(time.time() - created_at)
+        elif permanent or attempts + 1 >= int(_env_float("NOTIFY_MAX_ATTEMPTS", 20)):
+            conn.execute("DELETE FROM outbox WHERE id=?", (msg_id,))
+            _stats["dropped"] += 1
+            print(f"[OUTBOX] drop message #{msg_id} after {attempts + 1} attempts")
+        else:
+            # Telegram 给了 retry_after（429）就按它来，否则指数退避，最长 5 分钟
+            delay = retry_after if retry_after else min(300, 2 ** (attempts + 1))
+            conn.execute("UPDATE outbox SET attempts=?, next_try_at=? WHERE id=?",
+                         (attempts + 1, time.time() + delay, msg_id))
+            _stats["retried"] += 1
+        conn.commit()
+
+
+def drain(timeout: float = None) -> int:
+    """等待队列发完（最多 timeout 秒），返回剩余条数。"""
+    if _sender is None:
+        return 0
+    if timeout is None:
+        timeout = _env_float("NOTIFY_DRAIN_TIMEOUT", 60)
+    try:
+        if depth() == 0:
+            return 0
+    except Exception:
+        return 0
+    start()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with _lock:
+            left, soonest = _connect().execute("SELECT COUNT(*), MIN(next_try_at) FROM outbox").fetchone()
+        # 剩下的都在退避中、等不到了，就不空等
+        if left == 0 or soonest > deadline:
+            return left
+        _wake.set()
+        time.sleep(0.2)
+    return depth()
+
+
+def report(tag: str = "[OUTBOX]"):
+    """打印队列深度与投递延迟并清零计数（每个 run_once 结束时调用一次）。"""
+    if not enabled():
+        return
+    with _lock:
+        lat = sorted(_stats["latency"])
+        s = dict(_stats)
+        _stats.update({"queued": 0, "sent": 0, "retried": 0, "dropped": 0, "latency": []})
+    try:
+        left = depth()
+    except Exception:
+        left = -1
+    if left > 0:
+        # 上一次运行遗留的也一起发
+        start()
+    if not (s["queued"] or s["sent"] or left):
+        return
+    p50 = lat[len(lat) // 2] if lat else 0.0
+    mx = lat[-1] if lat else 0.0
+    print(
+        f"{tag} queued={s['queued']} sent={s['sent']} retried={s['retried']} dropped={s['dropped']} "
+        f"depth={left} latency_p50={p50:.1f}s max={mx:.1f}s"
+    )
+
+
+def _drain_at_exit():
+    left = drain()
+    if left:
+        print(f"[OUTBOX] {left} messages still queued, will retry next run")
+
+
+atexit.register(_drain_at_exit)
@@ -0,0 +1,155 @@
+# parse_pool.py
+# HTML 解析/判定放到进程池里跑，主线程只管抓页面：抓第 k+1 个页面的同时，第 k 个页面在另一个核上解析。
+# 由 pipeline.run() 驱动（流水线的 detect 段）：
+#   submit(site, html)      抓到页面后提交解析，返回 Future
+#   complete(site, finish, item)  取回判定结果，调用 finish(ctx, code, html, analysis)
+# analysis = {"status": ..., "price": ...}（没有 extract_price 的站点没有 price）；非 200 的页面为 None。
+# FETCH_MODE=AUTO 时“静态页判不出 / HTTP 非 200 → Playwright 渲染”的升级也在这里做（判定结果回来之后、
+# 在调用 complete 的线程里），抓取线程不碰 Playwright，也不再在抓取路径上先解析一遍。
+#
+# 环境变量（运行时读取）：
+#   PARSE_WORKERS   auto（默认 = CPU 核数；单核时为 0）| 0 = 在主线程里解析（旧行为）| N
+#   PARSE_DEPTH     同时在解析中的页面数上限，默认 2 × workers
+import os
+import time
+import atexit
+import importlib
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import metrics
+
+_pool = None
+_pool_size = 0
+
+
+def workers() -> int:
+    raw = os.getenv("PARSE_WORKERS", "auto").strip().lower()
+    if raw in ("", "auto"):
+        n = os.cpu_count() or 1
+        return n if n > 1 else 0
+    try:
+        return max(0, int(raw))
+    except ValueError:
+        return 0
+
+
+def analyze(site: str, html) -> dict:
+    """解析一次页面，跑该站点的 detect（和 extract_price），返回结果与耗时。进程池里和主线程里都用它。"""
+    from detectors.parsed import parse
+
+    t0 = time.perf_counter()
+    if isinstance(html, bytes):
+        html = html.decode("utf-8", errors="replace")
+    mod = importlib.import_module(f"detectors.{site}")
+    page = parse(html)
+    out = {"status": mod.detect(page)}
+    if hasattr(mod, "extract_price"):
+        out["price"] = mod.extract_price(page)
+    out["ms"] = (time.perf_counter() - t0) * 1000
+    return out
+
+
+def _warm():
+    # 工作进程启动时先把 lxml / detectors 导入好，第一页不用再等
+    from detectors import amazon, dorasuta, rakuten, yahoo, yshopping  # noqa: F401
+
+
+def _get_pool():
+    global _pool, _pool_size
+    n = workers()
+    if n <= 0:
+        return None
+    if _pool is not None and _pool_size == n:
+        return _pool
+    shutdown()
+    # 主进程里有 Telegram 发件箱线程 / Playwright，fork 不安全；forkserver 不可用时退回 spawn
+    methods = multiprocessing.get_all_start_methods()
+    ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    _pool = ProcessPoolExecutor(max_workers=n, mp_context=ctx, initializer=_warm)
+    _pool_size = n
+    return _pool
+
+
+def submit(site: str, html: str) -> Future:
+    """交给进程池解析（传 UTF-8 字节）；进程池关闭时当场解析，返回已完成的 Future。"""
+    pool = _get_pool()
+    if pool is not None:
+        try:
+            return pool.submit(analyze, site, html.encode("utf-8", errors="replace"))
+        except Exception as e:
+            print(f"[PARSE_POOL] submit failed, parse inline: {e}")
+    fut = Future()
+    try:
+        fut.set_result(analyze(site, html))
+    except Exception as e:
+        fut.set_exception(e)
+    return fut
+
+
+def _result(fut: Future, site: str, html: str) -> dict:
+    try:
+        return fut.result()
+    except Exception as e:
+        # 工作进程崩了（BrokenProcessPool）或 detector 报错：在主线程里再试一次
+        print(f"[PARSE_POOL] worker error, parse inline: {type(e).__name__}: {e}")
+        if "BrokenProcessPool" in type(e).__name__:
+            shutdown()
+        try:
+            return analyze(site, html)
+        except Exception as e2:
+            print(f"[PARSE_POOL] detect error: {e2}")
+            return {"status": "UNKNOWN", "ms": 0.0}
+
+
+def _auto_mode() -> bool:
+    return os.getenv("FETCH_MODE", "REQUESTS").strip().upper() == "AUTO"
+
+
+def depth() -> int:
+    """同时在解析中的页面数上限；不用进程池时为 0（抓一页判一页）。"""
+    n = workers()
+    if n <= 0:
+        return 0
+    try:
+        return max(1, int(os.getenv("PARSE_DEPTH", str(2 * n))))
+    except ValueError:
+        return 2 * n
+
+
+def complete(site: str, finish, item):
+    ctx, url, code, html, fut, rec = item
+    metrics.use(rec)
+    analysis = None
+    if fut is not None:
+        t0 = time.perf_counter()
+        analysis = _result(fut, site, html)
+        metrics.add("parse_wait", (time.perf_counter() - t0) * 1000)
+        metrics.add("detect", analysis.get("ms", 0.0))
+
+    # AUTO：静态页判不出，或 HTTP 非 200 且不是明确失效（404/410），用 Playwright 再渲染一次
+    if _auto_mode() and code not in (404, 410) and (analysis is None or analysis.get("status") == "UNKNOWN"):
+        from fetcher import fetch_playwright
+        print(f"[FETCH] AUTO escalate to Playwright: {url} (HTTP={code})")
+        metrics.fallback("playwright")
+        with metrics.stage("fetch"):
+            code, html = fetch_playwright(url)
+        metrics.note(http=code, bytes=len(html))
+        analysis = analyze(site, html) if code == 200 else None
+        if analysis:
+            metrics.add("detect", analysis["ms"])
+    finish(ctx, code, html, analysis)
+    metrics.end()
+
+
+def shutdown():
+    global _pool, _pool_size
+    if _pool is not None:
+        try:
+            _pool.shutdown(wait=True, cancel_futures=True)
+        except Exception:
+            pass
+    _pool, _pool_size = None, 0
+
+
+atexit.register(shutdown)
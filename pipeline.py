@@ -0,0 +1,244 @@
+# pipeline.py
+# 有界队列的分段流水线：读表 → 抓页面 → 解析判定 → 规则判断 → eBay 清零 → 通知。
+# 每段有自己的线程数和队列上限；下游慢时上游的 put() 阻塞（背压），页面不会无限堆积，
+# 最慢的依赖（eBay 调用 / Telegram 重试）只拖慢自己那一段，不再卡住下一个页面的抓取。
+#
+#   fetch   pipeline.run 里 PIPELINE_FETCH_WORKERS 个线程跑 start(r)（复查判断 + 抓页面）
+#   detect  parse_pool 进程池，最多 PARSE_DEPTH 个页面在解析中
+#   decide  调用 run 的线程跑 finish（状态库 / should_zero / 交给 ZeroBatch）；AUTO 升级 Playwright 也在这里
+#   ebay    ZeroBatch 攒满一批交给 PIPELINE_EBAY_WORKERS 个线程发送（见 ebay_updater.py）
+#   notify  eBay 返回后的通知回调交给 PIPELINE_NOTIFY_WORKERS 个线程
+# run_once 结束时各段的队列深度（最大/平均）、put 被阻塞的时间、工作时间记进 metrics（日志里搜 "METRICS queue"）。
+#
+# 环境变量（运行时读取）：
+#   PIPELINE_QUEUE            每段队列的容量，默认 8
+#   PIPELINE_FETCH_WORKERS    默认 1（同一站点仍一个接一个地抓，只是和后面几段重叠）；0 = 在主线程里抓（旧行为）
+#                             FETCH_MODE=PLAYWRIGHT 时固定为 0：sync Playwright 绑定在创建它的线程上
+#   PIPELINE_EBAY_WORKERS     默认 1；0 = 攒满一批就在调用线程里同步发送（旧行为）
+#   PIPELINE_NOTIFY_WORKERS   默认 1；0 = 在 eBay 线程里直接回调
+import os
+import time
+import queue
+import threading
+import traceback
+from collections import deque
+
+import metrics
+import parse_pool
+
+_STOP = object()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+def queue_size() -> int:
+    return max(1, _env_int("PIPELINE_QUEUE", 8))
+
+
+def workers(stage: str, default: int = 1) -> int:
+    return _env_int(f"PIPELINE_{stage.upper()}_WORKERS", default)
+
+
+class Channel:
+    """有界队列：put() 满了就阻塞；记录每次入队时的深度和被阻塞的时间。"""
+
+    def __init__(self, size: int = None):
+        self.size = size or queue_size()
+        self._q = queue.Queue(maxsize=self.size)
+        self._lock = threading.Lock()
+        self.puts = 0
+        self.depth_sum = 0
+        self.max_depth = 0
+        self.blocked_ms = 0.0
+
+    def sample(self, depth: int):
+        with self._lock:
+            self.puts += 1
+            self.depth_sum += depth
+            self.max_depth = max(self.max_depth, depth)
+
+    def put(self, item, count: bool = True):
+        if count:
+            self.sample(self._q.qsize())
+        t0 = time.perf_counter()
+        self._q.put(item)
+        if count:
+            with self._lock:
+                self.blocked_ms += (time.perf_counter() - t0) * 1000
+
+    def get(self, timeout: float = None):
+        return self._q.get(timeout=timeout)
+
+    def task_done(self):
+        self._q.task_done()
+
+    def stats(self) -> dict:
+        return {"cap": self.size, "puts": self.puts, "max_depth": self.max_depth,
+                "avg_depth": round(self.depth_sum / self.puts, 2) if self.puts else 0.0,
+                "blocked_ms": round(self.blocked_ms, 1)}
+
+
+class Stage:
+    """
+    一段流水线：Channel + workers 个线程跑 fn(item)；workers=0 时 put() 直接在调用线程里执行 fn。
+    fn 抛出的异常打印并记进 errors（线程不会死，下游不会卡住），由调用方在 close() 之后决定是否报错。
+    close() 等队列里已有的全部处理完再让线程退出。
+    """
+
+    def __init__(self, name: str, fn, workers: int = 1, size: int = None):
+        self.name = name
+        self.fn = fn
+        self.workers = max(0, workers)
+        self.inbox = Channel(size)
+        self.errors = []
+        self.busy_ms = 0.0
+        self._lock = threading.Lock()
+        self._threads = []
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def put(self, item):
+        if not self.workers:
+            self.inbox.sample(0)
+            self._call(item)
+            return
+        self.inbox.put(item)
+
+    def _call(self, item):
+        t0 = time.perf_counter()
+        try:
+            self.fn(item)
+        except Exception as e:
+            print(f"[PIPELINE] {self.name} error: {type(e).__name__}: {e}")
+            traceback.print_exc()
+            with self._lock:
+                self.errors.append(e)
+        finally:
+            with self._lock:
+                self.busy_ms += (time.perf_counter() - t0) * 1000
+
+    def _run(self):
+        while True:
+            item = self.inbox.get()
+            try:
+                if item is _STOP:
+                    return
+                self._call(item)
+            finally:
+                self.inbox.task_done()
+
+    def close(self):
+        for _ in self._threads:
+            self.inbox.put(_STOP, count=False)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    def stats(self) -> dict:
+        return dict(self.inbox.stats(), workers=self.workers, busy_ms=round(self.busy_ms, 1),
+                    errors=len(self.errors))
+
+
+def _fetch_workers() -> int:
+    if os.getenv("FETCH_MODE", "REQUESTS").strip().upper() == "PLAYWRIGHT":
+        return 0
+    return workers("fetch")
+
+
+def run(site: str, rows, start, finish):
+    """
+    处理本站点的行：
+      start(r)  -> None 或 (ctx, url, code, html)   fetch 段：复查判断 + 抓页面（fetch(url, escalate=False)）
+      finish(ctx, code, html, analysis)             decide 段：在调用线程里执行，参数见 parse_pool
+    finish 按抓取完成的顺序执行（fetch 只有 1 个线程时就是表格顺序）。
+    start 抛出的异常在其余行处理完之后重新抛出（main_all 据此把该站点记为失败）。
+    """
+    n = _fetch_workers()
+    depth = parse_pool.depth()
+    pending = deque()
+    detect = Channel(max(1, depth))     # 只用来统计在解析中的页面数
+    cancel = threading.Event()
+
+    def _take(got, rec):
+        ctx, url, code, html = got
+        detect.sample(len(pending))
+        fut = parse_pool.submit(site, html) if code == 200 else None
+        pending.append((ctx, url, code, html, fut, rec))
+        while len(pending) > depth:
+            parse_pool.complete(site, finish, pending.popleft())
+
+    def _start(r):
+        got = None
+        try:
+            got = start(r)
+        finally:
+            # 这一行交给 decide 段继续，抓取线程不再持有它
+            rec = metrics.detach()
+            if got is None:
+                metrics.end(rec)
+        return got, rec
+
+    decide = Channel()
+    ready = []      # n == 0：抓完直接在本线程判定
+
+    def _fetch(r):
+        if cancel.is_set():
+            return
+        got, rec = _start(r)
+        if got is None:
+            return
+        if n == 0:
+            ready.append((got, rec))
+        else:
+            decide.put((got, rec))
+
+    fetch = Stage("fetch", _fetch, workers=n)
+    if n == 0:
+        for r in rows:
+            fetch.put(r)
+            while ready:
+                decide.sample(0)
+                _take(*ready.pop(0))
+    else:
+        def _feed():
+            try:
+                for r in rows:
+                    if cancel.is_set():
+                        break
+                    fetch.put(r)
+            finally:
+                fetch.close()
+                decide.put(_STOP, count=False)
+
+        feeder = threading.Thread(target=_feed, name=f"{site}-feed", daemon=True)
+        feeder.start()
+        try:
+            while True:
+                item = decide.get()
+                if item is _STOP:
+                    break
+                _take(*item)
+        finally:
+            # decide 段出错提前退出时，放空队列让抓取线程结束
+            cancel.set()
+            while feeder.is_alive():
+                try:
+                    decide.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    while pending:
+        parse_pool.complete(site, finish, pending.popleft())
+
+    metrics.queue(site, "fetch", fetch.stats())
+    metrics.queue(site, "detect", dict(detect.stats(), workers=parse_pool.workers()))
+    metrics.queue(site, "decide", dict(decide.stats(), workers=1))
+    if fetch.errors:
+        raise fetch.errors[0]
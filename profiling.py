@@ -0,0 +1,152 @@
+# profiling.py
+# 可选的性能剖析：给各 main_* 的 run_once 套上 @profiling.profiled("<site>")，
+# 打开 PROFILE 时记录 cProfile（CPU）和 tracemalloc（内存分配）并写到 PROFILE_DIR，
+# 默认 logs/profile/，workflow 的 Upload logs 会和 run.log 一起上传。
+#
+# 环境变量（运行时读取）：
+#   PROFILE          空（默认，关闭）| cpu | mem | cpu,mem | true（= cpu,mem）
+#   PROFILE_SITES    只剖析这些站点（逗号分隔，名字见 sites.SITE_NAMES；默认全部）
+#   PROFILE_ROWS     >0 时只跑该站点随机抽的 N 行（其余行本轮不处理！只在排查时用）
+#   PROFILE_DIR      输出目录，默认 logs/profile
+#   PROFILE_TOP      文本报告里列多少条，默认 40
+#   PROFILE_MEM_FRAMES  tracemalloc 每个分配点保留的栈帧数，默认 1（加大更准但更慢）
+#
+# 输出（每个站点）：
+#   <site>-cpu.prof   pstats 二进制，可用 `python -m pstats` / snakeviz 打开
+#   <site>-cpu.txt    按 cumulative 和 tottime 排序的前 PROFILE_TOP 个函数
+#   <site>-mem.txt    tracemalloc 峰值 + 按代码行汇总的前 PROFILE_TOP 个分配点
+# cProfile 只看调用 run_once 的线程；Mercari 并发模式里线程池上的工作（快速路径、eBay 回调）不在 CPU 报告里。
+import io
+import os
+import time
+import pstats
+import cProfile
+import functools
+import tracemalloc
+
+
+# 剖析器自己的分配不计入内存报告
+_MEM_IGNORE = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, cProfile.__file__),
+    tracemalloc.Filter(False, pstats.__file__),
+]
+
+
+def _modes() -> set:
+    raw = os.getenv("PROFILE", "").strip().lower()
+    if raw in ("", "false", "0", "off"):
+        return set()
+    if raw in ("true", "1", "on", "all"):
+        return {"cpu", "mem"}
+    return {m.strip() for m in raw.split(",") if m.strip() in ("cpu", "mem")}
+
+
+def active(site: str) -> set:
+    """该站点本轮要开的剖析模式（空集 = 不剖析）。"""
+    modes = _modes()
+    if not modes:
+        return set()
+    sites = [s.strip().lower() for s in os.getenv("PROFILE_SITES", "").split(",") if s.strip()]
+    if sites and site not in sites:
+        return set()
+    return modes
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _out_dir() -> str:
+    d = os.getenv("PROFILE_DIR", os.path.join("logs", "profile"))
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+def _sample(site: str, df):
+    """PROFILE_ROWS>0：从本站点的行里固定种子随机抽 N 行。"""
+    n = _env_int("PROFILE_ROWS", 0)
+    if n <= 0:
+        return df
+    import ledger
+    from sheet_reader import read_ledger
+    from sites import get_site
+
+    if df is None:
+        df = read_ledger()
+    part = ledger.select(df, get_site(site)["domains"])
+    if len(part) > n:
+        part = part.sample(n=n, random_state=0)
+    print(f"[PROFILE] {site}: sampling {len(part)} rows (PROFILE_ROWS={n}); other rows are not processed this run")
+    return part
+
+
+def _write_cpu(site: str, prof, out: str, top: int):
+    prof.dump_stats(os.path.join(out, f"{site}-cpu.prof"))
+    buf = io.StringIO()
+    st = pstats.Stats(prof, stream=buf).strip_dirs()
+    st.sort_stats("cumulative").print_stats(top)
+    st.sort_stats("tottime").print_stats(top)
+    with open(os.path.join(out, f"{site}-cpu.txt"), "w", encoding="utf-8") as f:
+        f.write(buf.getvalue())
+
+
+def _write_mem(site: str, snap, peak: int, out: str, top: int):
+    stats = snap.statistics("lineno")
+    with open(os.path.join(out, f"{site}-mem.txt"), "w", encoding="utf-8") as f:
+        f.write(f"peak traced memory: {peak / 1024 / 1024:.1f} MiB\n")
+        f.write(f"still allocated at end: {sum(s.size for s in stats) / 1024 / 1024:.1f} MiB\n\n")
+        for s in stats[:top]:
+            f.write(f"{s.size / 1024:10.1f} KiB  {s.count:8d} blocks  {s.traceback}\n")
+
+
+def profiled(site: str):
+    """装饰 run_once(df=None)：PROFILE 打开且命中 PROFILE_SITES 时剖析整次调用，否则原样调用。"""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(df=None, *args, **kwargs):
+            modes = active(site)
+            if not modes:
+                return fn(df, *args, **kwargs)
+            df = _sample(site, df)
+            out = _out_dir()
+            top = _env_int("PROFILE_TOP", 40)
+
+            prof = cProfile.Profile() if "cpu" in modes else None
+            started_mem = "mem" in modes and not tracemalloc.is_tracing()
+            if started_mem:
+                tracemalloc.start(_env_int("PROFILE_MEM_FRAMES", 1))
+            t0 = time.perf_counter()
+            if prof:
+                prof.enable()
+            try:
+                return fn(df, *args, **kwargs)
+            finally:
+                if prof:
+                    prof.disable()
+                elapsed = time.perf_counter() - t0
+                written = []
+                try:
+                    # 先拍内存快照，免得把下面写 CPU 报告的分配也算进去
+                    snap = peak = None
+                    if "mem" in modes and tracemalloc.is_tracing():
+                        _, peak = tracemalloc.get_traced_memory()
+                        snap = tracemalloc.take_snapshot().filter_traces(_MEM_IGNORE)
+                    if prof:
+                        _write_cpu(site, prof, out, top)
+                        written += [f"{site}-cpu.prof", f"{site}-cpu.txt"]
+                    if snap is not None:
+                        _write_mem(site, snap, peak, out, top)
+                        written.append(f"{site}-mem.txt")
+                except Exception as e:
+                    print(f"[PROFILE] {site}: write failed: {e}")
+                finally:
+                    if started_mem:
+                        tracemalloc.stop()
+                print(f"[PROFILE] {site}: {elapsed:.1f}s profiled ({','.join(sorted(modes))}) → "
+                      f"{out}/{{{','.join(written)}}}")
+        return wrapper
+    return deco
@@ -0,0 +1,111 @@
+# ratelimit.py
+# 按域名的令牌桶：所有对商品站点的请求（fetcher 的 requests / Playwright、main_gsheets 的 page.goto）发出前先取令牌，
+# 并发抓取（PIPELINE_FETCH_WORKERS>1、MERCARI_CONCURRENCY>1）时同一域名也不会超过设定的速率。
+#   ratelimit.wait(url)               同步：令牌不够就 sleep
+#   await ratelimit.wait_async(url)   async Playwright 用
+# 桶按主机名分（去掉开头的 www.，amazon.co.jp 与 www.amazon.co.jp 共用一个桶）；速率/突发按站点配置（sites.classify）。
+# 预约式：取令牌时立即扣（可以扣成负数），算出要等多久后在锁外等待，线程/协程之间不互相阻塞。
+# 等待时间记进当前行的 metrics（阶段 throttle）。ledger.rows 会把行按主机名轮流排开，多个抓取线程分摊到不同的桶上。
+#
+# 环境变量（运行时读取）：
+#   RATE_LIMIT          true/false 总开关（默认 true）
+#   RATE_RPS            每个域名每秒请求数，默认 3；0 = 不限
+#   RATE_BURST          桶容量（允许连续突发的请求数），默认 = max(1, RATE_RPS)
+#   RATE_RPS_<SITE> / RATE_BURST_<SITE>   按站点覆盖（名字见 sites.SITE_NAMES，大写），例如 RATE_RPS_MERCARI=1
+# 速率是整轮的预算：分片运行（SHARD_COUNT=N）时 N 个作业同时打同一站点，每片按 1/N 限速。
+import os
+import time
+import asyncio
+import threading
+from urllib.parse import urlsplit
+
+import metrics
+
+_lock = threading.Lock()
+_buckets = {}   # host -> [tokens, last_ts, rps, burst]
+_stats = {}     # host -> {"site", "requests", "throttled", "wait_s"}
+
+
+def enabled() -> bool:
+    return os.getenv("RATE_LIMIT", "true").strip().lower() == "true"
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def host_of(url: str) -> str:
+    """桶的 key：小写主机名，去掉开头的 www.。"""
+    try:
+        host = (urlsplit(str(url or "").strip()).hostname or "").lower()
+    except ValueError:
+        host = ""
+    return host[4:] if host.startswith("www.") else host
+
+
+def limits(site) -> tuple:
+    """(rps, burst)：RATE_RPS_<SITE> / RATE_BURST_<SITE> 优先，分片时按 SHARD_COUNT 均分。"""
+    rps = _env_float("RATE_RPS", 3)
+    if site and os.getenv(f"RATE_RPS_{site.upper()}") is not None:
+        rps = _env_float(f"RATE_RPS_{site.upper()}", rps)
+    burst = _env_float("RATE_BURST", max(1.0, rps))
+    if site and os.getenv(f"RATE_BURST_{site.upper()}") is not None:
+        burst = _env_float(f"RATE_BURST_{site.upper()}", burst)
+    from ledger import shard_spec
+    _, count = shard_spec()
+    return rps / count, max(1.0, burst / count)
+
+
+def reserve(url: str) -> float:
+    """取一个令牌，返回需要等待的秒数（0 = 立即可发）。"""
+    if not enabled():
+        return 0.0
+    from sites import classify
+    site = classify(url)
+    rps, burst = limits(site)
+    if rps <= 0:
+        return 0.0
+    host = host_of(url)
+    now = time.monotonic()
+    with _lock:
+        b = _buckets.get(host)
+        if b is None or b[2] != rps or b[3] != burst:
+            b = _buckets[host] = [burst, now, rps, burst]
+        tokens = min(burst, b[0] + (now - b[1]) * rps) - 1
+        b[0], b[1] = tokens, now
+        wait = -tokens / rps if tokens < 0 else 0.0
+        st = _stats.setdefault(host, {"site": site or "", "requests": 0, "throttled": 0, "wait_s": 0.0})
+        st["requests"] += 1
+        if wait > 0:
+            st["throttled"] += 1
+            st["wait_s"] += wait
+    return wait
+
+
+def wait(url: str):
+    w = reserve(url)
+    if w > 0:
+        metrics.add("throttle", w * 1000)
+        time.sleep(w)
+
+
+async def wait_async(url: str):
+    w = reserve(url)
+    if w > 0:
+        metrics.add("throttle", w * 1000)
+        await asyncio.sleep(w)
+
+
+def report(tag: str, site: str):
+    """打印该站点各域名本轮的请求数 / 被限速次数 / 累计等待，然后清掉计数。"""
+    with _lock:
+        mine = {h: s for h, s in _stats.items() if s["site"] == site}
+        for h in mine:
+            del _stats[h]
+    for host, s in sorted(mine.items()):
+        rps, burst = limits(site)
+        print(f"{tag} {host}: requests={s['requests']} throttled={s['throttled']} "
+              f"wait={s['wait_s']:.1f}s (rps={rps:g} burst={burst:g})")
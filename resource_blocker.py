@@ -0,0 +1,173 @@
+# resource_blocker.py
+# Playwright 资源拦截：PW_BLOCK_MEDIA=true 时，在 context 上挂 route，直接 abort
+# 图片/字体/音视频 和 常见统计/广告域名，商品页只下载判定需要的 HTML/JS/CSS。
+#
+# 环境变量（运行时读取）：
+#   PW_BLOCK_MEDIA   true/false   总开关（默认 false）
+#   PW_BLOCK_TYPES   逗号分隔      按资源类型拦截，默认 image,media,font
+#   PW_BLOCK_HOSTS   逗号分隔      额外的拦截域名（与内置追踪域名合并，后缀匹配）
+#   PW_ALLOW_HOSTS   逗号分隔      白名单：设置后，除页面本身外只放行这些域名（后缀匹配）
+import os
+from urllib.parse import urlparse
+
+DEFAULT_BLOCK_TYPES = ("image", "media", "font")
+
+# 常见统计/广告/埋点域名（后缀匹配）
+TRACKER_HOSTS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "googlesyndication.com",
+    "googleadservices.com",
+    "doubleclick.net",
+    "facebook.net",
+    "amazon-adsystem.com",
+    "criteo.com",
+    "criteo.net",
+    "scorecardresearch.com",
+    "hotjar.com",
+    "clarity.ms",
+    "yjtag.jp",
+    "ads.yahoo.co.jp",
+    "b92.yahoo.co.jp",
+    "ard.yahoo.co.jp",
+    "adservice.google.com",
+    "sentry.io",
+    "newrelic.com",
+    "nr-data.net",
+)
+
+# 拦截掉的请求没法知道真实大小，按类型给个经验值用来估算“省下的流量”
+_EST_BYTES = {
+    "image": 60_000,
+    "media": 500_000,
+    "font": 40_000,
+    "stylesheet": 20_000,
+    "script": 30_000,
+}
+_EST_DEFAULT = 5_000
+
+_stats = {"blocked": 0, "blocked_by": {}, "est_bytes_saved": 0,
+          "allowed": 0, "bytes_loaded": 0}
+
+
+def _csv_env(name: str, default=()) -> tuple:
+    raw = os.getenv(name)
+    if raw is None:
+        return tuple(default)
+    return tuple(x.strip().lower() for x in raw.split(",") if x.strip())
+
+
+def enabled() -> bool:
+    return os.getenv("PW_BLOCK_MEDIA", "false").strip().lower() == "true"
+
+
+def _host_in(host: str, domains) -> bool:
+    return any(host == d or host.endswith("." + d) for d in domains)
+
+
+def block_reason(url: str, resource_type: str, block_types, deny_hosts, allow_hosts):
+    """返回拦截原因（'type:image' / 'host' / 'allowlist'）；放行返回 None。"""
+    # 页面本身永远放行
+    if resource_type == "document":
+        return None
+    host = (urlparse(url).hostname or "").lower()
+    if not host:
+        # data:/blob: 等
+        return None
+    if allow_hosts and not _host_in(host, allow_hosts):
+        return "allowlist"
+    if _host_in(host, deny_hosts):
+        return "host"
+    if resource_type in block_types:
+        return f"type:{resource_type}"
+    return None
+
+
+def _count_blocked(reason: str, resource_type: str):
+    _stats["blocked"] += 1
+    _stats["blocked_by"][reason] = _stats["blocked_by"].get(reason, 0) + 1
+    _stats["est_bytes_saved"] += _EST_BYTES.get(resource_type, _EST_DEFAULT)
+
+
+def _on_response(response):
+    _stats["allowed"] += 1
+    try:
+        _stats["bytes_loaded"] += int(response.headers.get("content-length") or 0)
+    except Exception:
+        pass
+
+
+def _rules() -> tuple:
+    """(block_types, deny_hosts, allow_hosts)：install 时按当前环境变量读一次。"""
+    return (set(_csv_env("PW_BLOCK_TYPES", DEFAULT_BLOCK_TYPES)),
+            TRACKER_HOSTS + _csv_env("PW_BLOCK_HOSTS"),
+            _csv_env("PW_ALLOW_HOSTS"))
+
+
+def _decide(request, rules) -> bool:
+    """
+    同步 / async 两种 route handler 共用的判定：True = abort，并记进拦截统计。
+    拦截规则只在 block_reason 里，handler 只负责调用 route.abort() / route.continue_()。
+    """
+    reason = block_reason(request.url, request.resource_type, *rules)
+    if reason:
+        _count_blocked(reason, request.resource_type)
+    return bool(reason)
+
+
+def install(ctx):
+    """给同步 API 的 BrowserContext 挂拦截规则；PW_BLOCK_MEDIA 未开启时什么也不做。"""
+    if not enabled():
+        return ctx
+    rules = _rules()
+
+    def _handler(route):
+        try:
+            if _decide(route.request, rules):
+                route.abort()
+            else:
+                route.continue_()
+        except Exception:
+            # 页面已关闭等情况，忽略
+            pass
+
+    ctx.route("**/*", _handler)
+    ctx.on("response", _on_response)
+    return ctx
+
+
+async def install_async(ctx):
+    """同 install()，给 async API 的 BrowserContext 用。"""
+    if not enabled():
+        return ctx
+    rules = _rules()
+
+    async def _handler(route):
+        try:
+            if _decide(route.request, rules):
+                await route.abort()
+            else:
+                await route.continue_()
+        except Exception:
+            pass
+
+    await ctx.route("**/*", _handler)
+    ctx.on("response", _on_response)
+    return ctx
+
+
+def stats() -> dict:
+    return {**_stats, "blocked_by": dict(_stats["blocked_by"])}
+
+
+def report(tag: str = "[PW_BLOCK]"):
+    """打印本轮拦截统计并清零（每个 run_once 结束时调用一次）。"""
+    if _stats["blocked"] or _stats["allowed"]:
+        by = " ".join(f"{k}={v}" for k, v in sorted(_stats["blocked_by"].items()))
+        print(
+            f"{tag} blocked={_stats['blocked']} ({by}) "
+            f"est_saved≈{_stats['est_bytes_saved'] / 1024:.0f}KB "
+            f"loaded={_stats['allowed']} req / {_stats['bytes_loaded'] / 1024:.0f}KB"
+        )
+    _stats.update({"blocked": 0, "blocked_by": {}, "est_bytes_saved": 0,
+                   "allowed": 0, "bytes_loaded": 0})
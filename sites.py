@@ -0,0 +1,33 @@
+# sites.py
+# 站点注册表：域名 → detector / 主流程模块（main_all 用它一次读表、按站点分发）。
+# 顺序有意义：更具体的域名放前面（shopping.yahoo.co.jp 也包含 yahoo.co.jp，必须先判 Y!Shopping）。
+from detectors import amazon, dorasuta, mercari, rakuten, yahoo, yshopping
+
+SITES = [
+    {"name": "mercari",   "domains": ("mercari.com",),          "detector": mercari,   "runner": "main_gsheets"},
+    {"name": "amazon",    "domains": ("amazon.co.jp",),         "detector": amazon,    "runner": "main_amazon"},
+    {"name": "yshopping", "domains": ("shopping.yahoo.co.jp",), "detector": yshopping, "runner": "main_yshopping"},
+    {"name": "yahoo",     "domains": ("yahoo.co.jp",),          "detector": yahoo,     "runner": "main_yahoo"},
+    {"name": "dorasuta",  "domains": ("dorasuta.jp",),          "detector": dorasuta,  "runner": "main_dorasuta"},
+    {"name": "rakuten",   "domains": ("rakuten.co.jp",),        "detector": rakuten,   "runner": "main_rakuten"},
+]
+
+SITE_NAMES = [s["name"] for s in SITES]
+
+
+def classify(url):
+    """按 SITES 顺序匹配域名，返回站点名；都不匹配返回 None。"""
+    u = str(url or "").strip().lower()
+    if not u:
+        return None
+    for site in SITES:
+        if any(d in u for d in site["domains"]):
+            return site["name"]
+    return None
+
+
+def get_site(name: str) -> dict:
+    for site in SITES:
+        if site["name"] == name:
+            return site
+    raise KeyError(f"unknown site: {name}")
@@ -0,0 +1,282 @@
+# state_store.py
+# 每个商品的本地状态（SQLite，WAL 模式）：上次检测到的状态、上次推给 eBay 的库存、时间戳。
+# 目的：已经清零过、状态也没变的商品，下一轮不再重复调用 eBay、不再重复发通知。
+#
+#   state_store.observe(url, item_id, sku, status)      # 每行检测完都记一次（UNKNOWN 不记）
+#   state_store.needs_push(url, item_id, sku, 0)        # False = 已清零且状态没变，跳过
+#   ZeroBatch.add(..., url=url)                         # 清零结果由 ZeroBatch 回写 record_push
+#   state_store.is_due(url, item_id, sku)               # 自适应复查：没到复查时间的行本轮不抓
+#   state_store.report("[YAHOO] STATE")                 # 每个 run_once 结束时提交并打印统计
+#
+# 环境变量（运行时读取）：
+#   STATE_STORE          true/false   总开关（默认 true；false 时 needs_push 永远返回 True）
+#   STATE_DB             路径         默认 .state/listings.db
+#   STATE_REZERO_HOURS   小时         已清零的商品隔多久强制再推一次（防止有人在 eBay 手动补了库存），默认 24；0 = 不强制
+#   STATE_COMMIT_EVERY   条数         攒多少条写入提交一次，默认 50
+#
+# 自适应复查（按每个商品的状态变化历史决定下次检查时间）：
+#   RECHECK_ADAPTIVE        true/false  默认 true；false = 每轮检查所有行
+#   RECHECK_HOT_HOURS       最近多少小时内状态变过的商品算“活跃”，每轮都查，默认 24
+#   RECHECK_MIN_MINUTES     最短复查间隔（分钟），默认 0（= 每轮都查）
+#   RECHECK_MAX_MINUTES     稳定商品的最长复查间隔（分钟），默认 360
+#   RECHECK_STABLE_FACTOR   稳定商品的间隔 = 已稳定时长 × 系数 ÷ (1 + 历史变化次数)，默认 0.1
+#   RECHECK_ZEROED_MINUTES  已清零且状态没变的商品的复查间隔（分钟），默认 720
+import os
+import time
+import sqlite3
+import threading
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS listing_state (
+    source_url        TEXT NOT NULL,
+    item_id           TEXT NOT NULL,
+    sku               TEXT NOT NULL,
+    last_status       TEXT,
+    status_changed_at REAL,
+    last_seen_at      REAL,
+    last_qty          INTEGER,
+    last_push_at      REAL,
+    last_push_ok      INTEGER,
+    changes           INTEGER DEFAULT 0,
+    PRIMARY KEY (source_url, item_id, sku)
+)
+"""
+
+_conn = None
+_conn_path = None
+_lock = threading.RLock()
+_dirty = 0
+_COLUMNS = ("last_status", "status_changed_at", "last_seen_at", "last_qty",
+            "last_push_at", "last_push_ok", "changes")
+# 老版本建的表没有这些列，打开时补上
+_MIGRATIONS = {"changes": "ALTER TABLE listing_state ADD COLUMN changes INTEGER DEFAULT 0"}
+
+# 这些状态说明库存紧张/随时会变，按“活跃”处理
+_HOT_STATUSES = ("LOW_STOCK",)
+
+_stats = {"observed": 0, "changed": 0, "skipped": 0, "pushed": 0, "deferred": 0}
+
+
+def enabled() -> bool:
+    return os.getenv("STATE_STORE", "true").strip().lower() == "true"
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _db_path() -> str:
+    return os.getenv("STATE_DB", os.path.join(".state", "listings.db"))
+
+
+def _connect():
+    """懒连接；STATE_DB 变了（例如分片跑）就重新打开。"""
+    global _conn, _conn_path
+    path = _db_path()
+    if _conn is not None and _conn_path == path:
+        return _conn
+    close()
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    # ZeroBatch 的回调可能在别的线程里（main_gsheets 并发模式），统一用 _lock 串行化
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(_SCHEMA)
+    have = {row[1] for row in conn.execute("PRAGMA table_info(listing_state)")}
+    for col, ddl in _MIGRATIONS.items():
+        if col not in have:
+            conn.execute(ddl)
+    conn.commit()
+    _conn, _conn_path = conn, path
+    return conn
+
+
+def _key(url, item_id, sku) -> tuple:
+    return (str(url or "").strip(), str(item_id or "").strip(), str(sku or "").strip())
+
+
+def _maybe_commit(conn):
+    global _dirty
+    _dirty += 1
+    if _dirty >= max(1, _env_int("STATE_COMMIT_EVERY", 50)):
+        conn.commit()
+        _dirty = 0
+
+
+def get(url, item_id, sku):
+    """返回该商品的状态行（dict）；没有记录返回 None。"""
+    if not enabled():
+        return None
+    with _lock:
+        cur = _connect().execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM listing_state WHERE source_url=? AND item_id=? AND sku=?",
+            _key(url, item_id, sku),
+        )
+        row = cur.fetchone()
+    if row is None:
+        return None
+    return dict(zip(_COLUMNS, row))
+
+
+def observe(url, item_id, sku, status: str) -> bool:
+    """记录本轮检测到的状态；返回 True 表示状态与上次不同（含第一次见到）。UNKNOWN 不记录。"""
+    if not enabled() or not status or status == "UNKNOWN":
+        return False
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        prev = get(url, item_id, sku)
+        changed = prev is None or prev["last_status"] != status
+        if prev is None:
+            conn.execute(
+                "INSERT INTO listing_state (source_url, item_id, sku, last_status, status_changed_at, last_seen_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (*_key(url, item_id, sku), status, now, now),
+            )
+        elif changed:
+            conn.execute(
+                "UPDATE listing_state SET last_status=?, status_changed_at=?, last_seen_at=?, "
+                "changes=COALESCE(changes, 0) + 1 WHERE source_url=? AND item_id=? AND sku=?",
+                (status, now, now, *_key(url, item_id, sku)),
+            )
+        else:
+            conn.execute(
+                "UPDATE listing_state SET last_seen_at=? WHERE source_url=? AND item_id=? AND sku=?",
+                (now, *_key(url, item_id, sku)),
+            )
+        _stats["observed"] += 1
+        if changed:
+            _stats["changed"] += 1
+        _maybe_commit(conn)
+    return changed
+
+
+def _zeroed(st) -> bool:
+    """已成功推过 0，且之后状态没变"""
+    return (bool(st["last_push_ok"]) and st["last_qty"] == 0
+            and (st["last_push_at"] or 0) >= (st["status_changed_at"] or 0))
+
+
+def next_check_at(st) -> float:
+    """
+    根据状态历史给出下次该检查的时间（epoch 秒）：
+    - 从没检查出过结果 / 最近变过状态 / 库存紧张 → 最短间隔（默认每轮都查）
+    - 已清零且状态没变 → RECHECK_ZEROED_MINUTES
+    - 其它稳定商品 → 稳定越久查得越少，历史上变化越多查得越勤，最长 RECHECK_MAX_MINUTES
+    """
+    if st is None or not st["last_seen_at"]:
+        return 0.0
+    now = time.time()
+    min_s = max(0, _env_int("RECHECK_MIN_MINUTES", 0)) * 60
+    max_s = max(min_s, _env_int("RECHECK_MAX_MINUTES", 360) * 60)
+    stable_s = max(0.0, now - (st["status_changed_at"] or now))
+
+    if st["last_status"] in _HOT_STATUSES or stable_s < _env_float("RECHECK_HOT_HOURS", 24) * 3600:
+        interval = min_s
+    elif _zeroed(st):
+        interval = max(min_s, _env_int("RECHECK_ZEROED_MINUTES", 720) * 60)
+    else:
+        factor = _env_float("RECHECK_STABLE_FACTOR", 0.1)
+        interval = stable_s * factor / (1 + (st["changes"] or 0))
+        interval = min(max_s, max(min_s, interval))
+    return st["last_seen_at"] + interval
+
+
+def is_due(url, item_id, sku) -> bool:
+    """本轮是否需要检查这一行；关闭 STATE_STORE 或 RECHECK_ADAPTIVE 时永远返回 True。"""
+    if not enabled() or os.getenv("RECHECK_ADAPTIVE", "true").strip().lower() != "true":
+        return True
+    due = next_check_at(get(url, item_id, sku)) <= time.time()
+    if not due:
+        with _lock:
+            _stats["deferred"] += 1
+    return due
+
+
+def needs_push(url, item_id, sku, quantity: int = 0) -> bool:
+    """
+    是否需要真的调用 eBay：
+    - 上次成功推过同样的库存，且之后状态没有变化 → 不需要（除非超过 STATE_REZERO_HOURS）
+    - 其它情况（没推过 / 推失败 / 状态变过 / 库存不同）→ 需要
+    """
+    if not enabled():
+        return True
+    st = get(url, item_id, sku)
+    if st is None or not st["last_push_ok"] or st["last_qty"] != quantity:
+        return True
+    if not _zeroed(st):
+        return True
+    rezero_h = _env_int("STATE_REZERO_HOURS", 24)
+    if rezero_h > 0 and time.time() - st["last_push_at"] >= rezero_h * 3600:
+        return True
+    with _lock:
+        _stats["skipped"] += 1
+    return False
+
+
+def record_push(url, item_id, sku, quantity: int, ok: bool):
+    """记录一次 eBay 库存推送结果；失败时不覆盖 last_qty，下一轮会重试。"""
+    if not enabled():
+        return
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        if ok:
+            conn.execute(
+                "INSERT INTO listing_state (source_url, item_id, sku, last_qty, last_push_at, last_push_ok) "
+                "VALUES (?, ?, ?, ?, ?, 1) "
+                "ON CONFLICT(source_url, item_id, sku) DO UPDATE SET "
+                "last_qty=excluded.last_qty, last_push_at=excluded.last_push_at, last_push_ok=1",
+                (*_key(url, item_id, sku), quantity, now),
+            )
+        else:
+            conn.execute(
+                "UPDATE listing_state SET last_push_ok=0 WHERE source_url=? AND item_id=? AND sku=?",
+                _key(url, item_id, sku),
+            )
+        _stats["pushed"] += 1
+        _maybe_commit(conn)
+
+
+def flush():
+    """提交尚未落盘的写入。"""
+    global _dirty
+    with _lock:
+        if _conn is not None:
+            _conn.commit()
+        _dirty = 0
+
+
+def close():
+    global _conn, _conn_path
+    with _lock:
+        if _conn is not None:
+            try:
+                _conn.commit()
+                _conn.close()
+            except Exception:
+                pass
+        _conn, _conn_path = None, None
+
+
+def report(tag: str = "[STATE]"):
+    """提交写入、打印本轮统计并清零（每个 run_once 结束时调用一次）。"""
+    flush()
+    if enabled() and any(_stats.values()):
+        print(
+            f"{tag} observed={_stats['observed']} changed={_stats['changed']} "
+            f"deferred={_stats['deferred']} skipped_push={_stats['skipped']} pushed={_stats['pushed']}"
+        )
+    _stats.update({"observed": 0, "changed": 0, "skipped": 0, "pushed": 0, "deferred": 0})